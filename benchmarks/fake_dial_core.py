@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from benchmarks.scenarios import APP_NAME, BUCKET, SCENARIOS, STORED_FILES, Scenario
+
+_FINAL_ANSWER = (
+    "Based on the results of the tools, here is the answer. The plate should be removed and washed in warm soapy "
+    "water, then dried thoroughly before it is put back. Top sale for category A is 1700 on 2025-10-05."
+)
+_ARGUMENTS_FRAGMENT_CHARS = 16
+
+
+@dataclass
+class LLMLatency:
+    """Simulated latency of a model: time to first token and delay between streamed chunks"""
+    time_to_first_token: float = 0.3
+    inter_chunk: float = 0.01
+    chars_per_chunk: int = 8
+
+
+def create_fake_dial_core(latency: LLMLatency) -> FastAPI:
+    """
+    Stand-in for DIAL Core: OpenAI-compatible streaming chat completions that replay scripted scenarios (see
+    `Scenario`) and file storage with files from `STORED_FILES`, uploads are kept in memory.
+    """
+    app = FastAPI()
+    uploads: dict[str, bytes] = {}
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request) -> StreamingResponse:
+        body = await request.json()
+        return StreamingResponse(
+            _stream_completion(deployment, body, latency),
+            media_type="text/event-stream",
+        )
+
+    @app.get("/v1/bucket")
+    async def bucket() -> dict[str, str]:
+        return {"bucket": BUCKET, "appdata": f"{BUCKET}/appdata/{APP_NAME}"}
+
+    @app.get("/v1/metadata/files/{bucket}/{path:path}")
+    async def metadata(bucket: str, path: str) -> JSONResponse:
+        content = _read_file(uploads, path)
+        if content is None:
+            return JSONResponse({"message": "Not found"}, status_code=404)
+        return JSONResponse(_file_metadata(bucket, path, content))
+
+    @app.get("/v1/files/{bucket}/{path:path}")
+    async def download(bucket: str, path: str) -> Response:
+        content = _read_file(uploads, path)
+        if content is None:
+            return JSONResponse({"message": "Not found"}, status_code=404)
+        return Response(content, media_type="application/octet-stream")
+
+    @app.put("/v1/files/{bucket}/{path:path}")
+    async def upload(bucket: str, path: str, request: Request) -> JSONResponse:
+        # Multipart body is stored as is, its content is not inspected by the agent
+        content = await request.body()
+        uploads[path] = content
+        return JSONResponse(_file_metadata(bucket, path, content))
+
+    return app
+
+
+def _read_file(uploads: dict[str, bytes], path: str) -> bytes | None:
+    if path in uploads:
+        return uploads[path]
+    stored = STORED_FILES.get(path)
+    return stored.read_bytes() if stored else None
+
+
+def _file_metadata(bucket: str, path: str, content: bytes) -> dict[str, Any]:
+    return {
+        "name": path.rsplit('/', 1)[-1],
+        "parentPath": path.rsplit('/', 1)[0] if '/' in path else None,
+        "bucket": bucket,
+        "url": f"files/{bucket}/{path}",
+        "nodeType": "ITEM",
+        "resourceType": "FILE",
+        "contentLength": len(content),
+        "etag": hashlib.md5(content).hexdigest(),
+    }
+
+
+def _find_scenario(messages: list[dict[str, Any]]) -> tuple[Scenario | None, int]:
+    """Return scenario of conversation and number of tool call rounds already made after the last user message"""
+    rounds_done = 0
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content") or ""
+            for scenario in SCENARIOS.values():
+                if scenario.marker in content:
+                    return scenario, rounds_done
+            return None, rounds_done
+        if message.get("role") == "assistant" and message.get("tool_calls"):
+            rounds_done += 1
+    return None, rounds_done
+
+
+async def _stream_completion(deployment: str, body: dict[str, Any], latency: LLMLatency) -> AsyncIterator[str]:
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+
+    def chunk(delta: dict[str, Any], finish_reason: str | None = None) -> str:
+        return "data: " + json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": deployment,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }) + "\n\n"
+
+    await asyncio.sleep(latency.time_to_first_token)
+    scenario, rounds_done = _find_scenario(body.get("messages", []))
+    tools_allowed = bool(body.get("tools")) and body.get("tool_choice") != "none"
+    if scenario and tools_allowed and rounds_done < len(scenario.rounds):
+        for index, tool_call in enumerate(scenario.rounds[rounds_done]):
+            yield chunk({
+                "role": "assistant",
+                "tool_calls": [{
+                    "index": index,
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": tool_call.name, "arguments": ""},
+                }],
+            })
+            arguments = json.dumps(tool_call.arguments)
+            for start in range(0, len(arguments), _ARGUMENTS_FRAGMENT_CHARS):
+                await asyncio.sleep(latency.inter_chunk)
+                yield chunk({
+                    "tool_calls": [{
+                        "index": index,
+                        "function": {"arguments": arguments[start:start + _ARGUMENTS_FRAGMENT_CHARS]},
+                    }],
+                })
+        yield chunk({}, finish_reason="tool_calls")
+    else:
+        for start in range(0, len(_FINAL_ANSWER), latency.chars_per_chunk):
+            if start:
+                await asyncio.sleep(latency.inter_chunk)
+            yield chunk({"role": "assistant", "content": _FINAL_ANSWER[start:start + latency.chars_per_chunk]})
+        yield chunk({}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
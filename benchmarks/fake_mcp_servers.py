@@ -0,0 +1,80 @@
+import asyncio
+import base64
+import json
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from mcp.server.fastmcp import FastMCP
+from starlette.applications import Starlette
+
+# 1x1 transparent PNG, returned as a chart produced by the interpreter
+_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+_SEARCH_RESULT = (
+    "1. How to clean a microwave plate - Remove the turntable and wash it in warm soapy water.\n"
+    "   URL: https://example.com/microwave-cleaning\n"
+)
+_PAGE_CONTENT = "Microwave cleaning guide. " * 200
+
+
+@dataclass
+class MCPLatency:
+    """Simulated latency of MCP tools"""
+    search: float = 0.5
+    fetch_content: float = 0.3
+    execute_code: float = 0.2
+
+
+def create_search_server(latency: MCPLatency) -> Starlette:
+    """Stand-in for DuckDuckGo MCP server with `search` and `fetch_content` tools"""
+    server = FastMCP("bench-search")
+
+    @server.tool()
+    async def search(query: str, max_results: int = 10) -> str:
+        """Search the web"""
+        await asyncio.sleep(latency.search)
+        return f"Found results for `{query}`:\n{_SEARCH_RESULT * min(max_results, 10)}"
+
+    @server.tool()
+    async def fetch_content(url: str) -> str:
+        """Fetch and parse content of a web page"""
+        await asyncio.sleep(latency.fetch_content)
+        return _PAGE_CONTENT
+
+    return server.streamable_http_app()
+
+
+def create_interpreter_server(latency: MCPLatency) -> Starlette:
+    """
+    Stand-in for Python code interpreter MCP server. Responses follow its `ExecutionResult` model, code containing
+    `plot` produces a PNG file that is read back as MCP resource.
+    """
+    server = FastMCP("bench-interpreter")
+
+    @server.tool()
+    async def execute_code(code: str, session_id: Optional[str] = None) -> str:
+        """Execute Python code in a stateful Jupyter kernel"""
+        await asyncio.sleep(latency.execute_code)
+        session_id = session_id or uuid.uuid4().hex[:8]
+        files = []
+        if 'plot' in code:
+            files.append({
+                "uri": f"bench://files/{session_id}/chart.png",
+                "mime_type": "image/png",
+                "name": "chart.png",
+                "size": len(_PNG),
+            })
+        return json.dumps({
+            "success": True,
+            "output": ["count 10.0\nmean 1234.5"],
+            "files": files,
+            "session_info": {"session_id": session_id},
+        })
+
+    @server.resource("bench://files/{session_id}/{name}", mime_type="image/png")
+    async def session_file(session_id: str, name: str) -> bytes:
+        return _PNG
+
+    return server.streamable_http_app()
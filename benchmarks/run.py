@@ -0,0 +1,366 @@
+"""
+Offline benchmark of the agent: DIAL Core (orchestration model, file storage) and MCP servers are replaced with local
+stand-ins with simulated latency, so only the agent itself is measured.
+
+    python -m benchmarks.run --scenarios rag,extraction,interpreter,multi_tool --requests 100 --concurrency 16
+
+For each scenario it reports requests per second, p50/p99 latency and time to first token, event loop lag of the
+agent and p50/p99 of the agent spans (see `task.utils.tracing`). Exits with code 1 if event loop of the agent was
+blocked for longer than `--max-loop-lag-ms`, so blocking calls in async code are caught as regressions, or if any
+request or tool call failed.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+import uvicorn
+
+from benchmarks.fake_dial_core import LLMLatency, create_fake_dial_core
+from benchmarks.fake_mcp_servers import MCPLatency, create_interpreter_server, create_search_server
+from benchmarks.scenarios import APP_NAME, SCENARIOS, Scenario, file_url
+
+_HOST = '127.0.0.1'
+_LOOP_LAG_INTERVAL_SECONDS = 0.01
+_SERVER_START_TIMEOUT_SECONDS = 30.0
+_REQUEST_TIMEOUT = httpx.Timeout(timeout=300.0, connect=5.0)
+
+
+@dataclass
+class ScenarioResult:
+    scenario: str
+    requests: int
+    # Failed requests and failed tool calls, tool failures are returned to LLM as tool messages and don't fail requests
+    errors: int
+    tool_errors: int
+    duration_seconds: float
+    requests_per_second: float
+    latency_p50_ms: float
+    latency_p99_ms: float
+    ttft_p50_ms: float
+    ttft_p99_ms: float
+    loop_lag_p99_ms: float
+    loop_lag_max_ms: float
+    spans: dict[str, dict[str, float]] = field(default_factory=dict)
+
+
+@dataclass
+class _LoadResult:
+    latencies: list[float] = field(default_factory=list)
+    ttfts: list[float] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+    duration: float = 0.0
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a sleeping task, any lag above a few ms means the loop was blocked"""
+
+    def __init__(self, interval: float = _LOOP_LAG_INTERVAL_SECONDS):
+        self.interval = interval
+        self.lags: list[float] = []
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - expected))
+
+    def reset(self) -> None:
+        self.lags = []
+
+
+class _ServersThread(threading.Thread):
+    """Runs uvicorn servers (and optional background coroutines) in a separate thread with its own event loop"""
+
+    def __init__(
+            self,
+            name: str,
+            apps: list[tuple[Any, int]],
+            background: Optional[list[Callable[[], Awaitable]]] = None,
+    ):
+        super().__init__(name=name, daemon=True)
+        self.servers = [
+            uvicorn.Server(uvicorn.Config(app, host=_HOST, port=port, log_level='warning', lifespan='on'))
+            for app, port in apps
+        ]
+        self.background = background or []
+
+    def run(self) -> None:
+        asyncio.run(self._serve())
+
+    async def _serve(self) -> None:
+        tasks = [asyncio.create_task(coroutine()) for coroutine in self.background]
+        await asyncio.gather(*(server.serve() for server in self.servers))
+        for task in tasks:
+            task.cancel()
+
+    def wait_started(self) -> None:
+        deadline = time.monotonic() + _SERVER_START_TIMEOUT_SECONDS
+        while not all(server.started for server in self.servers):
+            if time.monotonic() > deadline or not self.is_alive():
+                raise RuntimeError(f"{self.name} servers didn't start")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        for server in self.servers:
+            server.should_exit = True
+        self.join(timeout=_SERVER_START_TIMEOUT_SECONDS)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((_HOST, 0))
+        return sock.getsockname()[1]
+
+
+def _serve_stand_ins(ports: tuple[int, int, int], llm_latency: LLMLatency, mcp_latency: MCPLatency) -> None:
+    core_port, search_port, interpreter_port = ports
+    stand_ins = _ServersThread('stand-ins', [
+        (create_fake_dial_core(llm_latency), core_port),
+        (create_search_server(mcp_latency), search_port),
+        (create_interpreter_server(mcp_latency), interpreter_port),
+    ])
+    stand_ins.run()
+
+
+def _wait_port(port: int) -> None:
+    deadline = time.monotonic() + _SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            if sock.connect_ex((_HOST, port)) == 0:
+                return
+        time.sleep(0.05)
+    raise RuntimeError(f"Server on port {port} didn't start")
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percentile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _request_body(scenario: Scenario) -> dict[str, Any]:
+    message: dict[str, Any] = {"role": "user", "content": f"{scenario.marker} {scenario.prompt}"}
+    if scenario.attachments:
+        message["custom_content"] = {
+            "attachments": [{"url": file_url(name), "title": name} for name in scenario.attachments]
+        }
+    return {"messages": [message], "stream": True}
+
+
+async def _run_conversation(client: httpx.AsyncClient, url: str, scenario: Scenario) -> tuple[float, Optional[float]]:
+    """Send one request and return its latency and time to first content token, raise on error"""
+    started = time.perf_counter()
+    first_token: Optional[float] = None
+    headers = {"api-key": "bench", "x-conversation-id": uuid.uuid4().hex}
+    async with client.stream("POST", url, json=_request_body(scenario), headers=headers) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {(await response.aread())[:200]!r}")
+        async for line in response.aiter_lines():
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            chunk = json.loads(line[len("data: "):])
+            if "error" in chunk:
+                raise RuntimeError(chunk["error"])
+            if first_token is None:
+                for choice in chunk.get("choices", []):
+                    if (choice.get("delta") or {}).get("content"):
+                        first_token = time.perf_counter() - started
+    return time.perf_counter() - started, first_token
+
+
+async def _drive_load(url: str, scenario_name: str, requests: int, concurrency: int) -> _LoadResult:
+    scenario = SCENARIOS[scenario_name]
+    result = _LoadResult()
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def one(client: httpx.AsyncClient) -> None:
+        async with semaphore:
+            try:
+                latency, ttft = await _run_conversation(client, url, scenario)
+                result.latencies.append(latency)
+                if ttft is not None:
+                    result.ttfts.append(ttft)
+            except Exception as e:
+                result.errors.append(repr(e))
+
+    async with httpx.AsyncClient(timeout=_REQUEST_TIMEOUT, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client) for _ in range(requests)))
+        result.duration = time.perf_counter() - started
+    return result
+
+
+def _load_process(url: str, scenario_name: str, requests: int, concurrency: int) -> _LoadResult:
+    return asyncio.run(_drive_load(url, scenario_name, requests, concurrency))
+
+
+def run_scenario(
+        load_executor: Executor,
+        url: str,
+        scenario: Scenario,
+        requests: int,
+        concurrency: int,
+        warmup: int,
+        loop_lag: LoopLagMonitor,
+) -> ScenarioResult:
+    """
+    Run scenario load from a separate process, so the load generator doesn't compete with the agent for GIL and event
+    loop lag reflects the agent only
+    """
+    from task.utils.tracing import get_span_exporter
+
+    if warmup:
+        # Warm-up requests create tools, load models and fill caches, they are not measured
+        load_executor.submit(_load_process, url, scenario.name, warmup, concurrency).result()
+    get_span_exporter().clear()
+    loop_lag.reset()
+    load = load_executor.submit(_load_process, url, scenario.name, requests, concurrency).result()
+    lags = list(loop_lag.lags)
+    if load.errors:
+        print(f"{scenario.name}: {len(load.errors)} errors, first one: {load.errors[0]}", file=sys.stderr)
+
+    spans: dict[str, list[float]] = {}
+    for finished in get_span_exporter().get_finished_spans():
+        spans.setdefault(finished.name, []).append(finished.duration_seconds)
+    tool_errors = [finished for finished in get_span_exporter().get_finished_spans("tool.call") if finished.is_error]
+    if tool_errors:
+        first = tool_errors[0]
+        print(
+            f"{scenario.name}: {len(tool_errors)} tool call errors, first one: "
+            f"{first.attributes.get('tool')}: {first.error}",
+            file=sys.stderr,
+        )
+    return ScenarioResult(
+        scenario=scenario.name,
+        requests=requests,
+        errors=len(load.errors) + len(tool_errors),
+        tool_errors=len(tool_errors),
+        duration_seconds=round(load.duration, 3),
+        requests_per_second=round(len(load.latencies) / load.duration, 2) if load.duration else 0.0,
+        latency_p50_ms=round(_percentile(load.latencies, 50) * 1000, 1),
+        latency_p99_ms=round(_percentile(load.latencies, 99) * 1000, 1),
+        ttft_p50_ms=round(_percentile(load.ttfts, 50) * 1000, 1),
+        ttft_p99_ms=round(_percentile(load.ttfts, 99) * 1000, 1),
+        loop_lag_p99_ms=round(_percentile(lags, 99) * 1000, 1),
+        loop_lag_max_ms=round(max(lags, default=0.0) * 1000, 1),
+        spans={
+            name: {
+                "count": len(durations),
+                "p50_ms": round(_percentile(durations, 50) * 1000, 1),
+                "p99_ms": round(_percentile(durations, 99) * 1000, 1),
+            }
+            for name, durations in sorted(spans.items())
+        },
+    )
+
+
+def _print_report(results: list[ScenarioResult]) -> None:
+    columns = (
+        ("scenario", 12), ("requests", 9), ("errors", 7), ("tool err", 9), ("rps", 8), ("p50 ms", 9), ("p99 ms", 9),
+        ("ttft p50", 9), ("ttft p99", 9), ("lag p99", 8), ("lag max", 8),
+    )
+    print("".join(title.ljust(width) for title, width in columns))
+    for result in results:
+        values = (
+            result.scenario, result.requests, result.errors, result.tool_errors, result.requests_per_second, result.latency_p50_ms,
+            result.latency_p99_ms, result.ttft_p50_ms, result.ttft_p99_ms, result.loop_lag_p99_ms,
+            result.loop_lag_max_ms,
+        )
+        print("".join(str(value).ljust(width) for value, (_, width) in zip(values, columns)))
+    for result in results:
+        print(f"\n{result.scenario} spans (count, p50 ms, p99 ms):")
+        for name, stats in result.spans.items():
+            print(f"  {name.ljust(28)} {stats['count']:>6} {stats['p50_ms']:>10} {stats['p99_ms']:>10}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=50, help="Measured requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8, help="Conversations in flight")
+    parser.add_argument('--warmup', type=int, default=1, help="Not measured requests per scenario")
+    parser.add_argument('--llm-ttft-ms', type=float, default=300.0)
+    parser.add_argument('--llm-inter-chunk-ms', type=float, default=10.0)
+    parser.add_argument('--search-latency-ms', type=float, default=500.0)
+    parser.add_argument('--interpreter-latency-ms', type=float, default=200.0)
+    parser.add_argument('--max-loop-lag-ms', type=float, default=100.0,
+                        help="Max allowed event loop lag of the agent, exceeding it fails the benchmark")
+    parser.add_argument('--json', dest='json_path', help="Write results as JSON to this file")
+    args = parser.parse_args()
+    scenarios = [SCENARIOS[name.strip()] for name in args.scenarios.split(',')]
+
+    llm_latency = LLMLatency(time_to_first_token=args.llm_ttft_ms / 1000, inter_chunk=args.llm_inter_chunk_ms / 1000)
+    mcp_latency = MCPLatency(
+        search=args.search_latency_ms / 1000,
+        fetch_content=args.search_latency_ms / 1000,
+        execute_code=args.interpreter_latency_ms / 1000,
+    )
+    stand_in_ports = (_free_port(), _free_port(), _free_port())
+    core_port, search_port, interpreter_port = stand_in_ports
+    agent_port = _free_port()
+    spawn = multiprocessing.get_context('spawn')
+    stand_ins = spawn.Process(
+        target=_serve_stand_ins, args=(stand_in_ports, llm_latency, mcp_latency), name='stand-ins', daemon=True
+    )
+    stand_ins.start()
+    agent: Optional[_ServersThread] = None
+    try:
+        for port in stand_in_ports:
+            _wait_port(port)
+
+        # Agent settings are read on import, so environment is set before `task.app` is imported
+        os.environ['DIAL_ENDPOINT'] = f"http://{_HOST}:{core_port}"
+        os.environ['WEB_SEARCH_MCP_URL'] = f"http://{_HOST}:{search_port}/mcp"
+        os.environ['PYTHON_INTERPRETER_MCP_URL'] = f"http://{_HOST}:{interpreter_port}/mcp"
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        from task.app import dial_app
+
+        loop_lag = LoopLagMonitor()
+        agent = _ServersThread('agent', [(dial_app, agent_port)], background=[loop_lag.run])
+        agent.start()
+        agent.wait_started()
+        url = f"http://{_HOST}:{agent_port}/openai/deployments/{APP_NAME}/chat/completions"
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as load_executor:
+            results = [
+                run_scenario(load_executor, url, scenario, args.requests, args.concurrency, args.warmup, loop_lag)
+                for scenario in scenarios
+            ]
+    finally:
+        if agent:
+            agent.stop()
+        stand_ins.terminate()
+        stand_ins.join()
+
+    _print_report(results)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+    blocked = [result for result in results if result.loop_lag_max_ms > args.max_loop_lag_ms]
+    for result in blocked:
+        print(
+            f"\n⚠️ Event loop of the agent was blocked for {result.loop_lag_max_ms} ms in `{result.scenario}` "
+            f"scenario (max allowed {args.max_loop_lag_ms} ms)",
+            file=sys.stderr,
+        )
+    failed = [result for result in results if result.errors]
+    return 1 if blocked or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
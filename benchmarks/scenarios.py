@@ -0,0 +1,88 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+BUCKET = 'bench-bucket'
+APP_NAME = 'general-purpose-agent'
+_TESTS_DIR = Path(__file__).resolve().parent.parent / 'tests'
+
+# Files served by fake DIAL storage: `files/{BUCKET}/{name}` -> path of content on disk
+STORED_FILES: dict[str, Path] = {
+    'microwave_manual.txt': _TESTS_DIR / 'microwave_manual.txt',
+    'report.csv': _TESTS_DIR / 'report.csv',
+}
+
+
+def file_url(name: str) -> str:
+    return f"files/{BUCKET}/{name}"
+
+
+@dataclass(frozen=True)
+class ScriptedToolCall:
+    name: str
+    arguments: dict[str, Any]
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """
+    Conversation replayed by fake orchestration model. Each round is a list of tool calls streamed in one response,
+    after the last round model streams the final answer.
+    """
+    name: str
+    prompt: str
+    rounds: list[list[ScriptedToolCall]]
+    attachments: list[str] = field(default_factory=list)
+
+    @property
+    def marker(self) -> str:
+        # Fake model recognizes the scenario by this marker in user message
+        return f"[bench:{self.name}]"
+
+
+SCENARIOS: dict[str, Scenario] = {
+    scenario.name: scenario for scenario in (
+        Scenario(
+            name='rag',
+            prompt='How should I clean the plate?',
+            attachments=['microwave_manual.txt'],
+            rounds=[[
+                ScriptedToolCall('rag_tool', {
+                    'request': 'How should I clean the plate?',
+                    'file_url': file_url('microwave_manual.txt'),
+                }),
+            ]],
+        ),
+        Scenario(
+            name='extraction',
+            prompt='What is top sale for category A?',
+            attachments=['report.csv'],
+            rounds=[[
+                ScriptedToolCall('file_content_extractor', {'file_url': file_url('report.csv')}),
+            ]],
+        ),
+        Scenario(
+            name='interpreter',
+            prompt='Calculate statistics of sales and plot them',
+            rounds=[
+                [ScriptedToolCall('execute_code', {'code': 'df.describe()'})],
+                [ScriptedToolCall('execute_code', {'code': 'plot(df)'})],
+            ],
+        ),
+        Scenario(
+            name='multi_tool',
+            prompt='Find microwave cleaning tips online and compare them with the manual',
+            attachments=['microwave_manual.txt'],
+            rounds=[
+                [
+                    ScriptedToolCall('search', {'query': 'microwave plate cleaning', 'max_results': 5}),
+                    ScriptedToolCall('rag_tool', {
+                        'request': 'How should I clean the plate?',
+                        'file_url': file_url('microwave_manual.txt'),
+                    }),
+                ],
+                [ScriptedToolCall('fetch_content', {'url': 'https://example.com/microwave-cleaning'})],
+            ],
+        ),
+    )
+}
@@ -1,16 +1,56 @@
 import asyncio
+import contextvars
 import json
+import time
+from dataclasses import dataclass, field
 from typing import Any
 
 from aidial_client import AsyncDial
 from aidial_client.types.chat.legacy.chat_completion import CustomContent, ToolCall
 from aidial_sdk.chat_completion import Message, Role, Choice, Request, Response
+from pydantic import StrictStr
 
 from task.tools.base import BaseTool
 from task.tools.models import ToolCallParams
 from task.utils.constants import TOOL_CALL_HISTORY_KEY
+from task.utils.dial_clients import get_async_dial_client
 from task.utils.history import unpack_messages
+from task.utils.logger import Lazy, get_logger, messages_summary
 from task.utils.stage import StageProcessor
+from task.utils.tokens import count_tokens
+from task.utils.tool_call_assembler import ToolCallAssembler, parse_arguments
+from task.utils.tracing import record_span, span
+
+DEFAULT_MAX_ITERATIONS = 10
+DEFAULT_MAX_DURATION_SECONDS = 300.0
+# Final message when budget is exhausted and the model still answers with tool calls only
+BUDGET_EXHAUSTED_MESSAGE = (
+    "I couldn't finish the answer within the time and tool call limits of this request. "
+    "Please ask again, possibly with a narrower question."
+)
+
+_log = get_logger(__name__)
+
+
+@dataclass
+class RequestState:
+    """
+    State of a single request. `messages` is unpacked conversation history sent to the model, it is built once per
+    request and then only new assistant and tool messages are appended. `tool_call_history` is 'hidden' in choice
+    state, so the full conversation history is preserved between requests.
+    """
+    messages: list[dict[str, Any]]
+    tool_call_history: list[dict[str, Any]] = field(default_factory=list)
+    iterations: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def append(self, *messages: dict[str, Any]) -> None:
+        self.messages.extend(messages)
+        self.tool_call_history.extend(messages)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
 
 
 class GeneralPurposeAgent:
@@ -20,135 +60,212 @@ class GeneralPurposeAgent:
             endpoint: str,
             system_prompt: str,
             tools: list[BaseTool],
+            max_iterations: int = DEFAULT_MAX_ITERATIONS,
+            max_duration_seconds: float = DEFAULT_MAX_DURATION_SECONDS,
+            history_token_budget: int | None = None,
     ):
         # 1. Set variables: endpoint, system_prompt, tools
         # 2. Prepare tools_dict where key will be tool name and vale tool itself. It will help us to find tool faster
         #    on the tool call step
-        # 3. Create dict with `state` name. Inside this dict we need to add `TOOL_CALL_HISTORY_KEY` with empty array.
-        #    Here, in state, we will 'hide' tool call history. We need it since we need to preserve full conversation history.
+        # 3. Set budget of request: max number of tool call rounds and max duration. When budget is exhausted model
+        #    is asked for the final answer without tools
+        # 4. Set history_token_budget, if set then conversation history is windowed to fit into it
+        # State is created per request (see `RequestState`), so agent instance can be safely reused between requests.
         self.endpoint = endpoint
         self.system_prompt = system_prompt
         self.tolls_dict = {}
         for tool in tools:
             self.tolls_dict[tool.name] = tool
-        self.state = {TOOL_CALL_HISTORY_KEY: []}
+        self.max_iterations = max_iterations
+        self.max_duration_seconds = max_duration_seconds
+        self.history_token_budget = history_token_budget
 
     async def handle_request(self, deployment_name: str, choice: Choice, request: Request,
                              response: Response) -> Message:
-        # 1. Create AsyncDial, don't forget to provide endpoint as base_url and api_key. Api_key you can take from `request` as well as api_version
+        # 1. Get AsyncDial with `get_async_dial_client` (it shares connection pool of the process), don't forget to provide endpoint as base_url and api_key. Api_key you can take from `request` as well as api_version
         #    JFI: while request you will get Per-request API key (not `dial_api_key` configured in Core config). Read
         #    more about it -> https://docs.dialx.ai/platform/core/per-request-keys
-        # 2. Create `chunks` with created AsyncDial client (chat -> completions -> create). Provide it with:
-        #    - messages: get messages from `request` and unpack them with `_prepare_messages` method
-        #    - tools: provide list with tool schemas
+        # 2. Create `RequestState` with messages from `request` unpacked with `_prepare_messages` method (only once)
+        # 3. Loop:
+        #   - if budget (`max_iterations` or `max_duration_seconds`) is exhausted then ask model for the final answer
+        #     with `tool_choice="none"` (tools are still provided since history contains tool calls)
+        #   - call `_stream_completion`, it streams model response and runs tool calls. The round is limited by the
+        #     time left in the budget, a round that runs out of it is cancelled and the final answer is requested
+        #   - if there are no tool calls then it's the 'final result' from orchestration model: set choice with
+        #     `state` and return `assistant_message`. If the final answer has no content (the model streamed only
+        #     tool calls that were dropped) then `BUDGET_EXHAUSTED_MESSAGE` is returned instead
+        #   - otherwise append `assistant_message` as dict (exclude none) and tool messages to the state and continue
+        client = get_async_dial_client(self.endpoint, api_key=request.api_key, api_version=request.api_version)
+        conversation_id = request.headers.get("x-conversation-id", "")
+        with span("agent.request", deployment=deployment_name) as request_span:
+            state = RequestState(messages=self._prepare_messages(request.messages))
+            tools = [tool.schema for tool in self.tolls_dict.values()]
+
+            timed_out = False
+            while True:
+                budget_exhausted = (
+                        timed_out
+                        or state.iterations >= self.max_iterations
+                        or state.elapsed >= self.max_duration_seconds
+                )
+                if budget_exhausted:
+                    _log.warning(
+                        "agent.budget_exhausted", iterations=state.iterations, elapsed_seconds=round(state.elapsed, 1)
+                    )
+                # Final answer is not limited, it is the only way to complete the request
+                round_timeout = asyncio.timeout(
+                    None if budget_exhausted else self.max_duration_seconds - state.elapsed
+                )
+                try:
+                    with span("agent.iteration", iteration=state.iterations + 1) as iteration_span:
+                        async with round_timeout:
+                            assistant_message, tool_messages = await self._stream_completion(
+                                client=client,
+                                deployment_name=deployment_name,
+                                messages=state.messages,
+                                tools=tools,
+                                allow_tool_calls=not budget_exhausted,
+                                choice=choice,
+                                api_key=request.api_key,
+                                conversation_id=conversation_id,
+                            )
+                        iteration_span.set_attribute("tool_calls", len(tool_messages))
+                except TimeoutError:
+                    if not round_timeout.expired():
+                        raise
+                    # Round is cancelled with its tool calls, nothing of it is added to history
+                    timed_out = True
+                    state.iterations += 1
+                    continue
+                state.iterations += 1
+                if not tool_messages or budget_exhausted:
+                    if budget_exhausted and not assistant_message.content:
+                        choice.append_content(BUDGET_EXHAUSTED_MESSAGE)
+                        assistant_message.content = StrictStr(BUDGET_EXHAUSTED_MESSAGE)
+                    request_span.set_attribute("iterations", state.iterations)
+                    choice.state = {TOOL_CALL_HISTORY_KEY: state.tool_call_history}
+                    return assistant_message
+                state.append(assistant_message.dict(exclude_none=True), *tool_messages)
+
+    async def _stream_completion(
+            self,
+            client: AsyncDial,
+            deployment_name: str,
+            messages: list[dict[str, Any]],
+            tools: list,
+            allow_tool_calls: bool,
+            choice: Choice,
+            api_key: str,
+            conversation_id: str,
+    ) -> tuple[Message, list[dict[str, Any]]]:
+        # 1. Create `chunks` with AsyncDial client (chat -> completions -> create). Provide it with:
+        #    - messages
+        #    - tools: provide list with tool schemas (and `tool_choice="none"` if tool calls are not allowed)
         #    - deployment_name
         #    - make it stream
-        # 3. Create:
-        #   - `tool_call_index_map` (it is empty dict), here we will collect tool calls by their indexes.
+        # 2. Create:
+        #   - `tool_call_assembler` (ToolCallAssembler), it collects tool call deltas by their own indexes.
         #      Take a look how tool call streaming output is looks like, it is important! -> https://platform.openai.com/docs/guides/function-calling#streaming
-        #   - `content`, here we will collect the content from streaming
-        # 4. Make async loop through `chunks` and then we need to collect content, tool calls and attachments:
+        #      Several tool calls in one response are streamed one after another with different `index`, and only
+        #      the first delta of each tool call has `id` and function `name`
+        #   - `content_parts`, here we will collect the content from streaming
+        #   - `tool_tasks`, tool calls are started as soon as their arguments JSON is complete, so slow tools run
+        #     while the model is still streaming the rest of the response
+        # 3. Make async loop through `chunks` and then we need to collect content, tool calls and attachments:
         #   - If chunk has `choices` then:
         #       - Get 1st choice `delta`
         #       - if delta is present:
         #           - if delta content is present then append this content to `choice` (it will be shown in DIAL Chat
-        #             choice), concat delta content to `content` variable
-        #           - if delta has tool_calls then:
-        #               - iterate through tool_calls:
-        #                   - if tool call has `id` (first chunk of tool call) then add to `tool_call_index_map` new
-        #                     tool_call_delta, key will be index and value tool call delta itself
-        #                   - otherwise: get by tool call delta `index` from the `tool_call_index_map` the tool call and
-        #                     then check if provided tool_call_delta contains `function`, if yes then you need to get from
-        #                     `function` `arguments` (if not present set them as empty string to not attach haphazardly None)
-        #                     as `argument_chunk` and add it to the extracted from map tool_call function arguments
-        # 5. Create `assistant_message`, with role, content and tool_calls. `tool_calls` should be a list with ToolCall
-        #    objects generated from `tool_call_index_map` dict values. to create ToolCall use `validate` method (it
-        #    will show you the notification that it is deprecated but we need to use it because DIAL SDK is built on top of pydentic.v1)
-        # 6. Now we at the point where we need to understand if its 'final result' from orchestration model or not:
-        #    check if `assistant_message` contains `tool_calls`, if yes then we need:
-        #       - create `tasks` list. Iterate through `tool_calls` and call `_process_tool_call` method (do not use
-        #         `await` since we will run tool calls execution asynchronously), also you need to provide `conversation_id`
-        #         you can get it in `request` headers, its name is `x-conversation-id`
-        #       - now `gather` tasks with `asyncio` (here you need to await)
-        #       - to the `state` to `TOOL_CALL_HISTORY_KEY` append `assistant_message` as dict and exclude none from this dict
-        #       - extend the `state` `TOOL_CALL_HISTORY_KEY` with tool_messages that we executed above
-        #       - finally make recursive call
-        # 7. We don't have any tool calls and reasy to finish user request. Set choice with `state` and return `assistant_message`
-        client = AsyncDial(
-            base_url=self.endpoint,
-            api_key=request.api_key,
-            api_version=request.api_version,
-        )
-        chunks = await client.chat.completions.create(
-            messages=self._prepare_messages(request.messages),
-            tools=[tool.schema for tool in self.tolls_dict.values()],
-            deployment_name=deployment_name,
-            stream=True
-        )
-        tool_call_index_map = {}
-        content = ""
-
-        async for chunk in chunks:
-            if chunk.choices:
-                delta = chunk.choices[0].delta
-                if delta:
-                    if delta.content:
-                        choice.append_content(delta.content)
-                        content += delta.content
-                    if delta.tool_calls:
-                        for tool_call_delta in delta.tool_calls:
-                            if tool_call_delta.id:
-                                tool_call_index_map[choice.index] = tool_call_delta
-                            else:
-                                tool_call = tool_call_index_map[choice.index]
-                                if tool_call_delta.function:
-                                    argument_chunk = tool_call_delta.function.arguments or ""
-                                    tool_call.function.arguments += argument_chunk
+        #             choice), append delta content to `content_parts`
+        #           - if delta has tool_calls then add each tool_call_delta to `tool_call_assembler` and start
+        #             `_process_tool_call` task for each tool call completed by this delta (if tool call was reopened
+        #             by `tool_call_assembler` then its previous task is cancelled)
+        #   - When stream is over finish `tool_call_assembler` and start tasks for remaining tool calls
+        #   - If tool calls are not allowed, tool calls the model still streams are never started
+        #   Completion is traced with `llm.completion` span, time to first content or tool call delta is recorded as
+        #   `llm.time_to_first_token` span
+        # 4. Create `assistant_message`, with role, content and tool_calls. `tool_calls` are ToolCall objects assembled
+        #    by `tool_call_assembler` (they are created with `validate` method, it will show you the notification that
+        #    it is deprecated but we need to use it because DIAL SDK is built on top of pydentic.v1). If tool calls are
+        #    not allowed the message is final and carries no tool calls
+        # 5. `gather` tool tasks with `asyncio` (results keep tool calls order) and return them with `assistant_message`
+        completion_kwargs = {} if allow_tool_calls else {"tool_choice": "none"}
+        tool_call_assembler = ToolCallAssembler()
+        content_parts: list[str] = []
+        tool_tasks: dict[int, asyncio.Task] = {}
+        # Tool calls are children of the agent iteration span, not of the LLM completion they are streamed by
+        tool_context = contextvars.copy_context()
+
+        def start_tool_calls(tool_calls: list[ToolCall]) -> None:
+            if not allow_tool_calls:
+                return
+            for tool_call in tool_calls:
+                if previous_task := tool_tasks.get(tool_call.index):
+                    previous_task.cancel()
+                tool_tasks[tool_call.index] = asyncio.create_task(
+                    self._process_tool_call(tool_call, choice, api_key, conversation_id),
+                    context=tool_context.copy(),
+                )
+
+        try:
+            with span("llm.completion", deployment=deployment_name, messages=len(messages)) as completion_span:
+                started = time.perf_counter()
+                chunks = await client.chat.completions.create(
+                    messages=messages,
+                    tools=tools,
+                    deployment_name=deployment_name,
+                    stream=True,
+                    **completion_kwargs,
+                )
+                first_token = True
+                async for chunk in chunks:
+                    if chunk.choices:
+                        delta = chunk.choices[0].delta
+                        if delta:
+                            if first_token and (delta.content or delta.tool_calls):
+                                first_token = False
+                                record_span("llm.time_to_first_token", started, deployment=deployment_name)
+                            if delta.content:
+                                choice.append_content(delta.content)
+                                content_parts.append(delta.content)
+                            if delta.tool_calls:
+                                for tool_call_delta in delta.tool_calls:
+                                    start_tool_calls(tool_call_assembler.add(tool_call_delta))
+                start_tool_calls(tool_call_assembler.finish())
+                completion_span.set_attribute("tool_calls", len(tool_tasks))
+        except BaseException:
+            for task in tool_tasks.values():
+                task.cancel()
+            raise
+
+        content = ''.join(content_parts)
+        tool_calls = tool_call_assembler.tool_calls
+        if tool_calls and not allow_tool_calls:
+            _log.warning("agent.tool_calls_dropped", tool_calls=len(tool_calls))
+            tool_calls = []
         assistant_message = Message(
             role=Role.ASSISTANT,
             content=content or None,
-            tool_calls=[
-                ToolCall.validate(tool_call)
-                for tool_call in tool_call_index_map.values()
-            ] if tool_call_index_map else None,
+            tool_calls=tool_calls or None,
         )
-        if assistant_message.tool_calls:
-            tasks = []
-            for tool_call in assistant_message.tool_calls:
-                conversation_id = request.headers.get("x-conversation-id", "")
-                tasks.append(
-                    self._process_tool_call(
-                        tool_call,
-                        choice,
-                        request.api_key,
-                        conversation_id,
-                    )
-                )
-            tool_messages = await asyncio.gather(*tasks)
-            self.state[TOOL_CALL_HISTORY_KEY].append(
-                assistant_message.dict(exclude_none=True)
-            )
-            self.state[TOOL_CALL_HISTORY_KEY].extend(tool_messages)
-            return await self.handle_request(
-                deployment_name,
-                choice,
-                request,
-                response,
-            )
-        choice.state = self.state
-        return assistant_message
+        tool_messages = list(await asyncio.gather(*(tool_tasks[index] for index in sorted(tool_tasks))))
+        return assistant_message, tool_messages
 
     def _prepare_messages(self, messages: list[Message]) -> list[dict[str, Any]]:
-        # 1. Unpack messages with `unpack_messages` method (it is implemented, just check the logic in this method)
+        # 1. Unpack messages with `unpack_messages` method (it is implemented, just check the logic in this method),
+        #    if `history_token_budget` is set then history is windowed into budget left after system prompt
         # 2. Insert as first message the `system_prompt` (probably you have a question why do we need to insert each
         #    call system prompt, the reason is simple - security, if people will know our system prompt then it will be
         #    easier to manipulate LLM, so, best practices are to hide system prompt)
-        # 3. Print history: iterate through unpacked messages and print as json (json.dumps)
+        # 3. Log history summary, full history is serialized only when debug logging is enabled
         # 4. Return unpacked messages
-        unpacked_messages = unpack_messages(messages, self.state[TOOL_CALL_HISTORY_KEY])
+        token_budget = None
+        if self.history_token_budget:
+            token_budget = max(0, self.history_token_budget - count_tokens(self.system_prompt))
+        unpacked_messages = unpack_messages(messages, [], token_budget=token_budget)
         unpacked_messages.insert(0, {"role": Role.SYSTEM, "content": self.system_prompt})
-        print("Conversation history:")
-        print(json.dumps(unpacked_messages, indent=2))
+        _log.info("agent.history", sampled=True, **messages_summary(unpacked_messages))
+        _log.debug("agent.history.payload", history=Lazy(lambda: json.dumps(unpacked_messages, default=str)))
         return unpacked_messages
 
     async def _process_tool_call(self, tool_call: ToolCall, choice: Choice, api_key: str, conversation_id: str) -> dict[
@@ -156,7 +273,8 @@ class GeneralPurposeAgent:
         # 1. Get tool name from tool_call function name
         # 2. Open Stage with StageProcessor (it will be shown in DIAL Chat and Stage serves in our case for
         #    tool call results representation)
-        # 3. Get tool from `_tools_dict` by tool name
+        # 3. Get tool from `_tools_dict` by tool name. If there is no such tool or arguments are not valid JSON then
+        #    return tool message with the error, so LLM is able to fix the call
         # 4. If tool show_in_stage is true then:
         #   - append content to stage "## Request arguments: \n"
         #   - append content to stage f"```json\n\r{json.dumps(json.loads(tool_call.function.arguments), indent=2)}\n\r```\n\r"
@@ -166,22 +284,42 @@ class GeneralPurposeAgent:
         # 6. Close stage with StageProcessor
         # 7. Return tool message as dict and don't forget to exclude none
         tool_name = tool_call.function.name
-        stage = StageProcessor.open_stage(choice, f"Executing tool: {tool_name}")
-        tool = self.tolls_dict.get(tool_name)
-        if tool.show_in_stage:
-            stage.append_content("## Request arguments: \n")
-            stage.append_content(
-                f"```json\n\r{json.dumps(json.loads(tool_call.function.arguments), indent=2)}\n\r```\n\r"
-            )
-            stage.append_content("## Response: \n")
-        tool_response = await tool.execute(
-            ToolCallParams(
-                tool_call=tool_call,
-                stage=stage,
-                choice=choice,
-                api_key=api_key,
-                conversation_id=conversation_id,
-            )
-        )
-        stage.close()
-        return tool_response.dict(exclude_none=True)
+        with span("tool.call", tool=tool_name) as tool_span:
+            stage = StageProcessor.open_stage(choice, f"Executing tool: {tool_name}")
+            tool = self.tolls_dict.get(tool_name)
+            arguments, error = parse_arguments(tool_call)
+            if tool is None:
+                error = f"Tool `{tool_name}` is not available. Available tools: {', '.join(self.tolls_dict)}"
+            if error:
+                tool_span.set_error(error)
+                stage.append_content(f"Error: {error}\n\r")
+                StageProcessor.close_stage_safely(stage)
+                return Message(
+                    role=Role.TOOL,
+                    name=StrictStr(tool_name),
+                    tool_call_id=StrictStr(tool_call.id),
+                    content=StrictStr(f"Error: {error}"),
+                ).dict(exclude_none=True)
+            if tool.show_in_stage:
+                stage.append_content("## Request arguments: \n")
+                stage.append_content(
+                    f"```json\n\r{json.dumps(arguments, indent=2)}\n\r```\n\r"
+                )
+                stage.append_content("## Response: \n")
+            try:
+                tool_response = await tool.execute(
+                    ToolCallParams(
+                        tool_call=tool_call,
+                        stage=stage,
+                        choice=choice,
+                        api_key=api_key,
+                        conversation_id=conversation_id,
+                    )
+                )
+            except asyncio.CancelledError:
+                # Tool call was dispatched early and then discarded, see `ToolCallAssembler`
+                stage.append_content("Cancelled.\n\r")
+                StageProcessor.close_stage_safely(stage)
+                raise
+            stage.close()
+            return tool_response.dict(exclude_none=True)
@@ -1,43 +1,161 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import Any, Optional
 
 import uvicorn
 from aidial_sdk import DIALApp
 from aidial_sdk.chat_completion import ChatCompletion, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
 
-from task.agent import GeneralPurposeAgent
+from task.agent import GeneralPurposeAgent, DEFAULT_MAX_ITERATIONS, DEFAULT_MAX_DURATION_SECONDS
 from task.prompts import SYSTEM_PROMPT
 from task.tools.base import BaseTool
 from task.tools.deployment.image_generation_tool import ImageGenerationTool
+from task.tools.files.extracted_text_cache import ExtractedTextCache
 from task.tools.files.file_content_extraction_tool import FileContentExtractionTool
 from task.tools.py_interpreter.python_code_interpreter_tool import PythonCodeInterpreterTool
-from task.tools.mcp.mcp_client import MCPClient
+from task.tools.mcp.mcp_client_pool import MCPClientPool
+from task.tools.mcp.mcp_result_cache import MCPResultCache, parse_tool_ttls
 from task.tools.mcp.mcp_tool import MCPTool
-from task.tools.rag.document_cache import DocumentCache
+from task.tools.rag.cache_backends import DiskDocumentCacheBackend
+from task.tools.rag.document_cache import DocumentCache, DEFAULT_MAX_BYTES
 from task.tools.rag.rag_tool import RagTool
+from task.tools.results.tool_result_fetch_tool import ToolResultFetchTool
+from task.utils.dial_clients import close_dial_clients, get_dial_client_registry
+from task.utils.executors import get_thread_executor, shutdown_executors
+from task.utils.logger import get_logger
+from task.utils.tool_result_store import get_tool_result_store
+from task.utils.tracing import get_span_metrics
 
 DIAL_ENDPOINT = os.getenv('DIAL_ENDPOINT', "http://localhost:8080")
+PYTHON_INTERPRETER_MCP_URL = os.getenv('PYTHON_INTERPRETER_MCP_URL', "http://localhost:8050/mcp")
+WEB_SEARCH_MCP_URL = os.getenv('WEB_SEARCH_MCP_URL', "http://localhost:8051/mcp")
 # DEPLOYMENT_NAME = os.getenv('DEPLOYMENT_NAME', 'gpt-4o')
 
 
 DEPLOYMENT_NAME = os.getenv('DEPLOYMENT_NAME', 'claude-sonnet-3-7')
 
+# Budget of a single request: max number of LLM rounds with tool calls and max duration in seconds
+AGENT_MAX_ITERATIONS = int(os.getenv('AGENT_MAX_ITERATIONS', DEFAULT_MAX_ITERATIONS))
+AGENT_MAX_DURATION_SECONDS = float(os.getenv('AGENT_MAX_DURATION_SECONDS', DEFAULT_MAX_DURATION_SECONDS))
+# Token budget of conversation history sent to LLM (system prompt included), older tool exchanges are summarised and
+# oldest turns are dropped to fit into it. 0 disables windowing
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', 0))
+
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv('DOCUMENT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+# Directory for entries evicted from memory, if not set evicted entries are dropped
+DOCUMENT_CACHE_SPILL_DIR = os.getenv('DOCUMENT_CACHE_SPILL_DIR')
+# Write each indexed document to DOCUMENT_CACHE_SPILL_DIR right away, so indexes survive restarts
+DOCUMENT_CACHE_PERSISTENT = os.getenv('DOCUMENT_CACHE_PERSISTENT', 'false').lower() == 'true'
+# Number of most recent stored indexes loaded into memory on startup
+DOCUMENT_CACHE_WARM_UP_ENTRIES = int(os.getenv('DOCUMENT_CACHE_WARM_UP_ENTRIES', 0))
+
+# Idempotent MCP tools whose results are cached, comma separated `tool_name[:ttl_seconds]`, e.g. `search:300,fetch_content`.
+# Never add stateful tools here (code interpreter)
+MCP_CACHED_TOOLS = os.getenv('MCP_CACHED_TOOLS', '')
+MCP_RESULT_CACHE_MAX_BYTES = int(os.getenv('MCP_RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+EXTRACTED_TEXT_CACHE_MAX_BYTES = int(os.getenv('EXTRACTED_TEXT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+EXTRACTED_TEXT_CACHE_TTL_SECONDS = int(os.getenv('EXTRACTED_TEXT_CACHE_TTL_SECONDS', 3600))
+
+_log = get_logger(__name__)
+
 
 class GeneralPurposeAgentApplication(ChatCompletion):
 
     def __init__(self):
         self.tools: list[BaseTool] = []
+        # Resources with async `close` that must be closed on shutdown (MCP client pools, interpreter tool, RAG tool)
+        self.closeables: list[MCPClientPool | PythonCodeInterpreterTool | RagTool | FileContentExtractionTool] = []
+        # Single build of tools shared by lifespan and concurrent first requests, recreated if the build failed
+        self._tools_task: Optional[asyncio.Task] = None
+        self._warm_up_task: Optional[asyncio.Task] = None
+        self._rag_tool: Optional[RagTool] = None
+        # Created once on the first tools build and kept between build retries, its threads are stopped in `close`
+        self._document_cache: Optional[DocumentCache] = None
+
+    def start(self) -> None:
+        """Start building tools in the background, so the first request doesn't wait for MCP connections"""
+        self._get_tools_task()
+
+    def _get_tools_task(self) -> asyncio.Task:
+        task = self._tools_task
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            task = asyncio.create_task(self._create_tools())
+            task.add_done_callback(self._on_tools_created)
+            self._tools_task = task
+        return task
+
+    def _on_tools_created(self, task: asyncio.Task) -> None:
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            _log.warning("app.tools.failed", error=repr(task.exception()))
+            return
+        self.tools = task.result()
+        _log.info("app.tools.ready", tools=[tool.name for tool in self.tools])
+
+    async def get_tools(self) -> list[BaseTool]:
+        """Return tools, waiting for the background build (or starting it again if the previous one failed)"""
+        if self.tools:
+            return self.tools
+        # Shielded: a cancelled request must not cancel the build other requests are waiting for
+        return await asyncio.shield(self._get_tools_task())
+
+    def _warm_up_rag_tool(self, rag_tool: RagTool) -> None:
+        # Embedding model (torch + sentence_transformers) and faiss are loaded in a thread, the tool also loads them
+        # on first use if warm-up failed or isn't finished yet
+        self._rag_tool = rag_tool
+        self._warm_up_task = asyncio.create_task(get_thread_executor().run(rag_tool.warm_up))
+        self._warm_up_task.add_done_callback(self._on_rag_tool_warmed_up)
+
+    def _get_document_cache(self) -> DocumentCache:
+        if self._document_cache is None:
+            spill_backend = DiskDocumentCacheBackend(DOCUMENT_CACHE_SPILL_DIR) if DOCUMENT_CACHE_SPILL_DIR else None
+            self._document_cache = DocumentCache.create(
+                max_bytes=DOCUMENT_CACHE_MAX_BYTES,
+                spill_backend=spill_backend,
+                write_through=DOCUMENT_CACHE_PERSISTENT,
+                warm_up_entries=DOCUMENT_CACHE_WARM_UP_ENTRIES,
+            )
+        return self._document_cache
+
+    @staticmethod
+    def _on_rag_tool_warmed_up(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            _log.warning("app.rag_warm_up.failed", error=repr(task.exception()))
 
-    async def _get_mcp_tools(self, url: str) -> list[BaseTool]:
+    def readiness(self) -> dict[str, Any]:
+        """Status of tools build and embedding model warm-up"""
+        if self.tools:
+            tools_status = "ready"
+        elif self._tools_task is not None and self._tools_task.done():
+            tools_status = "failed"
+        else:
+            tools_status = "building"
+        model_status = "warm" if self._rag_tool is not None and self._rag_tool.is_warm else "loading"
+        if model_status == "loading" and self._warm_up_task is not None and self._warm_up_task.done():
+            model_status = "failed"
+        return {
+            "ready": tools_status == "ready" and model_status == "warm",
+            "tools": tools_status,
+            "embedding_model": model_status,
+        }
+
+    async def _get_mcp_tools(self, url: str, result_cache: MCPResultCache | None = None) -> list[BaseTool]:
         # 1. Create list of BaseTool
-        # 2. Create MCPClient
+        # 2. Create MCPClientPool (it keeps several sessions to MCP server and reconnects them)
         # 3. Get tools, iterate through them and add them to created list as MCPTool where the client will be created
         #    MCPClient and mcp_tool_model will be the tool itself (see what `mcp_client.get_tools` returns).
         # 4. Return created tool list
         base_tools: list[BaseTool] = []
-        mcp_client = await MCPClient.create(mcp_server_url=url)
+        mcp_client = await MCPClientPool.create(mcp_server_url=url)
+        self.closeables.append(mcp_client)
         mcp_client_tools = await mcp_client.get_tools()
         for tool in mcp_client_tools:
-            base_tools.append(MCPTool(client=mcp_client, mcp_tool_model=tool))
+            base_tools.append(MCPTool(client=mcp_client, mcp_tool_model=tool, result_cache=result_cache))
         return base_tools
 
     async def _create_tools(self) -> list[BaseTool]:
@@ -47,25 +165,51 @@ class GeneralPurposeAgentApplication(ChatCompletion):
         # ---
         # 2. Add ImageGenerationTool with DIAL_ENDPOINT
         # 3. Add FileContentExtractionTool with DIAL_ENDPOINT
-        # 4. Add RagTool with DIAL_ENDPOINT, DEPLOYMENT_NAME, and create DocumentCache (it has static method `create`)
-        # 5. Add PythonCodeInterpreterTool with DIAL_ENDPOINT, `http://localhost:8050/mcp` mcp_url, tool_name is
+        # 4. Add RagTool with DIAL_ENDPOINT, DEPLOYMENT_NAME, and DocumentCache (it is created once, see
+        #    `_get_document_cache`)
+        # 5. Add PythonCodeInterpreterTool with DIAL_ENDPOINT, PYTHON_INTERPRETER_MCP_URL mcp_url, tool_name is
         #    `execute_code`, more detailed about tools see in repository https://github.com/khshanovskyi/mcp-python-code-interpreter
         base_tools: list[BaseTool] = []
-        base_tools.append(FileContentExtractionTool(endpoint=DIAL_ENDPOINT))
-        base_tools.append(RagTool(endpoint=DIAL_ENDPOINT,
-                                  deployment_name=DEPLOYMENT_NAME,
-                                  document_cache=DocumentCache.create()))
+        file_content_extraction_tool = FileContentExtractionTool(
+            endpoint=DIAL_ENDPOINT,
+            text_cache=ExtractedTextCache(max_bytes=EXTRACTED_TEXT_CACHE_MAX_BYTES,
+                                          ttl=timedelta(seconds=EXTRACTED_TEXT_CACHE_TTL_SECONDS))
+        )
+        self.closeables.append(file_content_extraction_tool)
+        base_tools.append(file_content_extraction_tool)
+        rag_tool = RagTool(endpoint=DIAL_ENDPOINT,
+                           deployment_name=DEPLOYMENT_NAME,
+                           document_cache=self._get_document_cache())
+        self.closeables.append(rag_tool)
+        self._warm_up_rag_tool(rag_tool)
+        base_tools.append(rag_tool)
         base_tools.append(ImageGenerationTool(endpoint=DIAL_ENDPOINT))
-        base_tools.append(await PythonCodeInterpreterTool.create(mcp_url="http://localhost:8050/mcp",
-                                                           tool_name="execute_code",
-                                                           dial_endpoint=DIAL_ENDPOINT))
-        # 6. Extend tools with MCP tools from `http://localhost:8051/mcp` (use method `_get_mcp_tools`)
-        mcp_tools = await self._get_mcp_tools(url="http://localhost:8051/mcp")
+        # Tool results over their token budget are truncated in history, this tool reads them in full
+        base_tools.append(ToolResultFetchTool(result_store=get_tool_result_store()))
+        # 6. Extend tools with MCP tools from WEB_SEARCH_MCP_URL (use method `_get_mcp_tools`)
+        #    with result cache for idempotent tools configured in MCP_CACHED_TOOLS
+        # Both MCP servers are connected concurrently, if any of them fails already opened connections are closed
+        mcp_result_cache = MCPResultCache(tool_ttls=parse_tool_ttls(MCP_CACHED_TOOLS),
+                                          max_bytes=MCP_RESULT_CACHE_MAX_BYTES)
+        python_code_interpreter_tool, mcp_tools = await asyncio.gather(
+            PythonCodeInterpreterTool.create(mcp_url=PYTHON_INTERPRETER_MCP_URL,
+                                             tool_name="execute_code",
+                                             dial_endpoint=DIAL_ENDPOINT),
+            self._get_mcp_tools(url=WEB_SEARCH_MCP_URL, result_cache=mcp_result_cache),
+            return_exceptions=True,
+        )
+        if isinstance(python_code_interpreter_tool, PythonCodeInterpreterTool):
+            self.closeables.append(python_code_interpreter_tool)
+        for result in (python_code_interpreter_tool, mcp_tools):
+            if isinstance(result, BaseException):
+                await self._close_tools()
+                raise result
+        base_tools.append(python_code_interpreter_tool)
         base_tools.extend(mcp_tools)
         return base_tools
 
     async def chat_completion(self, request: Request, response: Response) -> None:
-        # 1. If `self.tools` are absent then call `_create_tools` method and assign to the `self.tools`
+        # 1. Get tools with `get_tools`, they are built in the background on startup (see `start`)
         # 2. Create `choice` (`with response.create_single_choice() as choice:`) and:
         #   - Create GeneralPurposeAgent with:
         #       - endpoint=DIAL_ENDPOINT
@@ -76,17 +220,44 @@ class GeneralPurposeAgentApplication(ChatCompletion):
         #       - deployment_name=DEPLOYMENT_NAME
         #       - request=request
         #       - response=response
-        if not self.tools:
-            self.tools = await self._create_tools()
+        tools = await self.get_tools()
         with response.create_single_choice() as choice:
             agent = GeneralPurposeAgent(endpoint=DIAL_ENDPOINT,
                                         system_prompt=SYSTEM_PROMPT,
-                                        tools=self.tools)
+                                        tools=tools,
+                                        max_iterations=AGENT_MAX_ITERATIONS,
+                                        max_duration_seconds=AGENT_MAX_DURATION_SECONDS,
+                                        history_token_budget=HISTORY_TOKEN_BUDGET or None)
             await agent.handle_request(choice=choice,
                                        deployment_name=DEPLOYMENT_NAME,
                                        request=request,
                                        response=response)
 
+    async def close(self) -> None:
+        for task in (self._tools_task, self._warm_up_task):
+            if task is not None and not task.done():
+                task.cancel()
+        await self._close_tools()
+        if self._document_cache is not None:
+            document_cache, self._document_cache = self._document_cache, None
+            await get_thread_executor().run(document_cache.stop_cleanup_task)
+
+    async def _close_tools(self) -> None:
+        """Close resources of built tools, document cache is kept for the next build"""
+        await asyncio.gather(*(closeable.close() for closeable in self.closeables), return_exceptions=True)
+        self.closeables.clear()
+
+
+@asynccontextmanager
+async def lifespan(app: DIALApp):
+    # Connection pools to DIAL Core are created off the event loop, creating SSL context is slow
+    await get_thread_executor().run(get_dial_client_registry().prepare, DIAL_ENDPOINT)
+    agent_app.start()
+    yield
+    await agent_app.close()
+    await close_dial_clients()
+    shutdown_executors()
+
 
 # 1. Create DIALApp
 # 2. Create GeneralPurposeAgentApplication
@@ -94,8 +265,23 @@ class GeneralPurposeAgentApplication(ChatCompletion):
 #       - deployment_name="general-purpose-agent"
 #       - impl=agent_app
 # 4. Run it with uvicorn: `uvicorn.run({CREATED_DIAL_APP}, port=5030, host="0.0.0.0")`
-dial_app = DIALApp()
+dial_app = DIALApp(lifespan=lifespan)
 agent_app = GeneralPurposeAgentApplication()
 dial_app.add_chat_completion(deployment_name="general-purpose-agent", impl=agent_app)
+
+
+@dial_app.get("/metrics", include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    """Prometheus histograms of agent iterations, LLM completions, time to first token, tool calls and RAG phases"""
+    return PlainTextResponse(get_span_metrics().render(), media_type="text/plain; version=0.0.4")
+
+
+@dial_app.get("/ready", include_in_schema=False)
+async def ready() -> JSONResponse:
+    """Readiness probe: 200 when tools are built and embedding model is loaded, 503 otherwise"""
+    status = agent_app.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
 if __name__ == "__main__":
     uvicorn.run(dial_app, port=5030, host="0.0.0.0")
@@ -7,6 +7,10 @@ from aidial_sdk.chat_completion import Message
 from pydantic import StrictStr
 
 from task.tools.models import ToolCallParams
+from task.utils.constants import TOOL_RESULT_FETCH_TOOL_NAME
+from task.utils.tokens import count_tokens
+from task.utils.tool_result_store import get_token_budget, get_tool_result_store, truncate_head_tail
+from task.utils.tracing import get_current_span
 
 
 class BaseTool(ABC):
@@ -21,7 +25,8 @@ class BaseTool(ABC):
         #       - In `try` block call`_execute` method, then check if result isinstance of Message, if yes then
         #         assign result to created message in 1st step, otherwise set Message `content` as StrictStr(result)
         #       - In `except` block intercept Exception and add it properly to Message `content`
-        # 3. Return created message
+        # 3. Fit text content into tool result token budget (see `_apply_result_budget`)
+        # 4. Return created message
         message = Message(
             role=Role.TOOL,
             name=StrictStr(tool_call_params.tool_call.function.name),
@@ -34,9 +39,43 @@ class BaseTool(ABC):
             else:
                 message.content = StrictStr(result)
         except Exception as e:
+            if current_span := get_current_span():
+                current_span.set_error(e)
             message.content = StrictStr(f"Tool execution failed with error: {e}")
+        if isinstance(message.content, str):
+            message.content = StrictStr(self._apply_result_budget(message.content, tool_call_params))
         return message
 
+    def _apply_result_budget(self, content: str, tool_call_params: ToolCallParams) -> str:
+        # Tool results stay in conversation history and are sent to LLM on every next turn, so large results are
+        # compacted by the tool (see `_compact_result`) or truncated to head and tail, full result is kept in the
+        # store and LLM can read it with fetch tool
+        budget = self.result_token_budget
+        if budget is None or count_tokens(content) <= budget:
+            return content
+        result_id = get_tool_result_store().put(tool_call_params.conversation_id, content)
+        if result_id is None:
+            placeholder = (
+                f"[... Result is truncated to {budget} tokens, full result has {len(content)} characters "
+                f"and is unavailable ...]"
+            )
+        else:
+            placeholder = (
+                f"[... Result is truncated to {budget} tokens, full result has {len(content)} characters. "
+                f"Use `{TOOL_RESULT_FETCH_TOOL_NAME}` tool with result_id `{result_id}` to read it ...]"
+            )
+        compacted = self._compact_result(content, budget, placeholder)
+        if compacted is not None:
+            return compacted
+        return truncate_head_tail(content, budget, placeholder)
+
+    def _compact_result(self, content: str, max_tokens: int, placeholder: str) -> str | None:
+        """
+        Fit result into `max_tokens` keeping its format valid, e.g. trim entries of a JSON result. `placeholder` tells
+        LLM how to read the full result and should be kept in the compacted one. None if result is cut to head and tail.
+        """
+        return None
+
     @abstractmethod
     async def _execute(self, tool_call_params: ToolCallParams) -> str | Message:
         pass
@@ -45,6 +84,11 @@ class BaseTool(ABC):
     def show_in_stage(self) -> bool:
         return True
 
+    @property
+    def result_token_budget(self) -> int | None:
+        """Max tokens of result put into conversation history, None if result is not limited."""
+        return get_token_budget(self.name)
+
     @property
     @abstractmethod
     def name(self) -> str:
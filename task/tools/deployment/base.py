@@ -2,13 +2,13 @@ import json
 from abc import ABC, abstractmethod
 from typing import Any
 
-from aidial_client import AsyncDial
 from aidial_sdk.chat_completion import Message, Role, CustomContent
 from pydantic import StrictStr
 from pyexpat.errors import messages
 
 from task.tools.base import BaseTool
 from task.tools.models import ToolCallParams
+from task.utils.dial_clients import get_async_dial_client
 
 
 class DeploymentTool(BaseTool, ABC):
@@ -30,7 +30,7 @@ class DeploymentTool(BaseTool, ABC):
         # 2. Get `prompt` from arguments (by default we provide `prompt` for each deployment tool, use this param name as standard)
         # 3. Delete `prompt` from `arguments` (there can be provided additional parameters and `prompt` will be added
         #    as user message content and other parameters as `custom_fields`)
-        # 4. Create AsyncDial client (api_version is 2025-01-01-preview)
+        # 4. Get AsyncDial client with `get_async_dial_client` (api_version is 2025-01-01-preview)
         # 5. Call chat completions with:
         #   - messages (here will be just user message. Optionally, in this class you can add system prompt `property`
         #     and if any deployment tool provides system prompt then we need to set it as first message (system prompt))
@@ -47,8 +47,8 @@ class DeploymentTool(BaseTool, ABC):
         if "prompt" in arguments:
             del arguments["prompt"]
 
-        dial_client = AsyncDial(
-            base_url=self.endpoint,
+        dial_client = get_async_dial_client(
+            self.endpoint,
             api_key=tool_call_params.api_key,
             api_version="2025-01-01-preview",
         )
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Tuple
+import threading
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL = timedelta(hours=1)
+
+
+class ExtractedText:
+    """
+    Extracted file text stored as one utf-8 buffer with precomputed byte offsets of page boundaries, so any page is
+    decoded in O(page size) without touching the rest of the document.
+    Text can be only the beginning of the document (`complete` is False), then `estimated_length` is approximate.
+    """
+
+    __slots__ = ('_data', '_offsets', 'length', 'page_size', 'complete', 'estimated_length')
+
+    def __init__(self, text: str, page_size: int, complete: bool = True, estimated_length: int | None = None):
+        self.length = len(text)
+        self.page_size = page_size
+        self.complete = complete
+        self.estimated_length = self.length if complete or estimated_length is None else estimated_length
+        self._data = text.encode('utf-8')
+        self._offsets: list[int] = [0]
+        position = 0
+        for start in range(page_size, self.length, page_size):
+            position += len(text[start - page_size:start].encode('utf-8'))
+            self._offsets.append(position)
+        self._offsets.append(len(self._data))
+
+    @property
+    def total_pages(self) -> int:
+        """Number of pages, estimated if text is not complete."""
+        if self.complete:
+            return len(self._offsets) - 1
+        return max(len(self._offsets) - 1, (self.estimated_length + self.page_size - 1) // self.page_size)
+
+    def has_page(self, page: int) -> bool:
+        """Check if page is fully present in text (the last page of complete text may be shorter)."""
+        if self.complete:
+            return page <= len(self._offsets) - 1
+        return self.length > page * self.page_size
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._data) + 8 * len(self._offsets)
+
+    def page(self, page: int) -> str:
+        """Return page content, pages are numbered from 1."""
+        return self._data[self._offsets[page - 1]:self._offsets[page]].decode('utf-8')
+
+    def text(self) -> str:
+        return self._data.decode('utf-8')
+
+
+@dataclass
+class _CacheEntry:
+    text: ExtractedText
+    timestamp: datetime
+
+
+class ExtractedTextCache:
+    """
+    Thread-safe LRU cache of extracted file texts keyed by file URL and ETag, so a changed file is never served from
+    stale cache. Bounded by total size of stored texts and entry TTL.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: timedelta = DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._cache: OrderedDict[Tuple[str, str], _CacheEntry] = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, file_url: str, etag: str) -> ExtractedText | None:
+        """
+        Retrieve a cached text.
+
+        Args:
+            file_url: File URL
+            etag: ETag of the file
+
+        Returns:
+            ExtractedText if found and not expired, None otherwise
+        """
+        key = (file_url, etag)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry:
+                if datetime.now() - entry.timestamp < self.ttl:
+                    self._cache.move_to_end(key)
+                    return entry.text
+                self._remove(key)
+            return None
+
+    def set(self, file_url: str, etag: str, text: ExtractedText) -> None:
+        """
+        Store a text, evicting least recently used entries if size budget is exceeded.
+
+        Args:
+            file_url: File URL
+            etag: ETag of the file
+            text: Extracted text
+        """
+        if text.nbytes > self.max_bytes:
+            return
+        key = (file_url, etag)
+        with self._lock:
+            self._remove(key)
+            self._cache[key] = _CacheEntry(text=text, timestamp=datetime.now())
+            self._current_bytes += text.nbytes
+            while self._current_bytes > self.max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._current_bytes -= evicted.text.nbytes
+
+    def clear(self) -> None:
+        """Clear all cached entries."""
+        with self._lock:
+            self._cache.clear()
+            self._current_bytes = 0
+
+    def size(self) -> int:
+        """Return the number of cached entries."""
+        with self._lock:
+            return len(self._cache)
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        """Remove entry. Must be called while holding `self._lock`."""
+        entry = self._cache.pop(key, None)
+        if entry:
+            self._current_bytes -= entry.text.nbytes
@@ -1,11 +1,32 @@
+import asyncio
 import json
-from typing import Any
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
 
 from aidial_sdk.chat_completion import Message
 
 from task.tools.base import BaseTool
+from task.tools.files.extracted_text_cache import ExtractedText, ExtractedTextCache
 from task.tools.models import ToolCallParams
-from task.utils.dial_file_conent_extractor import DialFileContentExtractor
+from task.utils.dial_file_conent_extractor import DialFileContentExtractor, DownloadedFile
+
+_PAGE_SIZE = 10_000
+# Downloaded PDFs which text is extracted only partially are kept on disk, so the next pages are extracted from
+# the last parsed page instead of downloading and parsing the file from the beginning again
+_MAX_PARTIAL_PDFS = 16
+_PARTIAL_PDF_TTL_SECONDS = 10 * 60
+
+
+@dataclass
+class _PartialPdf:
+    downloaded: DownloadedFile
+    text: str
+    # Number of pages `text` was extracted from
+    pages: int
+    total_pages: int
+    last_used: float
 
 
 class FileContentExtractionTool(BaseTool):
@@ -15,8 +36,14 @@ class FileContentExtractionTool(BaseTool):
     USAGE: Start with page=1 (by default)
     """
 
-    def __init__(self, endpoint: str):
+    def __init__(self, endpoint: str, text_cache: ExtractedTextCache):
         self.endpoint = endpoint
+        self.text_cache = text_cache
+        # (file_url, etag) -> partially extracted PDF
+        self._partial_pdfs: OrderedDict[tuple[str, str], _PartialPdf] = OrderedDict()
+        # (file_url, etag) -> (lock, number of requests holding or waiting for it), PDF is extracted by one request at
+        # a time, so concurrent requests don't download it twice
+        self._pdf_locks: dict[tuple[str, str], tuple[asyncio.Lock, int]] = {}
 
     @property
     def show_in_stage(self) -> bool:
@@ -35,6 +62,7 @@ class FileContentExtractionTool(BaseTool):
         return """
         Extracts text content from files. Supported: PDF (text only), TXT, CSV (as markdown table), HTML/HTM.
         PAGINATION: Files >10,000 chars are paginated. Response format: `**Page #X. Total pages: Y**` appears at end if paginated.
+        For large PDFs total pages can be estimated: `**Page #X. Total pages: ~Y (estimated)**`.
         USAGE: Start with page=1. If paginated, call again with page=2, page=3, etc. to get remaining content.
         Always check response end for pagination info before answering user queries about file content.
         """
@@ -71,18 +99,13 @@ class FileContentExtractionTool(BaseTool):
         # 6. Append content to stage: `f"**File URL**: {file_url}\n\r"`
         # 7. If `page` more than 1 then append content to stage: `f"**Page**: {page}\n\r"`
         # 8. Append content to stage: "## Response: \n"
-        # 9. Implement `task.utils.dial_file_conent_extractor`, create DialFileContentExtractor and call `extract_text`
-        #    method as `content`
-        # 10. If no `content` present then set it as "Error: File content not found."
-        # 11. If `content` len is more than 10_000 then we need to enable pagination:
-        #       - create variable `page_size` as 10_000
-        #       - calculate total pages, formula: (`content len` + `page_size` - 1) // `page_size`
+        # 9. Get extracted text (see `_get_extracted_text`, pagination through the document reuses text extracted once)
+        # 10. If no text present then set `content` as "Error: File content not found."
+        # 11. If text len is more than 10_000 then we need to enable pagination:
         #       - if `page` is less then 1 (potential hallucination from LLM) then set it as 1
         #       - otherwise check if page > total pages (potential hallucination), it yes then set `content` as
         #         `f"Error: Page {page} does not exist. Total pages: {total_pages}"`
-        #       - prepare `start_index`: `(page - 1) * page_size`
-        #       - prepare `end_index`: `start_index + page_size`
-        #       - get page content from `content` that will start with `start_index` and end with `end_index`
+        #       - get page content from extracted text by precomputed page offsets
         #       - set `content` as `f"{page_content}\n\n**Page #{page}. Total pages: {total_pages}**"` (It will show to
         #         LLM that it is not full content and it is pageable)
         # 12. Append content to stage: `f"```text\n\r{content}\n\r```\n\r"` (Will be shown in stage as markdown text)
@@ -96,22 +119,129 @@ class FileContentExtractionTool(BaseTool):
         if page > 1:
             stage.append_content(f"**Page**: {page}\n\r")
         stage.append_content(f"## Response: \n")
-        content = DialFileContentExtractor(
-            endpoint=self.endpoint,
-            api_key=tool_call_params.api_key
-        ).extract_text(file_url)
-        if not content:
+        extracted_text = await self._get_extracted_text(file_url, tool_call_params.api_key, max(page, 1))
+        if not extracted_text.length:
             content = "Error: File content not found."
-        if len(content) > 10_000:
-            page_size = 10_000
-            total_pages = (len(content) + page_size - 1) // page_size
+        elif extracted_text.length > _PAGE_SIZE:
+            total_pages = extracted_text.total_pages
             if page < 1:
                 page = 1
-            elif page > total_pages:
+            elif not extracted_text.has_page(page):
                 return f"Error: Page {page} does not exist. Total pages: {total_pages}"
-            start_index = (page - 1) * page_size
-            end_index = start_index + page_size
-            page_content = content[start_index:end_index]
-            content = f"{page_content}\n\n**Page #{page}. Total pages: {total_pages}**"
+            page_content = extracted_text.page(page)
+            if extracted_text.complete:
+                content = f"{page_content}\n\n**Page #{page}. Total pages: {total_pages}**"
+            else:
+                content = f"{page_content}\n\n**Page #{page}. Total pages: ~{total_pages} (estimated)**"
+        else:
+            content = extracted_text.text()
         stage.append_content(f"```text\n\r{content}\n\r```\n\r")
         return content
+
+    async def close(self) -> None:
+        """Remove downloaded PDFs kept for extraction of their next pages"""
+        while self._partial_pdfs:
+            _, partial = self._partial_pdfs.popitem()
+            partial.downloaded.path.unlink(missing_ok=True)
+
+    async def _get_extracted_text(self, file_url: str, api_key: str, page: int) -> ExtractedText:
+        # 1. ETag is requested with caller api_key on each call, so it also checks that caller has access to the file
+        #    before anything is served from the cache
+        # 2. Large PDFs are extracted only up to the requested page, the downloaded file is kept while text is
+        #    incomplete and extraction of the next pages continues from the last parsed page
+        # 3. Other files are extracted completely, PDFs without ETag are extracted from a new download on each call
+        extractor = DialFileContentExtractor(endpoint=self.endpoint, api_key=api_key)
+        etag = await extractor.aget_etag(file_url)
+        if etag:
+            cached_text = self.text_cache.get(file_url, etag)
+            if cached_text and (cached_text.complete or cached_text.has_page(page)):
+                return cached_text
+
+        min_chars = page * _PAGE_SIZE
+        if not etag or not extractor.is_pdf(file_url):
+            text_prefix = await extractor.aextract_text_prefix(file_url, min_chars=min_chars)
+            extracted_text = ExtractedText(
+                text_prefix.text,
+                page_size=_PAGE_SIZE,
+                complete=text_prefix.complete,
+                estimated_length=text_prefix.estimated_length,
+            )
+            if etag:
+                self.text_cache.set(file_url, etag, extracted_text)
+            return extracted_text
+
+        key = (file_url, etag)
+        lock, users = self._pdf_locks.get(key) or (asyncio.Lock(), 0)
+        self._pdf_locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                # Concurrent request may have already extracted the page while this one was waiting
+                cached_text = self.text_cache.get(file_url, etag)
+                if cached_text and (cached_text.complete or cached_text.has_page(page)):
+                    return cached_text
+                return await self._extract_pdf(extractor, file_url, etag, min_chars)
+        finally:
+            lock, users = self._pdf_locks[key]
+            if users > 1:
+                self._pdf_locks[key] = (lock, users - 1)
+            else:
+                del self._pdf_locks[key]
+
+    async def _extract_pdf(self, extractor: DialFileContentExtractor, file_url: str, etag: str,
+                           min_chars: int) -> ExtractedText:
+        # Partial PDF is taken out while it is extracted, so it is never removed under a running extraction
+        key = (file_url, etag)
+        partial = self._take_partial_pdf(key)
+        if partial is None:
+            downloaded = await extractor.adownload(file_url)
+            partial = _PartialPdf(downloaded=downloaded, text='', pages=0, total_pages=0, last_used=time.monotonic())
+        try:
+            if len(partial.text) <= min_chars:
+                text_prefix = await extractor.aextract_pdf_text_prefix(
+                    partial.downloaded, min_chars=min_chars - len(partial.text), start_page=partial.pages
+                )
+                if text_prefix.pages > partial.pages:
+                    partial.text = f"{partial.text}\n{text_prefix.text}" if partial.pages else text_prefix.text
+                    partial.pages = text_prefix.pages
+                    partial.total_pages = text_prefix.total_pages
+                complete = text_prefix.complete
+            else:
+                complete = partial.pages >= partial.total_pages
+        except BaseException:
+            partial.downloaded.path.unlink(missing_ok=True)
+            raise
+
+        estimated_length = len(partial.text) * partial.total_pages // max(partial.pages, 1)
+        extracted_text = ExtractedText(partial.text, page_size=_PAGE_SIZE, complete=complete,
+                                       estimated_length=estimated_length)
+        self.text_cache.set(file_url, etag, extracted_text)
+        if complete:
+            partial.downloaded.path.unlink(missing_ok=True)
+        else:
+            self._keep_partial_pdf(key, partial)
+        return extracted_text
+
+    def _take_partial_pdf(self, key: tuple[str, str]) -> Optional[_PartialPdf]:
+        partial = self._partial_pdfs.pop(key, None)
+        if partial and time.monotonic() - partial.last_used >= _PARTIAL_PDF_TTL_SECONDS:
+            partial.downloaded.path.unlink(missing_ok=True)
+            return None
+        return partial
+
+    def _keep_partial_pdf(self, key: tuple[str, str], partial: _PartialPdf) -> None:
+        replaced = self._partial_pdfs.pop(key, None)
+        if replaced is not None:
+            # Entry with more extracted pages is kept, file of the other one is removed
+            if replaced.pages > partial.pages:
+                partial, replaced = replaced, partial
+            replaced.downloaded.path.unlink(missing_ok=True)
+        partial.last_used = time.monotonic()
+        self._partial_pdfs[key] = partial
+        # Entries are ordered by last use, expired and least recently used files are removed
+        while self._partial_pdfs:
+            oldest_key, oldest = next(iter(self._partial_pdfs.items()))
+            if (len(self._partial_pdfs) <= _MAX_PARTIAL_PDFS
+                    and time.monotonic() - oldest.last_used < _PARTIAL_PDF_TTL_SECONDS):
+                break
+            del self._partial_pdfs[oldest_key]
+            oldest.downloaded.path.unlink(missing_ok=True)
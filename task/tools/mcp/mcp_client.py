@@ -1,4 +1,7 @@
-from typing import Optional, Any
+import json
+import os
+from datetime import timedelta
+from typing import Any, Callable, Optional
 
 from mcp import ClientSession
 from mcp.client.streamable_http import streamablehttp_client
@@ -6,13 +9,25 @@ from mcp.types import CallToolResult, TextContent, ReadResourceResult, TextResou
 from pydantic import AnyUrl
 
 from task.tools.mcp.mcp_tool_model import MCPToolModel
+from task.utils.logger import Lazy, get_logger, payload_size
+
+# Max time to wait for tool call result, a call without response (e.g. lost on server side) fails with McpError
+MCP_CALL_TIMEOUT_SECONDS = float(os.getenv('MCP_CALL_TIMEOUT_SECONDS', 300))
+
+_log = get_logger(__name__)
+
+
+class MCPToolError(Exception):
+    """Raised when MCP server reports tool call result as error (`isError`), message is the error content."""
 
 
 class MCPClient:
     """Handles MCP server connection and tool execution"""
 
-    def __init__(self, mcp_server_url: str) -> None:
+    def __init__(self, mcp_server_url: str, on_transport_error: Optional[Callable[[Exception], None]] = None) -> None:
+        """`on_transport_error` is called with errors of transport, requests in flight aren't failed by them"""
         self.server_url = mcp_server_url
+        self.on_transport_error = on_transport_error
         self.session: Optional[ClientSession] = None
         self._streams_context = None
         self._session_context = None
@@ -34,16 +49,35 @@ class MCPClient:
         # 3. Enter `self._streams_context`, result set as `read_stream, write_stream, _`
         # 4. Create ClientSession with streams from above and set as `self._session_context`
         # 5. Enter `self._session_context` and set as self.session
-        # 6. Initialize session and print its result to console
+        # 6. Initialize session and log its result
         if self.session is not None:
             return
         self._streams_context = streamablehttp_client(self.server_url)
-        read_stream, write_stream, _ = await self._streams_context.__aenter__()
-        self._session_context = ClientSession(read_stream=read_stream, write_stream=write_stream)
-        self.session = await self._session_context.__aenter__()
-        init_result = await self.session.initialize()
-        print(f"MCP Client connected: {init_result}")
-
+        try:
+            read_stream, write_stream, _ = await self._streams_context.__aenter__()
+            self._session_context = ClientSession(
+                read_stream=read_stream, write_stream=write_stream, message_handler=self._handle_message
+            )
+            self.session = await self._session_context.__aenter__()
+            init_result = await self.session.initialize()
+        except BaseException:
+            await self.close()
+            raise
+        _log.info(
+            "mcp.connected",
+            server_url=self.server_url,
+            server=init_result.serverInfo.name,
+            protocol_version=init_result.protocolVersion,
+        )
+
+
+    async def _handle_message(self, message: Any) -> None:
+        # Transport reports failures of response streams (e.g. server died mid-response) as exceptions in the read
+        # stream, ClientSession passes them here and leaves the request waiting for its response
+        if isinstance(message, Exception):
+            _log.warning("mcp.transport_error", server_url=self.server_url, error=repr(message))
+            if self.on_transport_error:
+                self.on_transport_error(message)
 
     async def get_tools(self) -> list[MCPToolModel]:
         """Get available tools from MCP server"""
@@ -53,25 +87,40 @@ class MCPClient:
         mcp_tools = await self.session.list_tools()
         tools: list[MCPToolModel] = []
         for tool in mcp_tools.tools:
+            annotations = tool.annotations
             tools.append(
                 MCPToolModel(
                     name=tool.name,
                     description=tool.description,
-                    parameters=tool.inputSchema
+                    parameters=tool.inputSchema,
+                    idempotent=bool(annotations and (annotations.readOnlyHint or annotations.idempotentHint)),
                 )
             )
         return tools
 
     async def call_tool(self, tool_name: str, tool_args: dict[str, Any]) -> Any:
-        """Call a tool on the MCP server"""
+        """Call a tool on the MCP server, raises MCPToolError if the server reports the result as error"""
         # Make tool call and return its result. Do it in proper way (it returns array of content and you need to handle it properly)
         if not self.session:
             raise RuntimeError("MCP client not connected. Call connect() first.")
-        print(f"    Calling `{tool_name}` with {tool_args}")
-        tool_result: CallToolResult = await self.session.call_tool(tool_name, tool_args)
+        _log.debug("mcp.call_tool.request", tool=tool_name, arguments=Lazy(lambda: json.dumps(tool_args, default=str)))
+        tool_result: CallToolResult = await self.session.call_tool(
+            tool_name, tool_args, read_timeout_seconds=timedelta(seconds=MCP_CALL_TIMEOUT_SECONDS)
+        )
         content = tool_result.content[0] if tool_result.content else None
-        print(f"    ⚙️: {content}\n")
-
+        _log.info(
+            "mcp.call_tool",
+            sampled=True,
+            tool=tool_name,
+            content_type=getattr(content, 'type', None),
+            result_chars=payload_size(content) if content is not None else 0,
+            is_error=tool_result.isError,
+        )
+        _log.debug("mcp.call_tool.result", tool=tool_name, result=Lazy(lambda: str(content)))
+
+        if tool_result.isError:
+            error = content.text if isinstance(content, TextContent) else str(content or "unknown error")
+            raise MCPToolError(f"Tool `{tool_name}` returned error: {error}")
         if isinstance(content, TextContent):
             return content.text
 
@@ -84,7 +133,9 @@ class MCPClient:
         if not self.session:
             raise RuntimeError("MCP client not connected. Call connect() first.")
         resource_result: ReadResourceResult = await self.session.read_resource(uri)
-        content = resource_result.content
+        if not resource_result.contents:
+            raise ValueError(f"Resource {uri} has no content")
+        content = resource_result.contents[0]
         if isinstance(content, TextResourceContents):
             return content.text
         elif isinstance(content, BlobResourceContents):
@@ -97,13 +148,17 @@ class MCPClient:
         # 1. Close `self._session_context`
         # 2. Close `self._streams_context`
         # 3. Set session, _session_context and _streams_context as None
-        if self._session_context:
-            await self._session_context.__aexit__(None, None, None)
+        # Transport must be closed even if session failed to close (e.g. server is gone), otherwise its background
+        # tasks are left running
+        try:
+            if self._session_context:
+                await self._session_context.__aexit__(None, None, None)
+        finally:
             self._session_context = None
-        if self._streams_context:
-            await self._streams_context.__aexit__(None, None, None)
-            self._streams_context = None
-        self.session = None
+            self.session = None
+            if self._streams_context:
+                streams_context, self._streams_context = self._streams_context, None
+                await streams_context.__aexit__(None, None, None)
 
     async def __aenter__(self):
         """Async context manager entry"""
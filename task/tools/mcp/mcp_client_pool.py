@@ -0,0 +1,299 @@
+import asyncio
+import os
+from typing import Any, Optional
+
+import anyio
+import httpx
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+from pydantic import AnyUrl
+
+from task.tools.mcp.mcp_client import MCPClient
+from task.tools.mcp.mcp_tool_model import MCPToolModel
+from task.utils.logger import get_logger
+
+MCP_POOL_SIZE = int(os.getenv('MCP_POOL_SIZE', 4))
+MCP_MAX_IN_FLIGHT_PER_SESSION = int(os.getenv('MCP_MAX_IN_FLIGHT_PER_SESSION', 8))
+MCP_HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv('MCP_HEALTH_CHECK_INTERVAL_SECONDS', 30))
+_HEALTH_CHECK_TIMEOUT_SECONDS = 10.0
+_RECONNECT_MIN_DELAY_SECONDS = 0.5
+_RECONNECT_MAX_DELAY_SECONDS = 30.0
+_CONNECT_TIMEOUT_SECONDS = 30.0
+# Errors of lost connection to MCP server. Protocol errors, tool errors and timeouts leave the session usable
+_CONNECTION_ERRORS = (
+    ConnectionError,
+    httpx.NetworkError,
+    httpx.RemoteProtocolError,
+    anyio.BrokenResourceError,
+    anyio.ClosedResourceError,
+    anyio.EndOfStream,
+)
+
+_log = get_logger(__name__)
+
+
+class MCPPoolUnavailableError(Exception):
+    """Raised when none of the pool sessions is connected."""
+
+
+class MCPConnectionLostError(ConnectionError):
+    """Raised for a call that was in flight when connection of its session was lost."""
+
+
+def _is_connection_error(error: BaseException) -> bool:
+    if isinstance(error, McpError):
+        return error.error.code == CONNECTION_CLOSED
+    return isinstance(error, _CONNECTION_ERRORS)
+
+
+class _PooledSession:
+    """
+    One MCP session of the pool. Streamable HTTP transport is built on anyio task groups which must be entered and
+    exited by the same task, so the session lives in its own task that connects, waits until the session is reported
+    broken or the pool is closed, and reconnects with exponential backoff.
+    """
+
+    def __init__(self, server_url: str, session_number: int, max_in_flight: int):
+        self.server_url = server_url
+        self.session_number = session_number
+        self.client: Optional[MCPClient] = None
+        self.in_flight = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._connected = asyncio.Event()
+        self._broken = asyncio.Event()
+        # Set when the current connection is gone, a new event is created for each connection
+        self._lost = asyncio.Event()
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def wait_connected(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def mark_broken(self) -> None:
+        if self._connected.is_set():
+            _log.warning("mcp.session.broken", server_url=self.server_url, session=self.session_number)
+            self._connected.clear()
+            self._broken.set()
+            self._lost.set()
+
+    async def call(self, operation) -> Any:
+        """
+        Run `operation` with the session client. Transport failure doesn't always fail requests in flight (their
+        response streams may be left unresolved), so the operation races with loss of the connection it was sent by.
+        """
+        client = await self.acquire()
+        lost = self._lost
+        operation_task = asyncio.ensure_future(operation(client))
+        lost_task = asyncio.ensure_future(lost.wait())
+        try:
+            await asyncio.wait((operation_task, lost_task), return_when=asyncio.FIRST_COMPLETED)
+            if operation_task.done():
+                return operation_task.result()
+            raise MCPConnectionLostError(
+                f"Connection of MCP session #{self.session_number} to {self.server_url} was lost"
+            )
+        finally:
+            for task in (operation_task, lost_task):
+                task.cancel()
+            await asyncio.gather(operation_task, lost_task, return_exceptions=True)
+            self.release()
+
+    async def acquire(self) -> MCPClient:
+        await self._semaphore.acquire()
+        self.in_flight += 1
+        if self.client is None:
+            self.release()
+            raise MCPPoolUnavailableError(f"MCP session #{self.session_number} to {self.server_url} is not connected")
+        return self.client
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def ping(self) -> None:
+        client = self.client
+        if client is None or client.session is None:
+            return
+        try:
+            await asyncio.wait_for(client.session.send_ping(), _HEALTH_CHECK_TIMEOUT_SECONDS)
+        except Exception as e:
+            _log.warning(
+                "mcp.session.health_check_failed",
+                server_url=self.server_url,
+                session=self.session_number,
+                error=str(e),
+            )
+            self.mark_broken()
+
+    async def close(self) -> None:
+        self._closed = True
+        self._broken.set()
+        if self._task:
+            if not self.is_connected:
+                # Task is connecting or waiting before reconnect
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        delay = _RECONNECT_MIN_DELAY_SECONDS
+        while not self._closed:
+            # Each connection is served by a separate task: when transport fails, anyio cancels the task that owns it,
+            # and this cancellation must not leak into the reconnect loop
+            connection = asyncio.create_task(self._serve())
+            try:
+                await connection
+                delay = _RECONNECT_MIN_DELAY_SECONDS
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                _log.warning("mcp.session.dropped", server_url=self.server_url, session=self.session_number)
+            except Exception as e:
+                _log.warning(
+                    "mcp.session.failed", server_url=self.server_url, session=self.session_number, error=repr(e)
+                )
+            finally:
+                self.client = None
+                self._connected.clear()
+                self._lost.set()
+            if self._closed:
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _RECONNECT_MAX_DELAY_SECONDS)
+
+    def _on_transport_error(self, error: Exception) -> None:
+        if _is_connection_error(error):
+            self.mark_broken()
+
+    async def _serve(self) -> None:
+        async with MCPClient(mcp_server_url=self.server_url, on_transport_error=self._on_transport_error) as client:
+            self.client = client
+            self._lost = asyncio.Event()
+            self._broken.clear()
+            self._connected.set()
+            await self._broken.wait()
+
+
+class MCPClientPool:
+    """
+    Pool of MCP sessions to one server with the same interface as MCPClient.
+    Calls are dispatched to the least loaded connected session, each session has a cap of in-flight calls.
+    Sessions are health checked with ping in background and reconnected with backoff when broken. A call that failed
+    because of lost connection is retried once on another session only if it is idempotent (listing tools, reading
+    resources, calls of tools annotated as read-only or idempotent), other calls may already have had side effects.
+    """
+
+    def __init__(
+            self,
+            mcp_server_url: str,
+            size: int = MCP_POOL_SIZE,
+            max_in_flight_per_session: int = MCP_MAX_IN_FLIGHT_PER_SESSION,
+            health_check_interval: float = MCP_HEALTH_CHECK_INTERVAL_SECONDS,
+    ) -> None:
+        self.server_url = mcp_server_url
+        self.health_check_interval = health_check_interval
+        self._sessions = [
+            _PooledSession(mcp_server_url, session_number, max_in_flight_per_session)
+            for session_number in range(size)
+        ]
+        self._health_check_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def create(cls, mcp_server_url: str, **kwargs) -> 'MCPClientPool':
+        """Async factory method to create pool and connect all its sessions concurrently"""
+        pool = cls(mcp_server_url=mcp_server_url, **kwargs)
+        await pool.connect()
+        return pool
+
+    async def connect(self) -> None:
+        """Connect sessions, at least one of them must be connected"""
+        for session in self._sessions:
+            session.start()
+        connected = await asyncio.gather(
+            *(session.wait_connected(_CONNECT_TIMEOUT_SECONDS) for session in self._sessions)
+        )
+        if not any(connected):
+            await self.close()
+            raise MCPPoolUnavailableError(f"Unable to connect to MCP server {self.server_url}")
+        _log.info("mcp.pool.connected", server_url=self.server_url, sessions=sum(connected), size=len(self._sessions))
+        if self.health_check_interval > 0:
+            self._health_check_task = asyncio.create_task(self._health_check_loop())
+
+    async def get_tools(self) -> list[MCPToolModel]:
+        """Get available tools from MCP server"""
+        return await self._dispatch(lambda client: client.get_tools(), idempotent=True)
+
+    async def call_tool(self, tool_name: str, tool_args: dict[str, Any], idempotent: bool = False) -> Any:
+        """Call a tool on the MCP server, only `idempotent` calls are retried when connection is lost"""
+        return await self._dispatch(lambda client: client.call_tool(tool_name, tool_args), idempotent=idempotent)
+
+    async def get_resource(self, uri: AnyUrl) -> str | bytes:
+        """Get specific resource content"""
+        return await self._dispatch(lambda client: client.get_resource(uri), idempotent=True)
+
+    @property
+    def in_flight(self) -> int:
+        return sum(session.in_flight for session in self._sessions)
+
+    @property
+    def connected_sessions(self) -> int:
+        return sum(1 for session in self._sessions if session.is_connected)
+
+    async def close(self) -> None:
+        """Close all sessions"""
+        if self._health_check_task:
+            self._health_check_task.cancel()
+            self._health_check_task = None
+        await asyncio.gather(*(session.close() for session in self._sessions), return_exceptions=True)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+        return False
+
+    async def _dispatch(self, operation, idempotent: bool) -> Any:
+        attempted: set[int] = set()
+        while True:
+            session = self._pick_session(exclude=attempted)
+            attempted.add(session.session_number)
+            try:
+                return await session.call(operation)
+            except MCPPoolUnavailableError:
+                # Session was disconnected while waiting for a free slot
+                continue
+            except Exception as e:
+                if not _is_connection_error(e):
+                    raise
+                session.mark_broken()
+                if not idempotent or len(attempted) >= 2 or not self._has_connected(exclude=attempted):
+                    raise
+
+    def _pick_session(self, exclude: set[int]) -> _PooledSession:
+        candidates = [
+            session for session in self._sessions
+            if session.is_connected and session.session_number not in exclude
+        ]
+        if not candidates:
+            raise MCPPoolUnavailableError(f"No connected MCP sessions to {self.server_url}")
+        return min(candidates, key=lambda session: session.in_flight)
+
+    def _has_connected(self, exclude: set[int]) -> bool:
+        return any(session.is_connected and session.session_number not in exclude for session in self._sessions)
+
+    async def _health_check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await asyncio.gather(*(session.ping() for session in self._sessions if session.is_connected))
@@ -0,0 +1,146 @@
+import asyncio
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Tuple
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL = timedelta(minutes=10)
+
+
+@dataclass
+class _CacheEntry:
+    result: str
+    expires_at: datetime
+    size: int
+
+
+class MCPResultCache:
+    """
+    LRU cache of MCP tool results keyed by tool name and canonical JSON of arguments, bounded by total size of stored
+    results. TTL is configured per tool, only tools with configured TTL are cached, so stateful tools (e.g. code
+    interpreter) must never be configured here.
+    Concurrent identical calls are deduplicated: only the first one goes to MCP server, others wait for its result.
+    """
+
+    def __init__(self, tool_ttls: dict[str, timedelta], max_bytes: int = DEFAULT_MAX_BYTES):
+        self.tool_ttls = tool_ttls
+        self.max_bytes = max_bytes
+        self._cache: OrderedDict[Tuple[str, str], _CacheEntry] = OrderedDict()
+        self._in_flight: dict[Tuple[str, str], asyncio.Future] = {}
+        self._current_bytes = 0
+
+    def is_cached_tool(self, tool_name: str) -> bool:
+        return tool_name in self.tool_ttls
+
+    async def get_or_call(
+            self,
+            tool_name: str,
+            arguments: dict[str, Any],
+            call: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        Return cached result of tool call or make the call and cache its result.
+
+        Args:
+            tool_name: MCP tool name
+            arguments: Tool call arguments
+            call: Makes actual tool call, result is cached only if it is a string. Failed calls (including tool
+                errors reported by MCP server, see MCPToolError) are never cached
+
+        Returns:
+            Tool call result
+        """
+        ttl = self.tool_ttls.get(tool_name)
+        if ttl is None:
+            return await call()
+
+        key = (tool_name, self.canonical_arguments(arguments))
+        while True:
+            entry = self._get(key)
+            if entry is not None:
+                return entry.result
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+            try:
+                # `shield` so cancellation of one waiter doesn't cancel the call for others
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled():
+                    raise
+                # The caller that made the call was cancelled, the call is made again
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await call()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Waiters re-raise it, the exception is not considered unretrieved
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if isinstance(result, str):
+                self._set(key, result, ttl)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def clear(self) -> None:
+        """Clear all cached entries."""
+        self._cache.clear()
+        self._current_bytes = 0
+
+    def size(self) -> int:
+        """Return the number of cached entries."""
+        return len(self._cache)
+
+    @staticmethod
+    def canonical_arguments(arguments: dict[str, Any]) -> str:
+        return json.dumps(arguments, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+    def _get(self, key: Tuple[str, str]) -> _CacheEntry | None:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if datetime.now() >= entry.expires_at:
+            self._remove(key)
+            return None
+        self._cache.move_to_end(key)
+        return entry
+
+    def _set(self, key: Tuple[str, str], result: str, ttl: timedelta) -> None:
+        size = len(result.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self._cache[key] = _CacheEntry(result=result, expires_at=datetime.now() + ttl, size=size)
+        self._current_bytes += size
+        while self._current_bytes > self.max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._current_bytes -= evicted.size
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        entry = self._cache.pop(key, None)
+        if entry:
+            self._current_bytes -= entry.size
+
+
+def parse_tool_ttls(value: str, default_ttl: timedelta = DEFAULT_TTL) -> dict[str, timedelta]:
+    """
+    Parse cached tools configuration, e.g. `search:300,fetch_content:3600` (TTL in seconds is optional).
+    """
+    tool_ttls: dict[str, timedelta] = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        tool_name, _, ttl_seconds = item.partition(':')
+        tool_ttls[tool_name.strip()] = timedelta(seconds=float(ttl_seconds)) if ttl_seconds else default_ttl
+    return tool_ttls
@@ -1,29 +1,39 @@
 import json
-from typing import Any
+from typing import Any, Optional
 
 from aidial_sdk.chat_completion import Message
 
 from task.tools.base import BaseTool
-from task.tools.mcp.mcp_client import MCPClient
+from task.tools.mcp.mcp_client_pool import MCPClientPool
+from task.tools.mcp.mcp_result_cache import MCPResultCache
 from task.tools.mcp.mcp_tool_model import MCPToolModel
 from task.tools.models import ToolCallParams
 
 
 class MCPTool(BaseTool):
 
-    def __init__(self, client: MCPClient, mcp_tool_model: MCPToolModel):
+    def __init__(self, client: MCPClientPool, mcp_tool_model: MCPToolModel,
+                 result_cache: Optional[MCPResultCache] = None):
         # 1. Set client
         # 2. Set mcp_tool_model
+        # 3. Set result_cache (optional), it caches results only of tools configured in it
         self.client = client
         self.mcp_tool_model = mcp_tool_model
+        self.result_cache = result_cache
 
     async def _execute(self, tool_call_params: ToolCallParams) -> str | Message:
         # 1. Load arguments wit `json`
-        # 2. Get content with mcp client tool call
+        # 2. Get content with mcp client tool call (through `result_cache` if it is set)
         # 3. Append retrieved content to stage
         # 4. return content
         arguments = json.loads(tool_call_params.tool_call.function.arguments)
-        content = await self.client.call_tool(self.name, arguments)
+        idempotent = self.mcp_tool_model.idempotent
+        if self.result_cache:
+            content = await self.result_cache.get_or_call(
+                self.name, arguments, lambda: self.client.call_tool(self.name, arguments, idempotent=idempotent)
+            )
+        else:
+            content = await self.client.call_tool(self.name, arguments, idempotent=idempotent)
         tool_call_params.stage.append_content(content)
         return content
 
@@ -7,3 +7,5 @@ class MCPToolModel(BaseModel):
     name: str
     description: str
     parameters: dict[str, Any]
+    # Tool is annotated by MCP server as read-only or idempotent, so its call can be safely repeated
+    idempotent: bool = False
@@ -1,16 +1,38 @@
-import base64
+import asyncio
+import binascii
 import json
+import os
+import tempfile
+from io import BufferedReader
 from typing import Any, Optional
 
-from aidial_client import Dial
-from aidial_sdk.chat_completion import Message, Attachment
+from aidial_sdk.chat_completion import Message, Attachment, Stage
 from pydantic import StrictStr, AnyUrl
 
 from task.tools.base import BaseTool
-from task.tools.py_interpreter._response import _ExecutionResult
-from task.tools.mcp.mcp_client import MCPClient
+from task.tools.py_interpreter._response import _ExecutionResult, _FileReference
+from task.tools.py_interpreter.session_manager import InterpreterSessionManager, session_id_argument
+from task.tools.mcp.mcp_client_pool import MCPClientPool
 from task.tools.mcp.mcp_tool_model import MCPToolModel
 from task.tools.models import ToolCallParams
+from task.utils.dial_clients import get_async_dial_client
+from task.utils.executors import get_thread_executor
+from task.utils.logger import get_logger
+from task.utils.tokens import count_tokens
+from task.utils.tool_result_store import truncate_head_tail
+
+MAX_INTERPRETER_FILE_SIZE_BYTES = int(os.getenv('MAX_INTERPRETER_FILE_SIZE_BYTES', 50 * 1024 * 1024))
+MAX_CONCURRENT_FILE_UPLOADS = int(os.getenv('MAX_CONCURRENT_FILE_UPLOADS', 4))
+INTERPRETER_WARM_SESSIONS = int(os.getenv('INTERPRETER_WARM_SESSIONS', 2))
+INTERPRETER_SESSION_TTL_SECONDS = float(os.getenv('INTERPRETER_SESSION_TTL_SECONDS', 1800))
+_TEXT_MIME_TYPES = ('application/json', 'application/xml')
+_IN_MEMORY_DECODE_MAX_CHARS = 4 * 1024 * 1024
+# Multiple of 4, so each chunk is decoded independently
+_BASE64_CHUNK_CHARS = 4 * 64 * 1024
+# Entries of execution result are not trimmed shorter than that when result is compacted into its token budget
+_MIN_ENTRY_TOKENS = 32
+
+_log = get_logger(__name__)
 
 
 class PythonCodeInterpreterTool(BaseTool):
@@ -22,14 +44,16 @@ class PythonCodeInterpreterTool(BaseTool):
 
     def __init__(
             self,
-            mcp_client: MCPClient,
+            mcp_client: MCPClientPool,
             mcp_tool_models: list[MCPToolModel],
             tool_name: str,
             dial_endpoint: str,
+            session_manager: Optional[InterpreterSessionManager] = None,
     ):
         """
         :param tool_name: it must be actual name of tool that executes code. It is 'execute_code'.
             https://github.com/khshanovskyi/mcp-python-code-interpreter/blob/main/interpreter/server.py#L303
+        :param session_manager: keeps sessions of conversations, if not set session is managed by LLM only
         """
         # 1. Set dial_endpoint
         # 2. Set mcp_client
@@ -44,6 +68,7 @@ class PythonCodeInterpreterTool(BaseTool):
                 self._code_execute_tool = tool_model
         if self._code_execute_tool is None:
             raise ValueError(f"Tool with name {tool_name} not found in MCP tools")
+        self.session_manager = session_manager
 
     @classmethod
     async def create(
@@ -51,17 +76,33 @@ class PythonCodeInterpreterTool(BaseTool):
             mcp_url: str,
             tool_name: str,
             dial_endpoint: str,
+            warm_sessions: int = INTERPRETER_WARM_SESSIONS,
     ) -> 'PythonCodeInterpreterTool':
         """Async factory method to create PythonCodeInterpreterTool"""
-        # 1. Create MCPClient
+        # 1. Create MCPClientPool
         # 2. Get tools
-        # 3. Create PythonCodeInterpreterTool instance and return it
-        mcp_client = await MCPClient.create(mcp_server_url=mcp_url)
+        # 3. Create InterpreterSessionManager and start warming up sessions in background
+        # 4. Create PythonCodeInterpreterTool instance and return it
+        mcp_client = await MCPClientPool.create(mcp_server_url=mcp_url)
         mcp_tools = await mcp_client.get_tools()
-        return cls(mcp_client=mcp_client,
+        tool_parameters = next((tool.parameters for tool in mcp_tools if tool.name == tool_name), {})
+        session_manager = InterpreterSessionManager(mcp_client=mcp_client,
+                                                    tool_name=tool_name,
+                                                    warm_sessions=warm_sessions,
+                                                    session_ttl_seconds=INTERPRETER_SESSION_TTL_SECONDS,
+                                                    tool_parameters=tool_parameters)
+        tool = cls(mcp_client=mcp_client,
                    mcp_tool_models=mcp_tools,
                    tool_name=tool_name,
-                   dial_endpoint=dial_endpoint)
+                   dial_endpoint=dial_endpoint,
+                   session_manager=session_manager)
+        session_manager.start()
+        return tool
+
+    async def close(self) -> None:
+        if self.session_manager:
+            await self.session_manager.close()
+        await self.mcp_client.close()
 
     @property
     def show_in_stage(self) -> bool:
@@ -86,7 +127,8 @@ class PythonCodeInterpreterTool(BaseTool):
     async def _execute(self, tool_call_params: ToolCallParams) -> str | Message:
         # 1. Load arguments with `json`
         # 2. Get `code` from arguments
-        # 3. Get `session_id` from arguments (it is optional parameter, use get method)
+        # 3. Get `session_id` from arguments (it is optional parameter, use get method). If LLM didn't provide it then
+        #    take session of conversation from `session_manager` (bound or pre-warmed one) and set it to arguments
         # 4. Get stage from `tool_call_params`
         # 5. Append content to stage: "## Request arguments: \n"
         # 6. Append content to stage: `"```python\n\r{code}\n\r```\n\r"` it will show code in stage as python markdown
@@ -97,21 +139,10 @@ class PythonCodeInterpreterTool(BaseTool):
         # 9. Load retrieved response as json (️⚠️ here can be potential issues if you didn't properly implemented
         #    MCPClient tool call, it must return string)
         # 10. Validate result with _ExecutionResult (it is full copy of https://github.com/khshanovskyi/mcp-python-code-interpreter/blob/main/interpreter/models.py)
-        # 11. If execution_result contains files we need to pool files from PyInterpreter and upload them to DIAL bucked:
-        #       - Create Dial client
-        #       - Get with client `my_appdata_home` path as `files_home`
-        #       - Iterated through files and:
-        #           - get file name and mime_type and assign to appropriate variables
-        #           - get resource with mcp client by URL from file (https://github.com/khshanovskyi/mcp-python-code-interpreter/blob/main/interpreter/server.py#L429)
-        #           - according to MCP binary resources must be encoded with base64 https://modelcontextprotocol.io/specification/2025-06-18/server/resources#binary-content
-        #             Check if mime_type starts with `text/` or some of 'application/json', 'application/xml', is yes
-        #             then encode resource with 'utf-8' format (text will be present as bytes to upload to DIAL bucket).
-        #             Otherwise (binary file) decode it with `b64decode`
-        #           - Prepare URL to upload downloaded file: f"files/{(files_home / file_name).as_posix()}"
-        #           - Upload file with DIAL client
-        #           - Prepare Attachment with url, type (mime_type), and title (file_name)
-        #           - Add attachment to stage and also add this attachment to choice (it will be shown in both stage and choice)
-        #       - Add to execution_result json addition
+        #     and bind session from result to conversation
+        # 11. If execution_result contains files we need to pool files from PyInterpreter and upload them to DIAL bucked
+        #     (see `_upload_files`, files are processed concurrently), then add attachments to stage and choice (it
+        #     will be shown in both stage and choice)
         # 12. Check if execution_result output present and if yes iterate through all output results and cut it length
         #     to 1000 chars, it is needed to avoid high costs and context window overload
         # 13. Append to stage response f"```json\n\r{execution_result.model_dump_json(indent=2)}\n\r```\n\r"
@@ -119,6 +150,11 @@ class PythonCodeInterpreterTool(BaseTool):
         arguments = json.loads(tool_call_params.tool_call.function.arguments)
         code = arguments.get("code", "")
         session_id = arguments.get("session_id", None)
+        conversation_id = tool_call_params.conversation_id
+        if (session_id is None or session_id == 0) and self.session_manager:
+            session_id = self.session_manager.acquire(conversation_id)
+            if session_id is not None:
+                arguments["session_id"] = self._session_id_argument(session_id)
         stage = tool_call_params.stage
         stage.append_content("## Request arguments: \n")
         stage.append_content(f"```python\n\r{code}\n\r```\n\r")
@@ -132,37 +168,11 @@ class PythonCodeInterpreterTool(BaseTool):
         )
         execution_result_json = json.loads(tool_result)
         execution_result = _ExecutionResult.model_validate(execution_result_json)
+        if self.session_manager and execution_result.session_info:
+            self.session_manager.bind(conversation_id, execution_result.session_info.session_id)
         if execution_result.files and len(execution_result.files) > 0:
-            dial_client = Dial(
-                base_url=self.dial_endpoint,
-                api_key=tool_call_params.api_key,
-            )
-            files_home = await dial_client.files.get_appdata_home()
-
-            for file in execution_result.files:
-                file_name = file.name
-                mime_type = file.mime_type
-
-                resource_bytes = await self.mcp_client.get_resource(uri=file.url)
-
-                if mime_type.startswith("text/") or mime_type in ['application/json', 'application/xml']:
-                    file_bytes = resource_bytes.encode('utf-8')
-                else:
-                    file_bytes = base64.b64decode(resource_bytes)
-
-                upload_url = f"files/{(files_home / file_name).as_posix()}"
-
-                dial_client.files.upload(
-                    url=upload_url,
-                    file_bytes=file_bytes
-                )
-
-                attachment = Attachment(
-                    url=StrictStr(upload_url),
-                    type=StrictStr(mime_type),
-                    title=StrictStr(file_name)
-                )
-
+            attachments = await self._upload_files(execution_result.files, tool_call_params.api_key, stage)
+            for attachment in attachments:
                 stage.add_attachment(attachment)
                 tool_call_params.choice.add_attachment(attachment)
 
@@ -174,3 +184,126 @@ class PythonCodeInterpreterTool(BaseTool):
         stage.append_content(f"```json\n\r{execution_result.model_dump_json(indent=2)}\n\r```\n\r")
 
         return StrictStr(execution_result.model_dump_json())
+
+    def _compact_result(self, content: str, max_tokens: int, placeholder: str) -> Optional[str]:
+        # Result is JSON of `_ExecutionResult`, so long entries of output and traceback and long result and error are
+        # trimmed instead of cutting JSON in the middle, limits are halved until result fits into `max_tokens`
+        try:
+            execution_result = _ExecutionResult.model_validate_json(content)
+        except ValueError:
+            return None
+        entry_tokens = max_tokens
+        max_entries = max(len(execution_result.output), len(execution_result.traceback), 2)
+        while True:
+            compacted = execution_result.model_copy(update={
+                "output": _trim_entries(execution_result.output, max_entries, entry_tokens),
+                "traceback": _trim_entries(execution_result.traceback, max_entries, entry_tokens),
+                "result": _trim_entry(execution_result.result, entry_tokens),
+                "error": _trim_entry(execution_result.error, entry_tokens),
+            })
+            compacted_json = json.dumps({**compacted.model_dump(mode='json'), "truncated": placeholder})
+            if count_tokens(compacted_json) <= max_tokens or (entry_tokens <= _MIN_ENTRY_TOKENS and max_entries <= 2):
+                return compacted_json
+            entry_tokens = max(entry_tokens // 2, _MIN_ENTRY_TOKENS)
+            max_entries = max(max_entries // 2, 2)
+
+    def _session_id_argument(self, session_id: Any) -> Any:
+        return session_id_argument(session_id, self.parameters)
+
+    async def _upload_files(self, files: list[_FileReference], api_key: str, stage: Stage) -> list[Attachment]:
+        # 1. Get AsyncDial client sharing connection pool of the process
+        # 2. Get with client `my_appdata_home` path as `files_home`
+        # 3. Upload files concurrently (no more than MAX_CONCURRENT_FILE_UPLOADS at once), each file:
+        #   - files larger than MAX_INTERPRETER_FILE_SIZE_BYTES are skipped without fetching them
+        #   - get resource with mcp client by URI from file (https://github.com/khshanovskyi/mcp-python-code-interpreter/blob/main/interpreter/server.py#L429)
+        #   - according to MCP binary resources must be encoded with base64 https://modelcontextprotocol.io/specification/2025-06-18/server/resources#binary-content
+        #     If mime_type starts with `text/` or is one of 'application/json', 'application/xml' then encode resource
+        #     with 'utf-8', otherwise decode it from base64 (see `_decode_resource`)
+        #   - Upload file with DIAL client to f"files/{(files_home / file_name).as_posix()}"
+        #   - Prepare Attachment with url, type (mime_type), and title (file_name)
+        # 4. Return attachments in order of files, failed files are reported to stage and skipped
+        dial_client = get_async_dial_client(self.dial_endpoint, api_key=api_key)
+        files_home = await dial_client.my_appdata_home()
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_FILE_UPLOADS)
+
+        async def upload(file: _FileReference) -> Attachment:
+            if file.size > MAX_INTERPRETER_FILE_SIZE_BYTES:
+                raise ValueError(f"file has {file.size} bytes, max allowed size is {MAX_INTERPRETER_FILE_SIZE_BYTES}")
+            async with semaphore:
+                resource = await self.mcp_client.get_resource(uri=AnyUrl(file.uri))
+                file_content = await get_thread_executor().run(_decode_resource, resource, file.mime_type)
+                del resource
+                try:
+                    upload_url = f"files/{(files_home / file.name).as_posix()}"
+                    await dial_client.files.upload(url=upload_url, file=(file.name, file_content))
+                finally:
+                    if isinstance(file_content, BufferedReader):
+                        file_content.close()
+            return Attachment(
+                url=StrictStr(upload_url),
+                type=StrictStr(file.mime_type),
+                title=StrictStr(file.name)
+            )
+
+        results = await asyncio.gather(*(upload(file) for file in files), return_exceptions=True)
+        attachments: list[Attachment] = []
+        for file, result in zip(files, results):
+            if isinstance(result, BaseException):
+                _log.warning("interpreter.file_upload_failed", file=file.name, error=repr(result))
+                stage.append_content(f"Unable to upload file `{file.name}`: {result}\n\r")
+            else:
+                attachments.append(result)
+        return attachments
+
+
+def _trim_entry(entry: Optional[str], max_tokens: int) -> Optional[str]:
+    if entry is None:
+        return None
+    return truncate_head_tail(entry, max_tokens, "...[truncated]...")
+
+
+def _trim_entries(entries: list[str], max_entries: int, max_tokens: int) -> list[str]:
+    """Trim each entry to `max_tokens`, only first and last entries are kept when there are more than `max_entries`"""
+    if len(entries) > max_entries:
+        head = (max_entries + 1) // 2
+        tail = max_entries - head
+        skipped = len(entries) - max_entries
+        entries = [*entries[:head], f"...[{skipped} entries are truncated]...", *entries[len(entries) - tail:]]
+    return [_trim_entry(entry, max_tokens) for entry in entries]
+
+
+def _decode_resource(resource: str | bytes, mime_type: str) -> bytes | BufferedReader:
+    """
+    Convert MCP resource into file content for upload. Text resources are encoded with utf-8, binary ones are base64
+    decoded. Large binary resources are decoded chunk by chunk into a temporary file, which is streamed on upload,
+    so they are not held in memory twice.
+    """
+    if isinstance(resource, bytes):
+        content = resource
+    elif mime_type.startswith("text/") or mime_type in _TEXT_MIME_TYPES:
+        content = resource.encode('utf-8')
+    else:
+        # Decoded size is known from base64 length, check it before decoding
+        if len(resource) * 3 // 4 > MAX_INTERPRETER_FILE_SIZE_BYTES + 2:
+            raise ValueError(f"file exceeds max allowed size of {MAX_INTERPRETER_FILE_SIZE_BYTES} bytes")
+        if len(resource) <= _IN_MEMORY_DECODE_MAX_CHARS:
+            return binascii.a2b_base64(resource)
+        return _decode_base64_to_file(resource)
+
+    if len(content) > MAX_INTERPRETER_FILE_SIZE_BYTES:
+        raise ValueError(f"file exceeds max allowed size of {MAX_INTERPRETER_FILE_SIZE_BYTES} bytes")
+    return content
+
+
+def _decode_base64_to_file(resource: str) -> BufferedReader:
+    with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+        try:
+            for start in range(0, len(resource), _BASE64_CHUNK_CHARS):
+                tmp_file.write(binascii.a2b_base64(resource[start:start + _BASE64_CHUNK_CHARS]))
+        except BaseException:
+            os.unlink(tmp_file.name)
+            raise
+    reader = open(tmp_file.name, 'rb')
+    # File is not visible anymore, but stays readable until reader is closed
+    os.unlink(tmp_file.name)
+    return reader
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from task.tools.mcp.mcp_client_pool import MCPClientPool
+from task.tools.py_interpreter._response import _ExecutionResult
+from task.utils.logger import get_logger
+
+WARM_UP_CODE = """
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+"""
+_MAX_CONVERSATIONS = 10_000
+# Failed warm-up is retried with exponential backoff, after the last attempt the pool isn't refilled for the max delay
+_WARM_UP_MAX_ATTEMPTS = 5
+_WARM_UP_RETRY_DELAY_SECONDS = 5.0
+_WARM_UP_MAX_RETRY_DELAY_SECONDS = 300.0
+
+_log = get_logger(__name__)
+
+
+class _WarmUpError(Exception):
+    """Warm-up code failed, `session_id` is the session it was executed in (if interpreter created one)."""
+
+    def __init__(self, message: str, session_id: Optional[Any]):
+        super().__init__(message)
+        self.session_id = session_id
+
+
+def session_id_argument(session_id: Any, tool_parameters: dict[str, Any]) -> Any:
+    """Interpreter returns session_id as string, but its tool schema may declare it as integer"""
+    session_id_schema = tool_parameters.get("properties", {}).get("session_id", {})
+    if session_id_schema.get("type") == "integer" and str(session_id).isdigit():
+        return int(session_id)
+    return session_id
+
+
+class InterpreterSessionManager:
+    """
+    Keeps conversation_id -> session_id affinity, so every code execution of a conversation runs in the same kernel
+    without relying on LLM to pass `session_id`, and a small pool of pre-warmed sessions (with pandas, numpy and
+    matplotlib already imported) that are handed out to conversations on their first execution.
+    Sessions are expired by the interpreter server when idle, so bound and warm sessions are forgotten after
+    `session_ttl_seconds` of inactivity.
+    """
+
+    def __init__(
+            self,
+            mcp_client: MCPClientPool,
+            tool_name: str,
+            warm_sessions: int,
+            session_ttl_seconds: float,
+            warm_up_code: str = WARM_UP_CODE,
+            tool_parameters: Optional[dict[str, Any]] = None,
+    ):
+        self.mcp_client = mcp_client
+        self.tool_name = tool_name
+        self.tool_parameters = tool_parameters or {}
+        self.warm_sessions = warm_sessions
+        self.session_ttl_seconds = session_ttl_seconds
+        self.warm_up_code = warm_up_code
+        # conversation_id -> (session_id, last used monotonic time)
+        self._bindings: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        # (session_id, created monotonic time)
+        self._warm: list[tuple[Any, float]] = []
+        # Sessions of warm-ups that gave up, interpreter has no way to terminate them, so next refill reuses them
+        self._failed: list[tuple[Any, float]] = []
+        self._warming = 0
+        # Monotonic time before which pool is not refilled, set when warm-up keeps failing
+        self._refill_after = 0.0
+        self._tasks: set[asyncio.Task] = set()
+        self._closed = False
+
+    def start(self) -> None:
+        """Start filling pool of warm sessions in background"""
+        self._refill()
+
+    def acquire(self, conversation_id: str) -> Optional[Any]:
+        """
+        Return session bound to conversation, or bind a warm session to it.
+
+        Returns:
+            session_id or None if a new session should be created by the interpreter
+        """
+        if not conversation_id:
+            return None
+        now = time.monotonic()
+        binding = self._bindings.get(conversation_id)
+        if binding and now - binding[1] < self.session_ttl_seconds:
+            self._bindings[conversation_id] = (binding[0], now)
+            self._bindings.move_to_end(conversation_id)
+            return binding[0]
+
+        session_id = self._take_session(self._warm, now)
+        if session_id is not None:
+            self.bind(conversation_id, session_id)
+        self._refill()
+        return session_id
+
+    def bind(self, conversation_id: str, session_id: Any) -> None:
+        """Bind session to conversation, it is called with the session actually used by the interpreter"""
+        if not conversation_id or session_id is None:
+            return
+        self._bindings[conversation_id] = (session_id, time.monotonic())
+        self._bindings.move_to_end(conversation_id)
+        while len(self._bindings) > _MAX_CONVERSATIONS:
+            self._bindings.popitem(last=False)
+
+    @property
+    def warm_count(self) -> int:
+        return len(self._warm)
+
+    async def close(self) -> None:
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _take_session(self, sessions: list[tuple[Any, float]], now: float) -> Optional[Any]:
+        while sessions:
+            session_id, created = sessions.pop(0)
+            if now - created < self.session_ttl_seconds:
+                return session_id
+        return None
+
+    def _refill(self) -> None:
+        if self._closed or time.monotonic() < self._refill_after:
+            return
+        missing = self.warm_sessions - len(self._warm) - self._warming
+        for _ in range(max(0, missing)):
+            self._warming += 1
+            task = asyncio.create_task(self._warm_up())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _warm_up(self) -> None:
+        # 1. Warm-up is attempted at most `_WARM_UP_MAX_ATTEMPTS` times with exponential backoff between attempts
+        # 2. Session created by a failed attempt is reused by the next one, so failures don't leave idle kernels
+        # 3. When all attempts failed the pool is not refilled until the max retry delay is over, the session of the
+        #    last attempt is kept and the next refill starts with it
+        session_id = self._take_session(self._failed, time.monotonic())
+        delay = _WARM_UP_RETRY_DELAY_SECONDS
+        try:
+            for attempt in range(1, _WARM_UP_MAX_ATTEMPTS + 1):
+                if self._closed:
+                    return
+                try:
+                    session_id = await self._create_session(session_id)
+                    self._warm.append((session_id, time.monotonic()))
+                    return
+                except _WarmUpError as e:
+                    session_id = e.session_id or session_id
+                    error = e
+                except Exception as e:
+                    # Session may be gone, e.g. interpreter was restarted
+                    session_id = None
+                    error = e
+                _log.warning(
+                    "interpreter.warm_up_failed",
+                    attempt=attempt,
+                    max_attempts=_WARM_UP_MAX_ATTEMPTS,
+                    retry_in_seconds=delay if attempt < _WARM_UP_MAX_ATTEMPTS else None,
+                    error=str(error),
+                )
+                if attempt < _WARM_UP_MAX_ATTEMPTS:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, _WARM_UP_MAX_RETRY_DELAY_SECONDS)
+            self._refill_after = time.monotonic() + _WARM_UP_MAX_RETRY_DELAY_SECONDS
+            if session_id is not None:
+                self._failed.append((session_id, time.monotonic()))
+            _log.error("interpreter.warm_up_gave_up", retry_in_seconds=_WARM_UP_MAX_RETRY_DELAY_SECONDS)
+        finally:
+            self._warming -= 1
+
+    async def _create_session(self, session_id: Optional[Any] = None) -> Any:
+        tool_args: dict[str, Any] = {"code": self.warm_up_code}
+        if session_id is not None:
+            tool_args["session_id"] = session_id_argument(session_id, self.tool_parameters)
+        tool_result = await self.mcp_client.call_tool(tool_name=self.tool_name, tool_args=tool_args)
+        execution_result = _ExecutionResult.model_validate(json.loads(tool_result))
+        created_session_id = execution_result.session_info.session_id if execution_result.session_info else None
+        if not execution_result.success or created_session_id is None:
+            raise _WarmUpError(execution_result.error or "interpreter returned no session", created_session_id)
+        return created_session_id
@@ -0,0 +1,138 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Tuple
+
+from task.tools.rag.chunk_store import ChunkStore
+from task.utils.logger import get_logger
+
+_log = get_logger(__name__)
+
+
+class DocumentCacheBackend(ABC):
+    """Secondary storage tier of `DocumentCache`. Receives entries evicted from memory and serves them on miss."""
+
+    @abstractmethod
+    def get(self, key: str) -> Tuple[Any, Any] | None:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, index: Any, chunks: Any) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+    def entries(self) -> dict[str, datetime]:
+        """Keys of stored entries with the time they were stored. Used to warm up cache after restart."""
+        return {}
+
+
+class InMemoryDocumentCacheBackend(DocumentCacheBackend):
+    """Plain dict backend. Keeps spilled entries in process, mostly useful for local runs and debugging."""
+
+    def __init__(self):
+        self._entries: dict[str, Tuple[Any, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[Any, Any] | None:
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key: str, index: Any, chunks: Any) -> None:
+        with self._lock:
+            self._entries[key] = (index, chunks)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class DiskDocumentCacheBackend(DocumentCacheBackend):
+    """
+    Stores entries in a local directory: FAISS index as `{key}.faiss` (written with `faiss.write_index`) and chunks
+    as `{key}.chunks`. Keys are content hashes, so they are safe to use as file names.
+
+    Chunks are written as `ChunkStore` bytes: chunk offsets and page numbers followed by document text.
+    Indexes are memory-mapped on load where FAISS supports it, so only touched pages are read from disk.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _index_path(self, key: str) -> Path:
+        return self.directory / f"{key}.faiss"
+
+    def _chunks_path(self, key: str) -> Path:
+        return self.directory / f"{key}.chunks"
+
+    def get(self, key: str) -> Tuple[Any, Any] | None:
+        index_path = self._index_path(key)
+        chunks_path = self._chunks_path(key)
+        if not index_path.exists() or not chunks_path.exists():
+            return None
+        try:
+            return self._read_index(index_path), self._read_chunks(chunks_path)
+        except Exception as e:
+            _log.warning("document_cache.disk_entry_load_failed", key=key, error=repr(e))
+            self.delete(key)
+            return None
+
+    def set(self, key: str, index: Any, chunks: Any) -> None:
+        # Chunks are written last: entry is visible for `get` and `entries` only when both files are present
+        import faiss
+        self._write_atomically(self._index_path(key), lambda path: faiss.write_index(index, str(path)))
+        self._write_atomically(self._chunks_path(key), lambda path: self._write_chunks(path, chunks))
+
+    def delete(self, key: str) -> None:
+        self._chunks_path(key).unlink(missing_ok=True)
+        self._index_path(key).unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        for path in self.directory.glob("*.faiss"):
+            path.unlink(missing_ok=True)
+        for path in self.directory.glob("*.chunks"):
+            path.unlink(missing_ok=True)
+
+    def entries(self) -> dict[str, datetime]:
+        result: dict[str, datetime] = {}
+        for chunks_path in self.directory.glob("*.chunks"):
+            key = chunks_path.name.removesuffix(".chunks")
+            if self._index_path(key).exists():
+                result[key] = datetime.fromtimestamp(chunks_path.stat().st_mtime)
+        return result
+
+    @staticmethod
+    def _write_atomically(path: Path, write) -> None:
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_index(path: Path) -> Any:
+        import faiss
+        try:
+            return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Memory mapping is not supported for every index type
+            return faiss.read_index(str(path))
+
+    @staticmethod
+    def _write_chunks(path: Path, chunks: ChunkStore) -> None:
+        chunks.write(path)
+
+    @staticmethod
+    def _read_chunks(path: Path) -> ChunkStore:
+        return ChunkStore.read(path)
@@ -0,0 +1,177 @@
+from pathlib import Path
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+
+# File layout: magic, uint64 header (chunks count, text bytes, has pages), int64 starts, int64 ends, int32 pages (if
+# present) and document text as utf-8. Offsets are byte offsets in the text buffer
+_MAGIC = b'CHUNKS01'
+_HEADER = np.dtype([('count', '<u8'), ('text_bytes', '<u8'), ('has_pages', '<u8')])
+
+
+class Chunk:
+    """View of one chunk in `ChunkStore`, its text is decoded from document buffer on access"""
+    __slots__ = ('_store', 'index')
+
+    def __init__(self, store: 'ChunkStore', index: int):
+        self._store = store
+        self.index = index
+
+    @property
+    def start(self) -> int:
+        return int(self._store.starts[self.index])
+
+    @property
+    def end(self) -> int:
+        return int(self._store.ends[self.index])
+
+    @property
+    def text(self) -> str:
+        return str(self._store.buffer[self.start:self.end], 'utf-8')
+
+    @property
+    def page(self) -> Optional[int]:
+        """1-based page number of chunk beginning, None for documents without pages"""
+        pages = self._store.pages
+        return None if pages is None else int(pages[self.index])
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return f"Chunk(index={self.index}, start={self.start}, end={self.end}, page={self.page})"
+
+
+class ChunkStore:
+    """
+    Chunks of one document kept as the document text encoded once as utf-8 plus start/end byte offsets, so
+    overlapping chunks don't duplicate text, there is no per-chunk object overhead and text with a single non-latin
+    character doesn't take 2-4 bytes per character as `str`. Chunks are accessed as `Chunk` views created on demand.
+    """
+
+    def __init__(self, buffer: bytes | memoryview, starts: np.ndarray, ends: np.ndarray,
+                 pages: Optional[np.ndarray] = None):
+        self.buffer = buffer
+        self.starts = starts
+        self.ends = ends
+        self.pages = pages
+
+    @classmethod
+    def from_chunks(cls, text: str, chunks: Sequence[str], page_starts: Optional[Sequence[int]] = None) -> 'ChunkStore':
+        """
+        Create store from splitter `chunks` of `text`, `page_starts` are character offsets of pages in `text`
+        (ascending). Chunk strings are dropped after their offsets are found.
+        """
+        starts, ends, suffix = locate_chunks(text, chunks)
+        pages = None
+        if page_starts:
+            pages = np.searchsorted(np.asarray(page_starts, dtype=np.int64), starts, side='right').astype(np.int32)
+        buffer, byte_starts, byte_ends = _encode_with_offsets(text + suffix, starts, ends)
+        return cls(buffer, byte_starts, byte_ends, pages)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, index: int) -> Chunk:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Chunk index {index} is out of range")
+        return Chunk(self, index)
+
+    def __iter__(self) -> Iterator[Chunk]:
+        return (Chunk(self, index) for index in range(len(self)))
+
+    def texts(self, indices: Optional[Sequence[int]] = None) -> list[str]:
+        """Texts of chunks by `indices` (all chunks by default), they are copies, so keep them only temporarily"""
+        if indices is None:
+            indices = range(len(self))
+        return [str(self.buffer[self.starts[i]:self.ends[i]], 'utf-8') for i in indices]
+
+    @property
+    def nbytes(self) -> int:
+        pages_bytes = self.pages.nbytes if self.pages is not None else 0
+        return len(self.buffer) + self.starts.nbytes + self.ends.nbytes + pages_bytes
+
+    def to_bytes(self) -> bytes:
+        header = np.array([(len(self), len(self.buffer), self.pages is not None)], dtype=_HEADER)
+        parts = [_MAGIC, header.tobytes(), self.starts.astype('<i8').tobytes(), self.ends.astype('<i8').tobytes()]
+        if self.pages is not None:
+            parts.append(self.pages.astype('<i4').tobytes())
+        parts.append(bytes(self.buffer))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ChunkStore':
+        """Zero-copy: offset arrays and text buffer are views over `data`"""
+        if data[:len(_MAGIC)] != _MAGIC:
+            raise ValueError("Unsupported chunks format")
+        offset = len(_MAGIC)
+        header = np.frombuffer(data, dtype=_HEADER, count=1, offset=offset)[0]
+        offset += _HEADER.itemsize
+        count = int(header['count'])
+        starts = np.frombuffer(data, dtype='<i8', count=count, offset=offset)
+        offset += starts.nbytes
+        ends = np.frombuffer(data, dtype='<i8', count=count, offset=offset)
+        offset += ends.nbytes
+        pages = None
+        if header['has_pages']:
+            pages = np.frombuffer(data, dtype='<i4', count=count, offset=offset)
+            offset += pages.nbytes
+        buffer = memoryview(data)[offset:offset + int(header['text_bytes'])]
+        return cls(buffer, starts, ends, pages)
+
+    def __reduce__(self):
+        # Buffer read from disk is a memoryview that can't be pickled
+        return ChunkStore.from_bytes, (self.to_bytes(),)
+
+    def write(self, path: Path) -> None:
+        path.write_bytes(self.to_bytes())
+
+    @classmethod
+    def read(cls, path: Path) -> 'ChunkStore':
+        return cls.from_bytes(path.read_bytes())
+
+
+def locate_chunks(text: str, chunks: Sequence[str]) -> tuple[np.ndarray, np.ndarray, str]:
+    """
+    Find offsets of splitter `chunks` in `text`. Chunks are searched in order from the previous chunk start, since
+    they overlap. A chunk that is not a substring of `text` is appended after it, the returned suffix must be
+    appended to `text` (it is empty for RecursiveCharacterTextSplitter chunks).
+    """
+    starts = np.empty(len(chunks), dtype=np.int64)
+    ends = np.empty(len(chunks), dtype=np.int64)
+    suffix_parts: list[str] = []
+    suffix_length = 0
+    search_from = 0
+    for i, chunk in enumerate(chunks):
+        position = text.find(chunk, search_from)
+        if position < 0:
+            position = text.find(chunk)
+        if position < 0:
+            position = len(text) + suffix_length
+            suffix_parts.append(chunk)
+            suffix_length += len(chunk)
+        else:
+            search_from = position + 1
+        starts[i] = position
+        ends[i] = position + len(chunk)
+    return starts, ends, ''.join(suffix_parts)
+
+
+def _encode_with_offsets(text: str, starts: np.ndarray, ends: np.ndarray) -> tuple[bytes, np.ndarray, np.ndarray]:
+    """Encode `text` as utf-8 and convert character offsets to byte offsets"""
+    buffer = text.encode('utf-8')
+    if len(buffer) == len(text):
+        return buffer, starts, ends
+    positions = np.unique(np.concatenate([starts, ends]))
+    byte_positions = np.empty_like(positions)
+    byte_position = 0
+    previous = 0
+    for i, position in enumerate(positions.tolist()):
+        byte_position += len(text[previous:position].encode('utf-8'))
+        byte_positions[i] = byte_position
+        previous = position
+    return (buffer, byte_positions[np.searchsorted(positions, starts)],
+            byte_positions[np.searchsorted(positions, ends)])
+
@@ -1,30 +1,96 @@
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, time, timedelta
 from typing import Any, Tuple
 import threading
 
+from task.tools.rag.cache_backends import DocumentCacheBackend
+from task.tools.rag.chunk_store import ChunkStore
+from task.tools.rag.index_factory import index_memory_bytes
+from task.utils.logger import get_logger
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+_log = get_logger(__name__)
+
+
+@dataclass
+class _CacheEntry:
+    index: Any
+    chunks: ChunkStore
+    timestamp: datetime
+    size: int
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    current_bytes: int
+    max_bytes: int
+
+
+def estimate_entry_size(index: Any, chunks: ChunkStore) -> int:
+    """Approximate memory footprint of FAISS index (vectors, graph links, centroids) plus chunk store, in bytes."""
+    return index_memory_bytes(index) + chunks.nbytes
+
 
 class DocumentCache:
     """
     Thread-safe document cache with automatic cleanup at midnight.
     Removes entries older than 24 hours.
+
+    Entries are keyed by document content (see `RagTool`), so one index is shared by all conversations that
+    attached the same file. Conversations reach entries through a thin binding layer: a (conversation_id, file_url)
+    pair is bound to a content key once the conversation has downloaded the file itself.
+
+    Memory is bounded by `max_bytes`: least recently used entries are evicted once the budget is exceeded. Evicted
+    entries are moved to `spill_backend` (if configured) and promoted back to memory on the next access.
+    With `write_through` every new entry is stored in `spill_backend` right away, so a persistent backend keeps
+    indexes across restarts; `warm` registers such entries after startup.
     """
 
-    def __init__(self):
-        self._cache: dict[str, Tuple[Any, Any, datetime]] = {}
+    def __init__(
+            self,
+            max_bytes: int = DEFAULT_MAX_BYTES,
+            spill_backend: DocumentCacheBackend | None = None,
+            write_through: bool = False,
+    ):
+        self.max_bytes = max_bytes
+        self.spill_backend = spill_backend
+        self.write_through = write_through and spill_backend is not None
+        self._cache: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._spilled: dict[str, datetime] = {}
+        self._bindings: dict[Tuple[str, str], Tuple[str, datetime]] = {}
+        self._current_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
         self._lock = threading.Lock()
         self._cleanup_thread = None
+        self._warmup_thread = None
         self._stop_event = threading.Event()
         self._running = False
 
     @classmethod
-    def create(cls) ->'DocumentCache':
-        instance = cls()
+    def create(
+            cls,
+            max_bytes: int = DEFAULT_MAX_BYTES,
+            spill_backend: DocumentCacheBackend | None = None,
+            write_through: bool = False,
+            warm_up_entries: int = 0,
+    ) -> 'DocumentCache':
+        instance = cls(max_bytes=max_bytes, spill_backend=spill_backend, write_through=write_through)
         instance.start_cleanup_task()
+        if spill_backend:
+            instance.start_warmup_task(warm_up_entries)
         return instance
 
     def get(self, key: str) -> Tuple[Any, Any] | None:
         """
-        Retrieve a cached entry.
+        Retrieve a cached entry. Spilled entries are loaded from `spill_backend` and promoted to memory.
 
         Args:
             key: Cache key
@@ -33,30 +99,141 @@ class DocumentCache:
             Tuple of (index, chunks) if found and not expired, None otherwise
         """
         with self._lock:
-            if key in self._cache:
-                index, chunks, timestamp = self._cache[key]
-                if datetime.now() - timestamp < timedelta(hours=24):
-                    return (index, chunks)
-                else:
-                    del self._cache[key]
-            return None
+            entry = self._cache.get(key)
+            if entry:
+                if datetime.now() - entry.timestamp < timedelta(hours=24):
+                    self._cache.move_to_end(key)
+                    self._hits += 1
+                    return (entry.index, entry.chunks)
+                self._remove(key)
+            spilled_at = self._spilled.get(key)
 
-    def set(self, key: str, index: Any, chunks: Any) -> None:
+        if spilled_at:
+            spilled_data = None
+            if datetime.now() - spilled_at < timedelta(hours=24):
+                spilled_data = self.spill_backend.get(key)
+            if spilled_data:
+                index, chunks = spilled_data
+                self._put(key, index, chunks, spilled_at)
+                with self._lock:
+                    self._hits += 1
+                return (index, chunks)
+            self._drop_spilled(key)
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def set(self, key: str, index: Any, chunks: ChunkStore) -> None:
         """
-        Store an entry in the cache.
+        Store an entry in the cache, evicting least recently used entries if memory budget is exceeded.
 
         Args:
             key: Cache key
             index: FAISS index
             chunks: Document chunks
         """
+        timestamp = datetime.now()
+        self._put(key, index, chunks, timestamp)
+        if self.write_through:
+            self.spill_backend.set(key, index, chunks)
+            with self._lock:
+                self._spilled[key] = timestamp
+
+    def warm(self, preload: int = 0) -> int:
+        """
+        Register entries stored in `spill_backend` (e.g. by previous process run), so they are loaded lazily on
+        first access, and load the most recent of them into memory.
+
+        Args:
+            preload: Number of most recent entries to load into memory
+
+        Returns:
+            Number of registered entries
+        """
+        if not self.spill_backend:
+            return 0
+
+        cutoff_time = datetime.now() - timedelta(hours=24)
+        entries = {
+            key: timestamp for key, timestamp in self.spill_backend.entries().items()
+            if timestamp >= cutoff_time
+        }
+        with self._lock:
+            for key, timestamp in entries.items():
+                self._spilled.setdefault(key, timestamp)
+
+        # Load oldest first, so the most recent entries end up as the most recently used
+        most_recent = sorted(entries, key=entries.get, reverse=True)[:preload]
+        for key in reversed(most_recent):
+            if self._stop_event.is_set():
+                break
+            spilled_data = self.spill_backend.get(key)
+            if spilled_data:
+                self._put(key, spilled_data[0], spilled_data[1], entries[key])
+
+        if entries:
+            _log.info("document_cache.warmed", entries=len(entries), preloaded=len(most_recent))
+        return len(entries)
+
+    def bind(self, conversation_id: str, file_url: str, key: str) -> None:
+        """
+        Grant a conversation access to a cached entry.
+
+        Args:
+            conversation_id: Conversation that downloaded the file
+            file_url: URL of the file within the conversation
+            key: Content key of the cached entry
+        """
+        # Without conversation id the binding would be shared by every such request, bypassing per-user download
+        if not conversation_id:
+            return
         with self._lock:
-            self._cache[key] = (index, chunks, datetime.now())
+            self._bindings[(conversation_id, file_url)] = (key, datetime.now())
+
+    def resolve(self, conversation_id: str, file_url: str) -> str | None:
+        """
+        Resolve the content key bound to a conversation file.
+
+        Args:
+            conversation_id: Conversation id
+            file_url: URL of the file within the conversation
+
+        Returns:
+            Content key if the binding exists and is not expired, None otherwise (always None without conversation id)
+        """
+        if not conversation_id:
+            return None
+        with self._lock:
+            binding = self._bindings.get((conversation_id, file_url))
+            if binding:
+                key, timestamp = binding
+                if datetime.now() - timestamp < timedelta(hours=24):
+                    return key
+                del self._bindings[(conversation_id, file_url)]
+            return None
+
+    def stats(self) -> CacheStats:
+        """Return snapshot of cache counters."""
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                entries=len(self._cache),
+                current_bytes=self._current_bytes,
+                max_bytes=self.max_bytes,
+            )
 
     def clear(self) -> None:
         """Clear all cached entries."""
         with self._lock:
             self._cache.clear()
+            self._spilled.clear()
+            self._bindings.clear()
+            self._current_bytes = 0
+        if self.spill_backend:
+            self.spill_backend.clear()
 
     def cleanup_old_entries(self) -> int:
         """
@@ -70,18 +247,73 @@ class DocumentCache:
 
         with self._lock:
             keys_to_remove = [
-                key for key, (_, _, timestamp) in self._cache.items()
-                if timestamp < cutoff_time
+                key for key, entry in self._cache.items()
+                if entry.timestamp < cutoff_time
             ]
 
             for key in keys_to_remove:
-                del self._cache[key]
+                self._remove(key)
+
+            spilled_to_remove = [
+                key for key, timestamp in self._spilled.items()
+                if timestamp < cutoff_time
+            ]
+
+            expired_bindings = [
+                binding for binding, (_, timestamp) in self._bindings.items()
+                if timestamp < cutoff_time
+            ]
+            for binding in expired_bindings:
+                del self._bindings[binding]
+
+        for key in spilled_to_remove:
+            self._drop_spilled(key)
+
+        removed_count = len(set(keys_to_remove) | set(spilled_to_remove))
+        if removed_count > 0:
+            _log.info("document_cache.cleaned_up", removed=removed_count)
+
+        return removed_count
 
-            removed_count = len(keys_to_remove)
-            if removed_count > 0:
-                print(f"[DocumentCache] Cleaned up {removed_count} expired entries at {now}")
+    def _put(self, key: str, index: Any, chunks: ChunkStore, timestamp: datetime) -> None:
+        entry = _CacheEntry(index=index, chunks=chunks, timestamp=timestamp, size=estimate_entry_size(index, chunks))
+        evicted: list[Tuple[str, _CacheEntry]] = []
+        with self._lock:
+            self._remove(key)
+            if entry.size > self.max_bytes:
+                _log.warning("document_cache.entry_too_large", key=key, size_bytes=entry.size, max_bytes=self.max_bytes)
+                self._evictions += 1
+                evicted.append((key, entry))
+            else:
+                self._cache[key] = entry
+                self._current_bytes += entry.size
+                while self._current_bytes > self.max_bytes:
+                    evicted_key, evicted_entry = self._cache.popitem(last=False)
+                    self._current_bytes -= evicted_entry.size
+                    self._evictions += 1
+                    evicted.append((evicted_key, evicted_entry))
+            if self.spill_backend:
+                # Entry that is already spilled is still present in the backend, no need to write it again
+                evicted = [(k, e) for k, e in evicted if k not in self._spilled]
+
+        if self.spill_backend:
+            # Spill outside of the lock: slow backend writes must not block concurrent readers
+            for evicted_key, evicted_entry in evicted:
+                self.spill_backend.set(evicted_key, evicted_entry.index, evicted_entry.chunks)
+                with self._lock:
+                    self._spilled[evicted_key] = evicted_entry.timestamp
 
-            return removed_count
+    def _remove(self, key: str) -> None:
+        """Remove entry from memory. Must be called while holding `self._lock`."""
+        entry = self._cache.pop(key, None)
+        if entry:
+            self._current_bytes -= entry.size
+
+    def _drop_spilled(self, key: str) -> None:
+        with self._lock:
+            self._spilled.pop(key, None)
+        if self.spill_backend:
+            self.spill_backend.delete(key)
 
     def _schedule_midnight_cleanup(self) -> None:
         """Background thread that runs cleanup at midnight every day."""
@@ -108,16 +340,29 @@ class DocumentCache:
                 name="DocumentCache-Cleanup"
             )
             self._cleanup_thread.start()
-            print("[DocumentCache] Started automatic cleanup thread (runs at midnight)")
+            _log.info("document_cache.cleanup_started", schedule="midnight")
+
+    def start_warmup_task(self, preload: int = 0) -> None:
+        """Start background thread that warms up the cache from `spill_backend`."""
+        if self._warmup_thread is None or not self._warmup_thread.is_alive():
+            self._warmup_thread = threading.Thread(
+                target=self.warm,
+                args=(preload,),
+                daemon=True,
+                name="DocumentCache-Warmup"
+            )
+            self._warmup_thread.start()
 
     def stop_cleanup_task(self) -> None:
-        """Stop the background cleanup thread."""
+        """Stop the background cleanup thread, warm-up thread (if still running) stops on the same event."""
         if self._running:
             self._running = False
             self._stop_event.set()
             if self._cleanup_thread and self._cleanup_thread.is_alive():
                 self._cleanup_thread.join(timeout=5)
-            print("[DocumentCache] Stopped automatic cleanup thread")
+            if self._warmup_thread and self._warmup_thread.is_alive():
+                self._warmup_thread.join(timeout=5)
+            _log.info("document_cache.cleanup_stopped")
 
     def size(self) -> int:
         """Return the number of cached entries."""
@@ -125,5 +370,10 @@ class DocumentCache:
             return len(self._cache)
 
     def __contains__(self, key: str) -> bool:
-        """Check if a key exists in the cache (and is not expired)."""
-        return self.get(key) is not None
\ No newline at end of file
+        """Check if a key exists in the cache (and is not expired), hit/miss stats and LRU order are not changed."""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and datetime.now() - entry.timestamp < timedelta(hours=24):
+                return True
+            spilled_at = self._spilled.get(key)
+            return spilled_at is not None and datetime.now() - spilled_at < timedelta(hours=24)
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Optional
+
+import numpy as np
+
+from task.utils.logger import get_logger
+from task.utils.tracing import span
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# Max number of texts encoded in one batch. A request with more texts is encoded by slices of this size, each next
+# slice is queued after requests submitted meanwhile, so queries don't wait for the whole document
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', 64))
+# How long the first request of a batch waits for other requests to join it
+EMBEDDING_MAX_WAIT_MS = float(os.getenv('EMBEDDING_MAX_WAIT_MS', 5))
+
+_log = get_logger(__name__)
+
+
+@dataclass
+class _EmbeddingRequest:
+    # Texts of the current slice, `pending_texts` are the following slices and `parts` are embeddings of encoded ones
+    texts: list[str]
+    future: Future = field(default_factory=Future)
+    pending_texts: list[str] = field(default_factory=list)
+    parts: list[np.ndarray] = field(default_factory=list)
+
+
+class EmbeddingService:
+    """
+    Encodes texts of all conversations with one model on a dedicated worker thread. Requests queued while the worker
+    is busy (or within `max_wait_seconds` after the first one) are concatenated into one micro-batch of at most
+    `max_batch_size` texts, so concurrent queries share one matrix multiplication instead of many single-row calls.
+    """
+
+    def __init__(self, model_loader: Callable[[], 'SentenceTransformer'],
+                 max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+                 max_wait_seconds: float = EMBEDDING_MAX_WAIT_MS / 1000):
+        self._model_loader = model_loader
+        self._max_batch_size = max_batch_size
+        self._max_wait_seconds = max_wait_seconds
+        self._queue: queue.Queue[Optional[_EmbeddingRequest]] = queue.Queue()
+        # Request taken from the queue that didn't fit into the previous batch
+        self._carried: Optional[_EmbeddingRequest] = None
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        """Return float32 embeddings of `texts`, one row per text"""
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def submit(self, texts: list[str]) -> Future:
+        request = _EmbeddingRequest(texts=texts[:self._max_batch_size], pending_texts=texts[self._max_batch_size:])
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Embedding service is closed")
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-worker", daemon=True)
+                self._worker.start()
+            self._queue.put(request)
+        return request.future
+
+    def close(self) -> None:
+        """Stop the worker, requests that are still queued are cancelled"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            # Queued requests are taken out before the worker is stopped, otherwise it would encode them first
+            queued = self._drain_queue()
+            self._queue.put(None)
+            worker = self._worker
+        for request in queued:
+            request.future.cancel()
+        if worker is not None:
+            worker.join(timeout=5)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            self._encode(batch)
+        self._cancel_pending()
+
+    def _next_batch(self) -> Optional[list[_EmbeddingRequest]]:
+        # 1. Block until the first request, then collect more requests until batch is full or wait time is over
+        # 2. A request that doesn't fit into the batch is carried over to the next one, so order is preserved
+        # 3. Requests cancelled by callers are skipped. Future of a sliced request is kept pending until its last
+        #    slice, so the caller can still cancel it between slices
+        first = self._carried or self._queue.get()
+        self._carried = None
+        if first is None:
+            return None
+        batch = [first]
+        size = len(first.texts)
+        deadline = time.monotonic() + self._max_wait_seconds
+        while size < self._max_batch_size:
+            try:
+                request = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            if size + len(request.texts) > self._max_batch_size:
+                self._carried = request
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return [
+            request for request in batch
+            if (not request.future.cancelled() if request.pending_texts
+                else request.future.set_running_or_notify_cancel())
+        ]
+
+    def _encode(self, batch: list[_EmbeddingRequest]) -> None:
+        if not batch:
+            return
+        texts = [text for request in batch for text in request.texts]
+        try:
+            with span("rag.embed_batch", requests=len(batch), texts=len(texts)):
+                embeddings = np.asarray(self._model_loader().encode(texts), dtype='float32')
+        except Exception as e:
+            _log.warning("embedding.batch_failed", requests=len(batch), texts=len(texts), error=repr(e))
+            for request in batch:
+                if not request.pending_texts or request.future.set_running_or_notify_cancel():
+                    request.future.set_exception(e)
+            return
+        offset = 0
+        for request in batch:
+            request_embeddings = embeddings[offset:offset + len(request.texts)]
+            offset += len(request.texts)
+            if request.pending_texts:
+                # Next slice goes to the end of the queue, behind requests submitted while this one was encoded
+                request.parts.append(request_embeddings)
+                request.texts = request.pending_texts[:self._max_batch_size]
+                request.pending_texts = request.pending_texts[self._max_batch_size:]
+                self._queue.put(request)
+            elif request.parts:
+                request.future.set_result(np.concatenate([*request.parts, request_embeddings]))
+            else:
+                request.future.set_result(request_embeddings)
+
+    def _cancel_pending(self) -> None:
+        pending = [self._carried] if self._carried else []
+        for request in [*pending, *self._drain_queue()]:
+            request.future.cancel()
+
+    def _drain_queue(self) -> list[_EmbeddingRequest]:
+        requests = []
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                return requests
+            if request is not None:
+                requests.append(request)
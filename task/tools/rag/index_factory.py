@@ -0,0 +1,217 @@
+import math
+import os
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import faiss
+
+
+class IndexKind(str, Enum):
+    FLAT = 'flat'
+    HNSW = 'hnsw'
+    IVFPQ = 'ivfpq'
+
+
+class VectorCompression(str, Enum):
+    """How vectors of flat and HNSW indexes are stored, float32 vector of 384 dims takes 1536 bytes"""
+    NONE = 'none'
+    FP16 = 'fp16'  # 768 bytes, 2x smaller, practically lossless
+    INT8 = 'int8'  # 384 bytes, 4x smaller
+    PQ = 'pq'  # 96 bytes, 16x smaller, needs enough vectors to train, otherwise int8 is used
+
+
+@dataclass(frozen=True)
+class IndexTarget:
+    """Latency/recall trade-off: where index kind switches and how wide ANN indexes search"""
+    flat_max_vectors: int
+    hnsw_max_vectors: int
+    hnsw_m: int
+    hnsw_ef_construction: int
+    hnsw_ef_search: int
+    ivf_nprobe: int
+
+
+INDEX_TARGETS: dict[str, IndexTarget] = {
+    'latency': IndexTarget(flat_max_vectors=5_000, hnsw_max_vectors=100_000,
+                           hnsw_m=16, hnsw_ef_construction=40, hnsw_ef_search=32, ivf_nprobe=8),
+    'balanced': IndexTarget(flat_max_vectors=20_000, hnsw_max_vectors=250_000,
+                            hnsw_m=32, hnsw_ef_construction=80, hnsw_ef_search=64, ivf_nprobe=16),
+    'recall': IndexTarget(flat_max_vectors=50_000, hnsw_max_vectors=1_000_000,
+                          hnsw_m=48, hnsw_ef_construction=160, hnsw_ef_search=128, ivf_nprobe=48),
+}
+
+# `auto` picks index kind by number of chunks, `flat`, `hnsw` or `ivfpq` force it
+RAG_INDEX_TYPE = os.getenv('RAG_INDEX_TYPE', 'auto')
+# One of INDEX_TARGETS: `latency`, `balanced` or `recall`
+RAG_INDEX_TARGET = os.getenv('RAG_INDEX_TARGET', 'balanced')
+# Compression of cached vectors: `none`, `fp16`, `int8` or `pq` (IVF-PQ indexes are always product quantized)
+RAG_INDEX_COMPRESSION = os.getenv('RAG_INDEX_COMPRESSION', 'none')
+# Compressed indexes return `k * RAG_RERANK_FACTOR` candidates that are re-embedded and reranked by exact cosine
+# similarity, 0 or 1 disables rerank
+RAG_RERANK_FACTOR = int(os.getenv('RAG_RERANK_FACTOR', 0))
+
+# Bytes per PQ code of IVF-PQ, embedding dimension must be divisible by it (384 / 48 = 8 dims per sub-quantizer)
+_IVFPQ_SUB_QUANTIZERS = 48
+# Bytes per PQ code of compressed flat and HNSW indexes (384 / 96 = 4 dims per sub-quantizer)
+_PQ_SUB_QUANTIZERS = 96
+_PQ_BITS = 8
+# FAISS needs at least 39 training points per centroid
+_MIN_POINTS_PER_CENTROID = 39
+_MAX_TRAINING_POINTS = 64 * 1024
+
+
+@dataclass(frozen=True)
+class IndexBuildReport:
+    kind: IndexKind
+    compression: VectorCompression
+    vectors: int
+    build_seconds: float
+    memory_bytes: int
+
+
+def get_index_target(name: str = RAG_INDEX_TARGET) -> IndexTarget:
+    if name not in INDEX_TARGETS:
+        raise ValueError(f"Unknown index target `{name}`, expected one of {', '.join(INDEX_TARGETS)}")
+    return INDEX_TARGETS[name]
+
+
+def choose_index_kind(vectors: int, target: IndexTarget, index_type: str = RAG_INDEX_TYPE) -> IndexKind:
+    """
+    Exact scan is the fastest for small documents, HNSW keeps queries sub-linear for large ones and IVF-PQ also
+    compresses vectors of huge ones. Forced IVF-PQ falls back to HNSW when there are too few vectors to train it.
+    """
+    if index_type != 'auto':
+        kind = IndexKind(index_type)
+    elif vectors <= target.flat_max_vectors:
+        kind = IndexKind.FLAT
+    elif vectors <= target.hnsw_max_vectors:
+        kind = IndexKind.HNSW
+    else:
+        kind = IndexKind.IVFPQ
+    if kind == IndexKind.IVFPQ and vectors < _MIN_POINTS_PER_CENTROID * (1 << _PQ_BITS):
+        kind = IndexKind.HNSW
+    return kind
+
+
+def choose_compression(vectors: int, kind: IndexKind,
+                       compression: str = RAG_INDEX_COMPRESSION) -> VectorCompression:
+    if kind == IndexKind.IVFPQ:
+        return VectorCompression.PQ
+    chosen = VectorCompression(compression)
+    if chosen == VectorCompression.PQ and vectors < _MIN_POINTS_PER_CENTROID * (1 << _PQ_BITS):
+        chosen = VectorCompression.INT8
+    return chosen
+
+
+def build_index(embeddings: np.ndarray, target: IndexTarget | None = None, index_type: str = RAG_INDEX_TYPE,
+                compression: str = RAG_INDEX_COMPRESSION) -> tuple['faiss.Index', IndexBuildReport]:
+    """
+    Build inner-product index over L2-normalized `embeddings` (cosine similarity, MiniLM is trained for it),
+    vectors are stored with `compression`. Blocks for seconds on large documents, must be called in executor.
+    """
+    import faiss
+    target = target or get_index_target()
+    started = time.perf_counter()
+    vectors = np.ascontiguousarray(embeddings, dtype='float32')
+    faiss.normalize_L2(vectors)
+    count, dimension = vectors.shape
+    kind = choose_index_kind(count, target, index_type)
+    chosen_compression = choose_compression(count, kind, compression)
+    scalar_types = {
+        VectorCompression.FP16: faiss.ScalarQuantizer.QT_fp16,
+        VectorCompression.INT8: faiss.ScalarQuantizer.QT_8bit,
+    }
+
+    if kind == IndexKind.FLAT:
+        if chosen_compression in scalar_types:
+            index = faiss.IndexScalarQuantizer(dimension, scalar_types[chosen_compression], faiss.METRIC_INNER_PRODUCT)
+        elif chosen_compression == VectorCompression.PQ:
+            index = faiss.IndexPQ(dimension, _PQ_SUB_QUANTIZERS, _PQ_BITS, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexFlatIP(dimension)
+    elif kind == IndexKind.HNSW:
+        if chosen_compression in scalar_types:
+            index = faiss.IndexHNSWSQ(dimension, scalar_types[chosen_compression], target.hnsw_m,
+                                      faiss.METRIC_INNER_PRODUCT)
+        elif chosen_compression == VectorCompression.PQ:
+            index = faiss.IndexHNSWPQ(dimension, _PQ_SUB_QUANTIZERS, target.hnsw_m, _PQ_BITS,
+                                      faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexHNSWFlat(dimension, target.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = target.hnsw_ef_construction
+        index.hnsw.efSearch = target.hnsw_ef_search
+    else:
+        nlist = min(int(4 * math.sqrt(count)), count // _MIN_POINTS_PER_CENTROID)
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, _IVFPQ_SUB_QUANTIZERS, _PQ_BITS,
+                                 faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = target.ivf_nprobe
+    if not index.is_trained:
+        index.train(_training_sample(vectors))
+    index.add(vectors)
+
+    report = IndexBuildReport(kind=kind, compression=chosen_compression, vectors=count,
+                              build_seconds=time.perf_counter() - started, memory_bytes=index_memory_bytes(index))
+    return index, report
+
+
+def search_index(index: 'faiss.Index', query_embeddings: np.ndarray, k: int) -> list[int]:
+    """Return ids of `k` nearest vectors to the first query, ANN indexes return -1 when they find fewer"""
+    import faiss
+    queries = np.ascontiguousarray(query_embeddings, dtype='float32').copy()
+    faiss.normalize_L2(queries)
+    _, indices = index.search(queries, k)
+    return [int(idx) for idx in indices[0] if idx >= 0]
+
+
+def rerank(query_embedding: np.ndarray, candidate_ids: list[int], candidate_embeddings: np.ndarray,
+           k: int) -> list[int]:
+    """Order candidates found by compressed index by exact cosine similarity and return top `k` of them"""
+    query = np.asarray(query_embedding, dtype='float32').reshape(-1)
+    candidates = np.asarray(candidate_embeddings, dtype='float32')
+    norms = np.linalg.norm(candidates, axis=1) * max(float(np.linalg.norm(query)), 1e-12)
+    scores = candidates @ query / np.maximum(norms, 1e-12)
+    return [candidate_ids[i] for i in np.argsort(-scores, kind='stable')[:k]]
+
+
+def stores_exact_vectors(index: Any) -> bool:
+    """True for indexes that keep float32 vectors, their search results don't need rerank"""
+    import faiss
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return isinstance(index, faiss.IndexFlat)
+
+
+def index_memory_bytes(index: Any) -> int:
+    """Approximate memory taken by FAISS index: codes, graph links, ids and trained centroids"""
+    import faiss
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        graph = index.hnsw
+        links = graph.neighbors.size() * 4 + graph.levels.size() * 4 + graph.offsets.size() * 8
+        return links + index_memory_bytes(index.storage)
+    if isinstance(index, faiss.IndexIVF):
+        centroids = index_memory_bytes(index.quantizer)
+        if isinstance(index, faiss.IndexIVFPQ):
+            centroids += index.pq.centroids.size() * 4
+        return index.invlists.compute_ntotal() * (index.code_size + 8) + centroids
+    if isinstance(index, faiss.IndexPQ):
+        return index.ntotal * index.code_size + index.pq.centroids.size() * 4
+    try:
+        return index.ntotal * index.sa_code_size()
+    except RuntimeError:
+        # Standalone codec is not implemented for some index types, count raw float32 vectors instead
+        return index.ntotal * index.d * 4
+
+
+def _training_sample(vectors: np.ndarray) -> np.ndarray:
+    if len(vectors) <= _MAX_TRAINING_POINTS:
+        return vectors
+    rows = np.random.default_rng(0).choice(len(vectors), _MAX_TRAINING_POINTS, replace=False)
+    return vectors[np.sort(rows)]
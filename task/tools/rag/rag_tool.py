@@ -1,22 +1,65 @@
+import hashlib
 import json
-from typing import Any
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
 
-import faiss
 import numpy as np
-from aidial_client import AsyncDial
 from aidial_sdk.chat_completion import Message, Role
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
 
 from task.tools.base import BaseTool
 from task.tools.models import ToolCallParams
+from task.tools.rag.chunk_store import Chunk, ChunkStore
 from task.tools.rag.document_cache import DocumentCache
+from task.tools.rag.embedding_service import EmbeddingService
+from task.tools.rag.index_factory import (
+    RAG_INDEX_COMPRESSION, RAG_INDEX_TARGET, RAG_INDEX_TYPE, RAG_RERANK_FACTOR, build_index, rerank, search_index,
+    stores_exact_vectors,
+)
+from task.utils.dial_clients import get_async_dial_client
 from task.utils.dial_file_conent_extractor import DialFileContentExtractor
+from task.utils.executors import get_process_executor, get_thread_executor
+from task.utils.logger import get_logger
+from task.utils.tracing import span
+
+# faiss, sentence_transformers (torch) and langchain take seconds to import, they are imported on first use or on
+# background warm-up (see `RagTool.warm_up`), so application starts fast
+if TYPE_CHECKING:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from sentence_transformers import SentenceTransformer
 
 # TODO: provide system prompt for Generation step
 _SYSTEM_PROMPT = """
 """
 
+_EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+_CHUNK_SIZE = 500
+_CHUNK_OVERLAP = 50
+_SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+_TOP_K = 3
+
+_log = get_logger(__name__)
+
+
+@lru_cache(maxsize=1)
+def _get_text_splitter() -> 'RecursiveCharacterTextSplitter':
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=_CHUNK_SIZE,
+        chunk_overlap=_CHUNK_OVERLAP,
+        length_function=len,
+        separators=_SEPARATORS
+    )
+
+
+def split_text(text: str, page_starts: Optional[list[int]] = None) -> ChunkStore:
+    """
+    Split text into chunks kept as `ChunkStore`, chunk strings never leave the worker. It is module level function to
+    be picklable for process pool, splitter is created once per worker.
+    """
+    return ChunkStore.from_chunks(text, _get_text_splitter().split_text(text), page_starts)
+
 
 class RagTool(BaseTool):
     """
@@ -29,11 +72,11 @@ class RagTool(BaseTool):
         # 2. Set deployment_name
         # 3. Set document_cache. DocumentCache is implemented, relate to it as to centralized Dict with file_url (as key),
         #    and indexed embeddings (as value), that have some autoclean. This cache will allow us to speed up RAG search.
-        # 4. Create SentenceTransformer and set is as `model` with:
+        # 4. SentenceTransformer `model` is loaded lazily (see `model` property) with:
         #   - model_name_or_path='all-MiniLM-L6-v2', it is self hosted lightwait embedding model.
         #     More info: https://medium.com/@rahultiwari065/unlocking-the-power-of-sentence-embeddings-with-all-minilm-l6-v2-7d6589a5f0aa
         #   - Optional! You can set it use CPU forcefully with `device='cpu'`, in case if not set up then will use GPU if it has CUDA cores
-        # 5. Create RecursiveCharacterTextSplitter as `text_splitter` with:
+        # 5. RecursiveCharacterTextSplitter is created in process pool workers (see `split_text`) with:
         #   - chunk_size=500
         #   - chunk_overlap=50
         #   - length_function=len
@@ -41,13 +84,32 @@ class RagTool(BaseTool):
         self.endpoint = endpoint
         self.deployment_name = deployment_name
         self.document_cache = document_cache
-        self.model = SentenceTransformer(model_name_or_path='all-MiniLM-L6-v2', device='cpu')
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=50,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
+        self._model: Optional['SentenceTransformer'] = None
+        self._model_lock = threading.Lock()
+        # Documents and queries of all conversations are encoded in micro-batches on one worker thread
+        self.embedding_service = EmbeddingService(model_loader=lambda: self.model)
+
+    @property
+    def model(self) -> 'SentenceTransformer':
+        """Embedding model, it is loaded on first access. Loading blocks, so it must be accessed outside event loop."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(model_name_or_path=_EMBEDDING_MODEL_NAME, device='cpu')
+        return self._model
+
+    @property
+    def is_warm(self) -> bool:
+        return self._model is not None
+
+    def warm_up(self) -> None:
+        """Import FAISS and load embedding model. It blocks for seconds, so it is run in executor in background."""
+        import faiss  # noqa: F401
+        _ = self.model
+
+    async def close(self) -> None:
+        await get_thread_executor().run(self.embedding_service.close)
 
     @property
     def show_in_stage(self) -> bool:
@@ -100,27 +162,35 @@ class RagTool(BaseTool):
         # 5. Append content to stage: "## Request arguments: \n"
         # 6. Append content to stage: `f"**Request**: {request}\n\r"`
         # 7. Append content to stage: `f"**File URL**: {file_url}\n\r"`
-        # 8. Create `cache_document_key`, it is string from `conversation_id` and `file_url`, with such key we guarantee
-        #    access to cached indexes for one particular conversation,
+        # 8. Resolve `cache_document_key` bound to `conversation_id` and `file_url` in `document_cache`. Cached indexes
+        #    are keyed by document content and shared between conversations, the binding guarantees that conversation
+        #    already downloaded this file with its own api_key. Requests without conversation id are never bound, they
+        #    always download the file (content is still shared through the content key)
         # 9. Get from `document_cache` by `cache_document_key` a cache
         # 10. If cache is present then set it as `index, chunks = cached_data` (cached_data is retrieved cache from 9 step),
         #     otherwise:
-        #       - Create DialFileContentExtractor and extract text by `file_url` as `text_content`
+        #       - Create DialFileContentExtractor and download file by `file_url` (streamed to temporary file, SHA-256 of
+        #         content is calculated while downloading)
+        #       - Create `cache_document_key` from content hash (see `__content_key`) and bind it to conversation
+        #       - If `document_cache` already has this content (indexed by another conversation) then reuse it, otherwise:
+        #       - Extract text (with offsets of PDF pages) from downloaded content as `document`
         #       - If no `text_content` then appen to stage info about it ans return the string with the error that file content is not found
-        #       - Create `chunks` with `text_splitter`
-        #       - Create `embeddings` with `model`
-        #       - Create IndexFlatL2 with `384` dimensions as `index` (more about IndexFlatL2 https://shayan-fazeli.medium.com/faiss-a-quick-tutorial-to-efficient-similarity-search-595850e08473)
-        #       - Add to `index` np.array with created embeddings as type 'float32'
+        #       - Create `chunks` as ChunkStore with `split_text` (in process pool), it keeps document text once
+        #         and page number of each chunk
+        #       - Create `embeddings` with `embedding_service` (it batches them with requests of other conversations)
+        #       - Create `index` with `build_index`, it picks flat, HNSW or IVF-PQ inner-product index by number of
+        #         chunks (more about FAISS indexes https://github.com/facebookresearch/faiss/wiki/Guidelines-to-choose-an-index)
         #       - Add to `document_cache`
-        # 11. Prepare `query_embedding` with model. You need to encode request as type 'float32'
-        # 12. Through created index make search with `query_embedding`, `k` set as 3. As response we expect tuple of
-        #     `distances` and `indices`
-        # 13. Now you need to iterate through `indices[0]` and and by each idx get element from `chunks`, result save as `retrieved_chunks`
+        # 11. Prepare `query_embedding` with `embedding_service`. You need to encode request as type 'float32'
+        # 12. Through created index make search with `query_embedding` (`search_index`), `k` set as 3. ANN indexes may
+        #     find fewer than `k` chunks, missing results are skipped. Compressed indexes return `RAG_RERANK_FACTOR`
+        #     times more candidates, they are re-embedded and reranked by exact similarity (see `__search`)
+        # 13. Now you need to iterate through found indices and by each idx get element from `chunks`, result save as `retrieved_chunks`
         # 14. Make augmentation
         # 15. Append content to stage: "## RAG Request: \n"
         # 16. Append content to stage: `ff"```text\n\r{augmented_prompt}\n\r```\n\r"` (will be shown as markdown text)
         # 17. Append content to stage: "## Response: \n"
-        # 18. Now make Generation with AsyncDial (don't forget about api_version '2025-01-01-preview, provide LLM with system prompt and augmented prompt and:
+        # 18. Now make Generation with AsyncDial from `get_async_dial_client` (don't forget about api_version '2025-01-01-preview, provide LLM with system prompt and augmented prompt and:
         #   - stream response to stage (user in real time will be able to see what the LLM responding while Generation step)
         #   - collect all content (we need to return it as tool execution result)
         # 19. return collected content
@@ -131,55 +201,104 @@ class RagTool(BaseTool):
         stage.append_content("## Request arguments: \n")
         stage.append_content(f"**Request**: {request}\n\r")
         stage.append_content(f"**File URL**: {file_url}\n\r")
-        cache_document_key = f"{tool_call_params.conversation_id}:{file_url}"
-        cached_data = self.document_cache.get(cache_document_key)
+        # Blocking work (download, parsing, embedding, FAISS and cache disk access) runs in executors, so the event
+        # loop keeps streaming other conversations meanwhile
+        thread_executor = get_thread_executor()
+        cache_document_key = self.document_cache.resolve(tool_call_params.conversation_id, file_url)
+        with span("rag.cache_lookup", bound=cache_document_key is not None) as lookup_span:
+            cached_data = None
+            if cache_document_key:
+                cached_data = await thread_executor.run(self.document_cache.get, cache_document_key)
+            lookup_span.set_attribute("hit", cached_data is not None)
         if cached_data:
             index, chunks = cached_data
         else:
-            text_content = DialFileContentExtractor(
+            extractor = DialFileContentExtractor(
                 endpoint=self.endpoint,
                 api_key=tool_call_params.api_key
-            ).extract_text(file_url)
+            )
+            async with extractor.adownload_to_file(file_url) as downloaded:
+                cache_document_key = self.__content_key(downloaded.sha256, downloaded.filename)
+                cached_data = await thread_executor.run(self.document_cache.get, cache_document_key)
+                if cached_data:
+                    index, chunks = cached_data
+                else:
+                    document = await extractor.aextract_document_from_file(downloaded)
+                    text_content = document.text
 
-            if not text_content:
-                stage.append_content("Error: File content not found.\n\r")
-                return "Error: File content not found."
+                    if not text_content:
+                        stage.append_content("Error: File content not found.\n\r")
+                        return "Error: File content not found."
 
-            chunks = self.text_splitter.split_text(text_content)
-            embeddings = self.model.encode(chunks)
-            index = faiss.IndexFlatL2(384)
-            index.add(np.array(embeddings).astype('float32'))
-            self.document_cache.set(cache_document_key, index, chunks)
+                    with span("rag.split") as split_span:
+                        chunks = await get_process_executor().run(split_text, text_content, document.page_starts)
+                        split_span.set_attribute("chunks", len(chunks))
+                    with span("rag.embed", chunks=len(chunks)):
+                        embeddings = await self.embedding_service.embed(chunks.texts())
+                    with span("rag.index_build", chunks=len(chunks)) as build_span:
+                        index, report = await thread_executor.run(build_index, embeddings)
+                        build_span.set_attribute("kind", report.kind.value)
+                        build_span.set_attribute("memory_bytes", report.memory_bytes)
+                    _log.info("rag.index_built", kind=report.kind.value, vectors=report.vectors,
+                              build_ms=round(report.build_seconds * 1000, 1), memory_bytes=report.memory_bytes)
+                    await thread_executor.run(self.document_cache.set, cache_document_key, index, chunks)
+            self.document_cache.bind(tool_call_params.conversation_id, file_url, cache_document_key)
 
-        query_embedding = np.array(self.model.encode([request]).astype('float32'))
-        distances, indices = index.search(query_embedding, k=3)
-        retrieved_chunks = [chunks[idx] for idx in indices[0]]
+        with span("rag.embed_query"):
+            query_embedding = await self.embedding_service.embed([request])
+        with span("rag.search", vectors=index.ntotal):
+            indices = await self.__search(index, chunks, query_embedding)
+        retrieved_chunks = [chunks[idx] for idx in indices]
         augmented_prompt = self.__augmentation(request, retrieved_chunks)
         stage.append_content("## RAG Request: \n")
         stage.append_content(f"```text\n\r{augmented_prompt}\n\r```\n\r")
         stage.append_content("## Response: \n")
 
-        dial_client = AsyncDial(base_url=self.endpoint, api_key=tool_call_params.api_key, api_version='2025-01-01-preview')
+        dial_client = get_async_dial_client(self.endpoint, api_key=tool_call_params.api_key,
+                                            api_version='2025-01-01-preview')
         collected_content = ""
-        async for chunk in await dial_client.chat.completions.create(
-            messages=[
-                {"role": Role.SYSTEM, "content": _SYSTEM_PROMPT},
-                {"role": Role.USER, "content": augmented_prompt}
-            ],
-            deployment_name=self.deployment_name,
-            stream=True
-        ):
-            if chunk.choices:
-                delta = chunk.choices[0].delta
-                if delta and delta.content:
-                    stage.append_content(delta.content)
-                    collected_content += delta.content
+        with span("rag.generation", deployment=self.deployment_name):
+            async for chunk in await dial_client.chat.completions.create(
+                messages=[
+                    {"role": Role.SYSTEM, "content": _SYSTEM_PROMPT},
+                    {"role": Role.USER, "content": augmented_prompt}
+                ],
+                deployment_name=self.deployment_name,
+                stream=True
+            ):
+                if chunk.choices:
+                    delta = chunk.choices[0].delta
+                    if delta and delta.content:
+                        stage.append_content(delta.content)
+                        collected_content += delta.content
 
         return collected_content
 
-    def __augmentation(self, request: str, chunks: list[str]) -> str:
-        # make prompt augmentation
-        context = "\n\n".join(chunks)
+    async def __search(self, index: Any, chunks: ChunkStore, query_embedding: np.ndarray) -> list[int]:
+        thread_executor = get_thread_executor()
+        if RAG_RERANK_FACTOR <= 1 or stores_exact_vectors(index):
+            return await thread_executor.run(search_index, index, query_embedding, _TOP_K)
+        candidates = await thread_executor.run(search_index, index, query_embedding, _TOP_K * RAG_RERANK_FACTOR)
+        with span("rag.rerank", candidates=len(candidates)):
+            candidate_embeddings = await self.embedding_service.embed(chunks.texts(candidates))
+            return rerank(query_embedding, candidates, candidate_embeddings, _TOP_K)
+
+    @staticmethod
+    def __content_key(file_sha256: str, filename: str) -> str:
+        # Same bytes split and embedded with the same configuration always produce the same index, so the key covers
+        # both of them: changing model, splitter or index settings must not reuse stale indexes. Text is extracted by
+        # file extension, so the same bytes under another extension (e.g. `.html` and `.txt`) get their own index
+        digest = hashlib.sha256(file_sha256.encode('utf-8'))
+        digest.update(f"|{Path(filename).suffix.lower()}|".encode('utf-8'))
+        digest.update(f"{_EMBEDDING_MODEL_NAME}|{_CHUNK_SIZE}|{_CHUNK_OVERLAP}|{_SEPARATORS}".encode('utf-8'))
+        digest.update(f"|ip|{RAG_INDEX_TYPE}|{RAG_INDEX_TARGET}|{RAG_INDEX_COMPRESSION}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def __augmentation(self, request: str, chunks: list[Chunk]) -> str:
+        # make prompt augmentation, chunks of PDF documents are labeled with their page
+        context = "\n\n".join(
+            chunk.text if chunk.page is None else f"[Page {chunk.page}]\n{chunk.text}" for chunk in chunks
+        )
         augmented_prompt = f"""Use the following context to answer the question.
         Context: {context}
         Question: {request}
@@ -0,0 +1,87 @@
+import json
+from typing import Any
+
+from aidial_sdk.chat_completion import Message
+
+from task.tools.base import BaseTool
+from task.tools.models import ToolCallParams
+from task.utils.constants import TOOL_RESULT_FETCH_TOOL_NAME
+from task.utils.tokens import tokens_to_chars
+from task.utils.tool_result_store import TOOL_RESULT_DEFAULT_TOKEN_BUDGET, ToolResultStore
+
+
+class ToolResultFetchTool(BaseTool):
+    """
+    Returns full content of tool results that were truncated before they were put into conversation history.
+    Content is paginated, each page fits into default tool result budget.
+    """
+
+    def __init__(self, result_store: ToolResultStore, page_tokens: int = TOOL_RESULT_DEFAULT_TOKEN_BUDGET):
+        self.result_store = result_store
+        self.page_size = tokens_to_chars(page_tokens)
+
+    @property
+    def show_in_stage(self) -> bool:
+        return False
+
+    @property
+    def result_token_budget(self) -> int | None:
+        # Result is already limited by page size
+        return None
+
+    @property
+    def name(self) -> str:
+        return TOOL_RESULT_FETCH_TOOL_NAME
+
+    @property
+    def description(self) -> str:
+        return """
+        Reads full content of a tool result that was truncated in conversation history. Truncated results contain
+        placeholder with `result_id`. Use it only when omitted part is really needed to answer.
+        PAGINATION: Response format: `**Page #X. Total pages: Y**` appears at end if paginated.
+        """
+
+    @property
+    def parameters(self) -> dict[str, Any]:
+        return {
+            "type": "object",
+            "properties": {
+                "result_id": {
+                    "type": "string",
+                    "description": "Id of truncated tool result"
+                },
+                "page": {
+                    "type": "integer",
+                    "description": "Page of result content",
+                    "default": 1
+                },
+            },
+            "required": [
+                "result_id",
+            ]
+        }
+
+    async def _execute(self, tool_call_params: ToolCallParams) -> str | Message:
+        arguments = json.loads(tool_call_params.tool_call.function.arguments)
+        result_id = arguments["result_id"]
+        page = arguments.get("page", 1)
+        stage = tool_call_params.stage
+        stage.append_content("## Request arguments: \n")
+        stage.append_content(f"**Result id**: {result_id}\n\r")
+        if page > 1:
+            stage.append_content(f"**Page**: {page}\n\r")
+        stage.append_content("## Response: \n")
+
+        content = self.result_store.get(tool_call_params.conversation_id, result_id)
+        if content is None:
+            content = f"Error: Result `{result_id}` is not found or expired."
+        else:
+            total_pages = max(1, (len(content) + self.page_size - 1) // self.page_size)
+            if page < 1 or page > total_pages:
+                content = f"Error: Page {page} doesn't exist. Total pages: {total_pages}"
+            elif total_pages > 1:
+                page_content = content[(page - 1) * self.page_size:page * self.page_size]
+                content = f"{page_content}\n\n**Page #{page}. Total pages: {total_pages}**"
+
+        stage.append_content(f"```text\n\r{content}\n\r```\n\r")
+        return content
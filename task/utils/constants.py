@@ -1,2 +1,3 @@
 TOOL_CALL_HISTORY_KEY = "tool_call_history"
-CUSTOM_CONTENT = "custom_content"
\ No newline at end of file
+CUSTOM_CONTENT = "custom_content"
+TOOL_RESULT_FETCH_TOOL_NAME = "get_tool_result"
\ No newline at end of file
@@ -0,0 +1,167 @@
+import asyncio
+import importlib.util
+import os
+import threading
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Optional
+
+import httpx
+from aidial_client import AsyncDial, Dial
+
+from task.utils.logger import get_logger
+
+# Same HTTP client wrappers `AsyncDialClientPool` uses, they let many DIAL clients share one connection pool while
+# each client sends its own api key in request headers. They are private modules of aidial-client (checked by
+# tests/test_dial_clients.py), if they are gone every DIAL client gets its own connection pool
+try:
+    from aidial_client._auth import process_auth
+    from aidial_client._http_client import AsyncHTTPClient, SyncHTTPClient
+    _SHARED_POOL_SUPPORTED = True
+except ImportError:
+    _SHARED_POOL_SUPPORTED = False
+
+# Limits of connections to one DIAL endpoint (host) per process
+DIAL_MAX_CONNECTIONS = int(os.getenv('DIAL_MAX_CONNECTIONS', 100))
+DIAL_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('DIAL_MAX_KEEPALIVE_CONNECTIONS', 20))
+DIAL_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv('DIAL_KEEPALIVE_EXPIRY_SECONDS', 30))
+# HTTP/2 is negotiated with TLS endpoints only and requires `h2` package, otherwise HTTP/1.1 is used
+DIAL_HTTP2 = os.getenv('DIAL_HTTP2', 'true').lower() == 'true'
+DIAL_MAX_RETRIES = int(os.getenv('DIAL_MAX_RETRIES', 2))
+DIAL_TIMEOUT = httpx.Timeout(timeout=600.0, connect=5.0)
+
+_log = get_logger(__name__)
+
+
+def _no_cookies() -> CookieJar:
+    """Cookie jar that rejects all cookies: pools are shared by requests of all users, cookies must not be"""
+    return CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+
+
+class DialClientRegistry:
+    """
+    Process-wide connection pools to DIAL endpoints, one async and one sync `httpx` client per endpoint. DIAL clients
+    are cheap views over these pools: per-request api key is sent in headers of each request and connections are
+    kept alive between requests of different users.
+    """
+
+    def __init__(self, limits: httpx.Limits, http2: bool):
+        self._limits = limits
+        self._http2 = http2 and importlib.util.find_spec('h2') is not None
+        if http2 and not self._http2:
+            _log.warning("dial.http2_unavailable", reason="`h2` package is not installed, HTTP/1.1 is used")
+        if not _SHARED_POOL_SUPPORTED:
+            _log.warning("dial.shared_pool_unavailable",
+                         reason="aidial-client HTTP client wrappers are not found, clients don't share connections")
+        self._async_http_clients: dict[str, httpx.AsyncClient] = {}
+        self._sync_http_clients: dict[str, httpx.Client] = {}
+        # Sync clients are requested from executor threads
+        self._lock = threading.Lock()
+
+    def async_http_client(self, endpoint: str) -> httpx.AsyncClient:
+        """Shared async connection pool to `endpoint`, also used for requests aidial_client doesn't cover (streaming)"""
+        client = self._async_http_clients.get(endpoint)
+        if client is None:
+            with self._lock:
+                client = self._async_http_clients.get(endpoint)
+                if client is None:
+                    client = httpx.AsyncClient(limits=self._limits, http2=self._http2, timeout=DIAL_TIMEOUT,
+                                               cookies=_no_cookies())
+                    self._async_http_clients[endpoint] = client
+        return client
+
+    def sync_http_client(self, endpoint: str) -> httpx.Client:
+        client = self._sync_http_clients.get(endpoint)
+        if client is None:
+            with self._lock:
+                client = self._sync_http_clients.get(endpoint)
+                if client is None:
+                    client = httpx.Client(limits=self._limits, http2=self._http2, timeout=DIAL_TIMEOUT,
+                                          cookies=_no_cookies())
+                    self._sync_http_clients[endpoint] = client
+        return client
+
+    def prepare(self, endpoint: str) -> None:
+        """Create connection pools to `endpoint` ahead of the first request, creating SSL context takes a while"""
+        self.async_http_client(endpoint)
+        self.sync_http_client(endpoint)
+
+    def async_client(self, endpoint: str, api_key: str, api_version: Optional[str] = None) -> AsyncDial:
+        if not _SHARED_POOL_SUPPORTED:
+            return AsyncDial(base_url=endpoint, api_key=api_key, api_version=api_version)
+        auth_type, auth_value = process_auth(api_key=api_key, bearer_token=None)
+        return AsyncDial(
+            base_url=endpoint,
+            api_key=api_key,
+            api_version=api_version,
+            http_client=AsyncHTTPClient(
+                base_url=endpoint,
+                auth_value=auth_value,
+                auth_type=auth_type,
+                max_retries=DIAL_MAX_RETRIES,
+                timeout=DIAL_TIMEOUT,
+                internal_http_client=self.async_http_client(endpoint),
+            ),
+        )
+
+    def sync_client(self, endpoint: str, api_key: str, api_version: Optional[str] = None) -> Dial:
+        if not _SHARED_POOL_SUPPORTED:
+            return Dial(base_url=endpoint, api_key=api_key, api_version=api_version)
+        auth_type, auth_value = process_auth(api_key=api_key, bearer_token=None)
+        return Dial(
+            base_url=endpoint,
+            api_key=api_key,
+            api_version=api_version,
+            http_client=SyncHTTPClient(
+                base_url=endpoint,
+                auth_value=auth_value,
+                auth_type=auth_type,
+                max_retries=DIAL_MAX_RETRIES,
+                timeout=DIAL_TIMEOUT,
+                internal_http_client=self.sync_http_client(endpoint),
+            ),
+        )
+
+    async def close(self) -> None:
+        with self._lock:
+            async_clients = list(self._async_http_clients.values())
+            sync_clients = list(self._sync_http_clients.values())
+            self._async_http_clients.clear()
+            self._sync_http_clients.clear()
+        await asyncio.gather(*(client.aclose() for client in async_clients), return_exceptions=True)
+        for client in sync_clients:
+            client.close()
+
+
+_registry: Optional[DialClientRegistry] = None
+
+
+def get_dial_client_registry() -> DialClientRegistry:
+    global _registry
+    if _registry is None:
+        _registry = DialClientRegistry(
+            limits=httpx.Limits(
+                max_connections=DIAL_MAX_CONNECTIONS,
+                max_keepalive_connections=DIAL_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=DIAL_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            http2=DIAL_HTTP2,
+        )
+    return _registry
+
+
+def get_async_dial_client(endpoint: str, api_key: str, api_version: Optional[str] = None) -> AsyncDial:
+    """`AsyncDial` sharing process-wide connection pool to `endpoint`"""
+    return get_dial_client_registry().async_client(endpoint, api_key, api_version)
+
+
+def get_sync_dial_client(endpoint: str, api_key: str, api_version: Optional[str] = None) -> Dial:
+    """`Dial` sharing process-wide connection pool to `endpoint`"""
+    return get_dial_client_registry().sync_client(endpoint, api_key, api_version)
+
+
+async def close_dial_clients() -> None:
+    """Close connection pools. Called on application shutdown."""
+    global _registry
+    if _registry is not None:
+        registry, _registry = _registry, None
+        await registry.close()
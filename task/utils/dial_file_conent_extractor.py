@@ -1,73 +1,434 @@
+import asyncio
+import codecs
+import hashlib
 import io
+import math
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from html.parser import HTMLParser
 from pathlib import Path
+from typing import AsyncIterator, Iterator, Optional
 
-import pdfplumber
-import pandas as pd
-from aidial_client import Dial
+import httpx
+from aidial_client import Dial, InvalidDialURLError
 from bs4 import BeautifulSoup
 
+from task.utils.dial_clients import get_async_dial_client, get_dial_client_registry, get_sync_dial_client
+from task.utils.executors import PROCESS_EXECUTOR_WORKERS, get_process_executor
+from task.utils.logger import get_logger
+from task.utils.tracing import span
+
+# pdfplumber and pandas are imported on first use, they are needed only for PDF and CSV files and mostly in process
+# pool workers
+
+MAX_FILE_SIZE_BYTES = int(os.getenv('MAX_FILE_SIZE_BYTES', 100 * 1024 * 1024))
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', 8))
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+_DOWNLOAD_TIMEOUT = httpx.Timeout(timeout=600.0, connect=5.0)
+# PDF (random access to pages) and CSV (pandas type inference) need the whole file, they are spooled to disk and
+# parsed in process pool. Everything else is parsed chunk by chunk while downloading
+_WHOLE_FILE_EXTENSIONS = ('.pdf', '.csv')
+_HTML_EXTENSIONS = ('.html', '.htm')
+# Minimal number of PDF pages extracted by one process pool task, each task opens the document again
+_PDF_PAGES_PER_TASK = 16
+
+_log = get_logger(__name__)
+_download_semaphore: Optional[asyncio.Semaphore] = None
+
+
+class FileTooLargeError(Exception):
+    """Raised when downloaded file exceeds `MAX_FILE_SIZE_BYTES`."""
+
+
+@dataclass
+class DownloadedFile:
+    filename: str
+    path: Path
+    size: int
+    sha256: str
+
+
+@dataclass
+class ExtractedText:
+    """Document text, `page_starts` are offsets of pages in `text` for paged documents (PDF), None otherwise."""
+    text: str
+    page_starts: Optional[list[int]] = None
+
+
+@dataclass
+class TextPrefix:
+    """
+    Beginning of document text. `estimated_length` is exact when `complete` is True. For PDF `pages` is number of
+    pages `text` was extracted from (extraction of the rest continues from this page) out of `total_pages`.
+    """
+    text: str
+    complete: bool
+    estimated_length: int
+    pages: int = 0
+    total_pages: int = 0
+
+
+def _get_download_semaphore() -> asyncio.Semaphore:
+    global _download_semaphore
+    if _download_semaphore is None:
+        _download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    return _download_semaphore
+
 
 class DialFileContentExtractor:
 
     def __init__(self, endpoint: str, api_key: str):
-        # Set Dial client with endpoint as base_url and api_key
-        self.dial_client = Dial(base_url=endpoint, api_key=api_key)
+        # Set Dial client with endpoint as base_url and api_key, clients share connection pools of the process
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.async_dial_client = get_async_dial_client(endpoint, api_key=api_key)
+        self._dial_client: Optional[Dial] = None
+
+    @property
+    def dial_client(self) -> Dial:
+        """Sync client, used only by sync `download`"""
+        if self._dial_client is None:
+            self._dial_client = get_sync_dial_client(self.endpoint, api_key=self.api_key)
+        return self._dial_client
 
     def extract_text(self, file_url: str) -> str:
         # 1. Download with Dial client file by `file_url` (files -> download)
         # 2. Get downloaded file name and content
-        # 3. Get file extension, use for this `Path(filename).suffix.lower()`
-        # 4. Call `__extract_text` and return its result
+        # 3. Call `extract_text_from_content` and return its result
+        filename, file_content = self.download(file_url)
+        return self.extract_text_from_content(file_content, filename)
+
+    def download(self, file_url: str) -> tuple[str, bytes]:
+        """Download file by `file_url` and return its name and raw content."""
         file = self.dial_client.files.download(file_url)
-        filename = file.filename
-        file_content = file.get_content()
+        return file.filename, file.get_content()
+
+    def extract_text_from_content(self, file_content: bytes, filename: str) -> str:
+        """Extract text from already downloaded file content, file type is resolved by `filename` extension."""
+        return extract_text_from_content(file_content, filename)
+
+    async def aextract_text(self, file_url: str) -> str:
+        """
+        Async variant of `extract_text`. TXT and HTML are parsed chunk by chunk while downloading, PDF and CSV are
+        spooled to a temporary file and parsed in process pool.
+        """
+        filename = self._get_filename(file_url)
         file_extension = Path(filename).suffix.lower()
-        return self.__extract_text(file_content, file_extension, filename)
-
-    def __extract_text(self, file_content: bytes, file_extension: str, filename: str) -> str:
-        """Extract text content based on file type."""
-        # Wrap in `try-except` block:
-        # try:
-        #   1. if `file_extension` is '.txt' then return `file_content.decode('utf-8', errors='ignore')`
-        #   2. if `file_extension` is '.pdf' then:
-        #       - load it with `io.BytesIO(file_content)`
-        #       - with pdfplumber.open PDF files bites
-        #       - iterate through created pages adn create array with extracted page text
-        #       - return it joined with `\n`
-        #   3. if `file_extension` is '.csv' then:
-        #       - decode `file_content` with encoding 'utf-8' and errors='ignore'
-        #       - create csv buffer from `io.StringIO(decoded_text_content)`
-        #       - read csv with pandas (pd) as dataframe
-        #       - return dataframe to markdown (index=False)
-        #   4. if `file_extension` is in ['.html', '.htm'] then:
-        #       - decode `file_content` with encoding 'utf-8' and errors='ignore'
-        #       - create BeautifulSoup with decoded html content, features set as 'html.parser' as `soup`
-        #       - remove script and style elements: iterate through `soup(["script", "style"])` and `decompose` those scripts
-        #       - return `soup.get_text(separator='\n', strip=True)`
-        #   5. otherwise return it as decoded `file_content` with encoding 'utf-8' and errors='ignore'
-        # except:
-        #   print an error and return empty string
+        if file_extension in _WHOLE_FILE_EXTENSIONS:
+            async with self.adownload_to_file(file_url) as downloaded:
+                return await self.aextract_text_from_file(downloaded)
+
+        parser = _HtmlTextParser() if file_extension in _HTML_EXTENSIONS else _PlainTextParser()
+        # Download and parsing are interleaved, so they are traced with one span
+        with span("file.download_parse", extension=file_extension):
+            async for chunk in self.aiter_content(file_url):
+                parser.feed(chunk)
+            return parser.close()
+
+    async def aget_etag(self, file_url: str) -> Optional[str]:
+        """Get file ETag from DIAL metadata, it changes whenever file content changes."""
+        metadata = await self.async_dial_client.files.get_metadata(file_url)
+        return metadata.etag
+
+    async def aextract_text_prefix(self, file_url: str, min_chars: int) -> TextPrefix:
+        """
+        Extract at least `min_chars` characters from the beginning of the document. PDF pages are extracted one by
+        one and extraction stops as soon as enough text is collected, other formats are extracted completely.
+        """
+        if not self.is_pdf(file_url):
+            text = await self.aextract_text(file_url)
+            return TextPrefix(text=text, complete=True, estimated_length=len(text))
+
+        async with self.adownload_to_file(file_url) as downloaded:
+            return await self.aextract_pdf_text_prefix(downloaded, min_chars)
+
+    async def aextract_pdf_text_prefix(self, downloaded: DownloadedFile, min_chars: int,
+                                       start_page: int = 0) -> TextPrefix:
+        """Extract at least `min_chars` characters of downloaded PDF text starting from `start_page` (0-based)"""
+        return await get_process_executor().run(extract_pdf_text_prefix, downloaded.path, min_chars, start_page)
+
+    def is_pdf(self, file_url: str) -> bool:
+        return Path(self._get_filename(file_url)).suffix.lower() == '.pdf'
+
+    async def aiter_content(self, file_url: str) -> AsyncIterator[bytes]:
+        """
+        Stream file content by chunks. Number of simultaneous downloads per process is limited by
+        `MAX_CONCURRENT_DOWNLOADS` and file size by `MAX_FILE_SIZE_BYTES`.
+        """
+        # aidial_client reads the whole response body before returning it, so AsyncDial only resolves file URL and
+        # the body is streamed with shared httpx client directly
+        filename = self._get_filename(file_url)
+        absolute_url = self.async_dial_client.files.get_storage_resource(file_url).absolute_url
+
+        async with _get_download_semaphore():
+            client = get_dial_client_registry().async_http_client(self.endpoint)
+            async with client.stream(
+                    "GET", absolute_url, headers={"api-key": self.api_key}, timeout=_DOWNLOAD_TIMEOUT
+            ) as response:
+                response.raise_for_status()
+                content_length = int(response.headers.get("content-length", 0))
+                if content_length > MAX_FILE_SIZE_BYTES:
+                    raise FileTooLargeError(
+                        f"File {filename} has {content_length} bytes, max allowed size is {MAX_FILE_SIZE_BYTES} bytes"
+                    )
+                received = 0
+                async for chunk in response.aiter_bytes(_DOWNLOAD_CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > MAX_FILE_SIZE_BYTES:
+                        raise FileTooLargeError(
+                            f"File {filename} exceeds max allowed size of {MAX_FILE_SIZE_BYTES} bytes"
+                        )
+                    yield chunk
+
+    @asynccontextmanager
+    async def adownload_to_file(self, file_url: str) -> AsyncIterator[DownloadedFile]:
+        """Stream file into a temporary file computing its SHA-256 on the fly. Temporary file is removed on exit."""
+        downloaded = await self.adownload(file_url)
+        try:
+            yield downloaded
+        finally:
+            downloaded.path.unlink(missing_ok=True)
+
+    async def adownload(self, file_url: str) -> DownloadedFile:
+        """Same as `adownload_to_file`, but the caller owns the temporary file and must remove it"""
+        filename = self._get_filename(file_url)
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(suffix=Path(filename).suffix, delete=False) as tmp_file:
+            path = Path(tmp_file.name)
+        try:
+            with span("file.download") as download_span, open(path, "wb") as f:
+                async for chunk in self.aiter_content(file_url):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+                download_span.set_attribute("size_bytes", size)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+        return DownloadedFile(filename=filename, path=path, size=size, sha256=digest.hexdigest())
+
+    async def aextract_text_from_file(self, downloaded: DownloadedFile) -> str:
+        """
+        Extract text from downloaded file in process pool, the worker reads file content from disk itself.
+        PDF pages are split into batches extracted by several workers in parallel.
+        """
+        return (await self.aextract_document_from_file(downloaded)).text
+
+    async def aextract_document_from_file(self, downloaded: DownloadedFile) -> ExtractedText:
+        """Same as `aextract_text_from_file`, PDF text also comes with offsets of its pages."""
+        with span("file.parse", extension=Path(downloaded.filename).suffix.lower(), size_bytes=downloaded.size):
+            if Path(downloaded.filename).suffix.lower() == '.pdf':
+                pages = await self._aextract_pdf_pages(downloaded)
+                page_starts: list[int] = []
+                position = 0
+                for page_text in pages:
+                    page_starts.append(position)
+                    position += len(page_text) + 1
+                return ExtractedText(text='\n'.join(pages), page_starts=page_starts or None)
+            text = await get_process_executor().run(extract_text_from_file, downloaded.path, downloaded.filename)
+            return ExtractedText(text=text)
+
+    async def _aextract_pdf_pages(self, downloaded: DownloadedFile) -> list[str]:
+        process_executor = get_process_executor()
         try:
-            if file_extension == '.txt':
-                return file_content.decode(encoding='utf-8', errors='ignore')
-            elif file_extension == '.pdf':
-                pdf_file = io.BytesIO(file_content)
-                with pdfplumber.open(pdf_file) as pdf:
-                    pages_text = [page.extract_text() or '' for page in pdf.pages]
-                return '\n'.join(pages_text)
-            elif file_extension == '.csv':
-                decoded_text_content = file_content.decode(encoding='utf-8', errors='ignore')
-                csv_buffer = io.StringIO(decoded_text_content)
-                df = pd.read_csv(csv_buffer)
-                return df.to_markdown(index=False)
-            elif file_extension in ['.html', '.htm']:
-                decoded_html_content = file_content.decode(encoding='utf-8', errors='ignore')
-                soup = BeautifulSoup(decoded_html_content, features='html.parser')
-                for script_or_style in soup(["script", "style"]):
-                    script_or_style.decompose()
-                return soup.get_text(separator='\n', strip=True)
-            else:
-                return file_content.decode('utf-8', errors='ignore')
+            total_pages = await process_executor.run(count_pdf_pages, downloaded.path)
+            batch_size = max(_PDF_PAGES_PER_TASK, math.ceil(total_pages / PROCESS_EXECUTOR_WORKERS))
+            batches = await asyncio.gather(*[
+                process_executor.run(extract_pdf_pages_text, downloaded.path, start, start + batch_size)
+                for start in range(0, total_pages, batch_size)
+            ])
         except Exception as e:
-            print(f"Error extracting text from {filename}: {e}")
-            return ""
+            _log.warning("file.extract_failed", file=downloaded.filename, error=repr(e))
+            return []
+        return [page_text for batch in batches for page_text in batch]
+
+    def _get_filename(self, file_url: str) -> str:
+        filename = self.async_dial_client.files.get_storage_resource(file_url).filename
+        if filename is None:
+            raise InvalidDialURLError("URL points to a directory, not a file")
+        return filename
+
+
+class _PlainTextParser:
+    """Decodes utf-8 text chunk by chunk, characters split between chunks are handled by incremental decoder."""
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self._parts: list[str] = []
+
+    def feed(self, chunk: bytes) -> None:
+        self._parts.append(self._decoder.decode(chunk))
+
+    def close(self) -> str:
+        self._parts.append(self._decoder.decode(b'', final=True))
+        return ''.join(self._parts)
+
+
+class _HtmlTextParser(HTMLParser):
+    """
+    Incremental equivalent of `BeautifulSoup(...).get_text(separator='\n', strip=True)` with script and style
+    elements removed.
+    """
+
+    _SKIPPED_TAGS = ("script", "style")
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self._texts: list[str] = []
+        self._pending: list[str] = []
+        self._skip_depth = 0
+
+    def feed(self, chunk: bytes) -> None:
+        super().feed(self._decoder.decode(chunk))
+
+    def close(self) -> str:
+        super().feed(self._decoder.decode(b'', final=True))
+        super().close()
+        self._flush()
+        return '\n'.join(self._texts)
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in self._SKIPPED_TAGS:
+            self._skip_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush()
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in self._SKIPPED_TAGS and self._skip_depth > 0:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        # Text node comes in several pieces when it is split between downloaded chunks
+        self._pending.append(data)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def _flush(self) -> None:
+        if self._pending:
+            text = ''.join(self._pending).strip()
+            self._pending.clear()
+            if text and self._skip_depth == 0:
+                self._texts.append(text)
+
+
+def extract_text_from_file(path: Path, filename: str) -> str:
+    """Extract text from file on local disk. It is module level function to be picklable for process pool."""
+    return extract_text_from_content(path.read_bytes(), filename)
+
+
+def iter_pdf_pages_text(pdf_file: str | Path | io.BytesIO, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+    """Lazily yield text of PDF pages one by one, each page is released right after its text is extracted."""
+    import pdfplumber
+    with pdfplumber.open(pdf_file) as pdf:
+        for page in pdf.pages[start:end]:
+            text = page.extract_text() or ''
+            page.close()
+            yield text
+
+
+def count_pdf_pages(path: Path) -> int:
+    import pdfplumber
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_pdf_pages_text(path: Path, start: int, end: int) -> list[str]:
+    """Extract text of PDF pages in [start, end) range. Runs in process pool."""
+    return list(iter_pdf_pages_text(path, start, end))
+
+
+def extract_pdf_text_prefix(path: Path, min_chars: int, start_page: int = 0) -> TextPrefix:
+    """
+    Extract PDF pages from `start_page` until collected text is longer than `min_chars`. Text collected from the
+    first page is a prefix of full document text, text collected from a later page continues text of previous pages
+    after '\n' separator. Total length is estimated by average length of extracted pages. Runs in process pool.
+    """
+    try:
+        total_pages = count_pdf_pages(path)
+        pages_text: list[str] = []
+        length = 0
+        for page_text in iter_pdf_pages_text(path, start_page):
+            pages_text.append(page_text)
+            length += len(page_text) + 1
+            if length > min_chars:
+                break
+    except Exception as e:
+        _log.warning("file.extract_failed", file=str(path), error=repr(e))
+        return TextPrefix(text="", complete=True, estimated_length=0)
+
+    text = '\n'.join(pages_text)
+    pages = start_page + len(pages_text)
+    complete = pages >= total_pages
+    estimated_length = len(text) if complete or not pages_text else len(text) * total_pages // len(pages_text)
+    return TextPrefix(text=text, complete=complete, estimated_length=estimated_length, pages=pages,
+                      total_pages=total_pages)
+
+
+def extract_text_from_content(file_content: bytes, filename: str) -> str:
+    """
+    Extract text from file content, file type is resolved by `filename` extension.
+    It is module level function to be picklable for process pool.
+    """
+    file_extension = Path(filename).suffix.lower()
+    return _extract_text(file_content, file_extension, filename)
+
+
+def _extract_text(file_content: bytes, file_extension: str, filename: str) -> str:
+    """Extract text content based on file type."""
+    # Wrap in `try-except` block:
+    # try:
+    #   1. if `file_extension` is '.txt' then return `file_content.decode('utf-8', errors='ignore')`
+    #   2. if `file_extension` is '.pdf' then:
+    #       - load it with `io.BytesIO(file_content)`
+    #       - with pdfplumber.open PDF files bites
+    #       - iterate through created pages adn create array with extracted page text
+    #       - return it joined with `\n`
+    #   3. if `file_extension` is '.csv' then:
+    #       - decode `file_content` with encoding 'utf-8' and errors='ignore'
+    #       - create csv buffer from `io.StringIO(decoded_text_content)`
+    #       - read csv with pandas (pd) as dataframe
+    #       - return dataframe to markdown (index=False)
+    #   4. if `file_extension` is in ['.html', '.htm'] then:
+    #       - decode `file_content` with encoding 'utf-8' and errors='ignore'
+    #       - create BeautifulSoup with decoded html content, features set as 'html.parser' as `soup`
+    #       - remove script and style elements: iterate through `soup(["script", "style"])` and `decompose` those scripts
+    #       - return `soup.get_text(separator='\n', strip=True)`
+    #   5. otherwise return it as decoded `file_content` with encoding 'utf-8' and errors='ignore'
+    # except:
+    #   print an error and return empty string
+    try:
+        if file_extension == '.txt':
+            return file_content.decode(encoding='utf-8', errors='ignore')
+        elif file_extension == '.pdf':
+            return '\n'.join(iter_pdf_pages_text(io.BytesIO(file_content)))
+        elif file_extension == '.csv':
+            decoded_text_content = file_content.decode(encoding='utf-8', errors='ignore')
+            csv_buffer = io.StringIO(decoded_text_content)
+            import pandas as pd
+            df = pd.read_csv(csv_buffer)
+            return df.to_markdown(index=False)
+        elif file_extension in ['.html', '.htm']:
+            decoded_html_content = file_content.decode(encoding='utf-8', errors='ignore')
+            soup = BeautifulSoup(decoded_html_content, features='html.parser')
+            for script_or_style in soup(["script", "style"]):
+                script_or_style.decompose()
+            return soup.get_text(separator='\n', strip=True)
+        else:
+            return file_content.decode('utf-8', errors='ignore')
+    except Exception as e:
+        _log.warning("file.extract_failed", file=filename, error=repr(e))
+        return ""
@@ -0,0 +1,106 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+THREAD_EXECUTOR_WORKERS = int(os.getenv('THREAD_EXECUTOR_WORKERS', 8))
+THREAD_EXECUTOR_MAX_PENDING = int(os.getenv('THREAD_EXECUTOR_MAX_PENDING', 64))
+PROCESS_EXECUTOR_WORKERS = int(os.getenv('PROCESS_EXECUTOR_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+PROCESS_EXECUTOR_MAX_PENDING = int(os.getenv('PROCESS_EXECUTOR_MAX_PENDING', 16))
+# How long a caller waits for a free slot before the call is rejected
+EXECUTOR_ACQUIRE_TIMEOUT = float(os.getenv('EXECUTOR_ACQUIRE_TIMEOUT', 30))
+
+
+class ExecutorOverloadedError(Exception):
+    """Raised when executor queue stays full longer than acquire timeout."""
+
+
+class BoundedExecutor:
+    """
+    Runs blocking callables outside of the event loop with a limit on tasks in flight (running + queued).
+    When the limit is reached callers wait for a free slot (backpressure) and fail after `acquire_timeout`.
+    """
+
+    def __init__(self, name: str, executor: Executor, max_pending: int, acquire_timeout: Optional[float] = None):
+        self.name = name
+        self._executor = executor
+        self._max_pending = max_pending
+        self._acquire_timeout = acquire_timeout
+        self._semaphore = asyncio.Semaphore(max_pending)
+        self._in_flight = 0
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run `fn(*args, **kwargs)` in the executor and await its result."""
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self._acquire_timeout)
+        except asyncio.TimeoutError:
+            raise ExecutorOverloadedError(
+                f"{self.name} executor is overloaded: {self._max_pending} tasks are already in flight"
+            )
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    @property
+    def in_flight(self) -> int:
+        """Number of tasks running or queued in the executor."""
+        return self._in_flight
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_thread_executor: Optional[BoundedExecutor] = None
+_process_executor: Optional[BoundedExecutor] = None
+
+
+def get_thread_executor() -> BoundedExecutor:
+    """
+    Thread pool for blocking I/O (sync clients, disk) and native code that releases the GIL (FAISS, torch).
+    """
+    global _thread_executor
+    if _thread_executor is None:
+        _thread_executor = BoundedExecutor(
+            name="thread",
+            executor=ThreadPoolExecutor(max_workers=THREAD_EXECUTOR_WORKERS, thread_name_prefix="blocking"),
+            max_pending=THREAD_EXECUTOR_MAX_PENDING,
+            acquire_timeout=EXECUTOR_ACQUIRE_TIMEOUT,
+        )
+    return _thread_executor
+
+
+def get_process_executor() -> BoundedExecutor:
+    """
+    Process pool for CPU-bound pure Python work (file parsing). Callables and arguments must be picklable.
+    """
+    global _process_executor
+    if _process_executor is None:
+        _process_executor = BoundedExecutor(
+            name="process",
+            # `spawn` since forking process with running threads (torch, FAISS, pools) may deadlock
+            executor=ProcessPoolExecutor(
+                max_workers=PROCESS_EXECUTOR_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            ),
+            max_pending=PROCESS_EXECUTOR_MAX_PENDING,
+            acquire_timeout=EXECUTOR_ACQUIRE_TIMEOUT,
+        )
+    return _process_executor
+
+
+def shutdown_executors() -> None:
+    """Shutdown created executors. Called on application shutdown."""
+    global _thread_executor, _process_executor
+    for executor in (_thread_executor, _process_executor):
+        if executor:
+            executor.shutdown()
+    _thread_executor = None
+    _process_executor = None
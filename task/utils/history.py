@@ -1,12 +1,31 @@
-import copy
-from typing import Any
+import json
+from typing import Any, Optional
 
 from aidial_sdk.chat_completion import Message, Role
 
 from task.utils.constants import TOOL_CALL_HISTORY_KEY, CUSTOM_CONTENT
+from task.utils.tokens import count_tokens
 
+# Approximate overhead of message structure (role, separators) in tokens
+_MESSAGE_OVERHEAD_TOKENS = 4
+_SUMMARY_ARGUMENTS_CHARS = 150
+_SUMMARY_RESULT_CHARS = 300
 
-def unpack_messages(messages: list[Message], state_history: list[dict[str, Any]]) -> list[dict[str, Any]]:
+
+def unpack_messages(
+        messages: list[Message],
+        state_history: list[dict[str, Any]],
+        token_budget: Optional[int] = None,
+) -> list[dict[str, Any]]:
+    """
+    Unpack request messages into LLM messages, tool call history stored in assistant messages state is put before
+    each assistant message.
+
+    Args:
+        messages: Request messages
+        state_history: Tool call history of current request
+        token_budget: If set, history is windowed to fit into it (see `window_messages`)
+    """
     result: list[dict[str, Any]] = []
     for message in messages:
         if message.role == Role.ASSISTANT:
@@ -28,9 +47,8 @@ def unpack_messages(messages: list[Message], state_history: list[dict[str, Any]]
                             else:
                                 result.append(history_msg)
 
-                    msg = copy.deepcopy(message)
-                    msg.custom_content = None
-                    result.append(msg.dict(exclude_none=True))
+            # Custom content (state, attachments) is not sent to LLM, it is excluded instead of copying the message
+            result.append(message.dict(exclude_none=True, exclude={CUSTOM_CONTENT}))
         else:
             attachments_urls_content = ''
             if message.custom_content and message.custom_content.attachments:
@@ -54,8 +72,112 @@ def unpack_messages(messages: list[Message], state_history: list[dict[str, Any]]
 
     if state_history:
         for history_msg in state_history:
-            if history_msg.get(CUSTOM_CONTENT):
-                del history_msg[CUSTOM_CONTENT]
+            if CUSTOM_CONTENT in history_msg:
+                history_msg = {key: value for key, value in history_msg.items() if key != CUSTOM_CONTENT}
             result.append(history_msg)
 
+    if token_budget is not None:
+        result = window_messages(result, token_budget)
     return result
+
+
+def window_messages(messages: list[dict[str, Any]], token_budget: int) -> list[dict[str, Any]]:
+    """
+    Fit conversation history into token budget.
+
+    History is split into turns (user message and everything that follows it). The last turn is always kept as is,
+    since it contains current user request and its unresolved tool calls. Older turns are added from the newest one
+    while they fit into budget, tool exchanges (assistant tool calls with their tool messages) of turns that don't
+    fit are collapsed into compact summaries, turns that don't fit even collapsed are dropped with all older ones.
+    Tool calls are never separated from their results.
+    """
+    turns = _split_turns(messages)
+    if not turns:
+        return messages
+
+    kept: list[list[dict[str, Any]]] = [turns[-1]]
+    used = _count_tokens(turns[-1])
+    for turn in reversed(turns[:-1]):
+        turn_tokens = _count_tokens(turn)
+        if used + turn_tokens > token_budget:
+            turn = _collapse_tool_exchanges(turn)
+            turn_tokens = _count_tokens(turn)
+            if used + turn_tokens > token_budget:
+                break
+        kept.append(turn)
+        used += turn_tokens
+
+    return [message for turn in reversed(kept) for message in turn]
+
+
+def _split_turns(messages: list[dict[str, Any]]) -> list[list[dict[str, Any]]]:
+    turns: list[list[dict[str, Any]]] = []
+    for message in messages:
+        if _role(message) == Role.USER.value or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _collapse_tool_exchanges(turn: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Replace assistant messages with tool calls and their tool messages by one assistant message with summary."""
+    collapsed: list[dict[str, Any]] = []
+    summaries: list[str] = []
+    tool_calls: dict[str, dict[str, Any]] = {}
+    for message in turn:
+        role = _role(message)
+        if role == Role.ASSISTANT.value and message.get("tool_calls"):
+            if message.get("content"):
+                summaries.append(message["content"])
+            for tool_call in message["tool_calls"]:
+                tool_calls[tool_call.get("id")] = tool_call
+        elif role == Role.TOOL.value:
+            tool_call = tool_calls.get(message.get("tool_call_id"), {})
+            function = tool_call.get("function", {})
+            summaries.append(
+                f"- `{function.get('name', message.get('name', 'tool'))}`"
+                f"({_shorten(function.get('arguments', ''), _SUMMARY_ARGUMENTS_CHARS)}) -> "
+                f"{_shorten(message.get('content') or '', _SUMMARY_RESULT_CHARS)}"
+            )
+        else:
+            if summaries and role == Role.ASSISTANT.value:
+                # Summary is merged into the final assistant message, so assistant messages don't go in a row
+                message = {**message, "content": f"{_summary(summaries)}\n\n{message.get('content') or ''}"}
+            elif summaries:
+                collapsed.append({"role": Role.ASSISTANT.value, "content": _summary(summaries)})
+            summaries = []
+            collapsed.append(message)
+    if summaries:
+        collapsed.append({"role": Role.ASSISTANT.value, "content": _summary(summaries)})
+    return collapsed
+
+
+def _summary(summaries: list[str]) -> str:
+    return "[Summary of earlier tool calls]\n" + "\n".join(summaries)
+
+
+def _shorten(text: Any, max_chars: int) -> str:
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False)
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars] + "..."
+
+
+def _role(message: dict[str, Any]) -> str:
+    role = message.get("role")
+    return role.value if isinstance(role, Role) else role
+
+
+def _count_tokens(messages: list[dict[str, Any]]) -> int:
+    tokens = 0
+    for message in messages:
+        tokens += _MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += count_tokens(content)
+        elif content:
+            tokens += count_tokens(json.dumps(content, ensure_ascii=False))
+        for tool_call in message.get("tool_calls") or []:
+            function = tool_call.get("function", {})
+            tokens += count_tokens(function.get("name", "")) + count_tokens(function.get("arguments", ""))
+    return tokens
@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import random
+import sys
+from typing import Any, Callable
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Share of sampled events (e.g. per LLM round, per tool call) that are emitted, 1.0 emits all of them
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 1.0))
+# `json` (one object per line) or `text` (`event key=value ...`)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+
+# Modules log with `get_logger(__name__)`, so all their loggers are children of `task`
+_ROOT_LOGGER_NAME = 'task'
+_configured = False
+
+
+class Lazy:
+    """
+    Log field value that is computed only if the event is actually emitted, e.g. `Lazy(lambda: json.dumps(history))`
+    """
+
+    __slots__ = ('_factory',)
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+
+    def __call__(self) -> Any:
+        return self._factory()
+
+
+class _StructuredFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields: dict[str, Any] = getattr(record, 'fields', {})
+        if LOG_FORMAT == 'text':
+            values = ' '.join(f"{key}={value}" for key, value in fields.items())
+            return f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()} {values}".rstrip()
+        return json.dumps(
+            {
+                'ts': self.formatTime(record),
+                'level': record.levelname,
+                'logger': record.name,
+                'event': record.getMessage(),
+                **fields,
+            },
+            ensure_ascii=False,
+            default=str,
+        )
+
+
+class StructuredLogger:
+    """
+    Logger of structured events: `logger.info("mcp.call_tool", tool=name, duration_ms=12.5)`.
+    Fields wrapped into `Lazy` are evaluated only when the event passes level and sampling checks, so expensive
+    payloads (full history, tool results) cost nothing unless debug is enabled.
+    """
+
+    def __init__(self, name: str):
+        if name != _ROOT_LOGGER_NAME and not name.startswith(f"{_ROOT_LOGGER_NAME}."):
+            name = f"{_ROOT_LOGGER_NAME}.{name}"
+        self._logger = logging.getLogger(name)
+
+    def is_enabled_for(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    @property
+    def debug_enabled(self) -> bool:
+        return self._logger.isEnabledFor(logging.DEBUG)
+
+    def debug(self, event: str, sampled: bool = False, **fields: Any) -> None:
+        self._log(logging.DEBUG, event, sampled, fields)
+
+    def info(self, event: str, sampled: bool = False, **fields: Any) -> None:
+        self._log(logging.INFO, event, sampled, fields)
+
+    def warning(self, event: str, sampled: bool = False, **fields: Any) -> None:
+        self._log(logging.WARNING, event, sampled, fields)
+
+    def error(self, event: str, sampled: bool = False, **fields: Any) -> None:
+        self._log(logging.ERROR, event, sampled, fields)
+
+    def _log(self, level: int, event: str, sampled: bool, fields: dict[str, Any]) -> None:
+        if not self._logger.isEnabledFor(level):
+            return
+        if sampled and LOG_SAMPLE_RATE < 1.0 and random.random() >= LOG_SAMPLE_RATE:
+            return
+        resolved = {key: value() if isinstance(value, Lazy) else value for key, value in fields.items()}
+        self._logger.log(level, event, extra={'fields': resolved})
+
+
+def _configure() -> None:
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    root = logging.getLogger(_ROOT_LOGGER_NAME)
+    root.setLevel(LOG_LEVEL)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_StructuredFormatter())
+    root.addHandler(handler)
+    root.propagate = False
+
+
+def get_logger(name: str) -> StructuredLogger:
+    _configure()
+    return StructuredLogger(name)
+
+
+def messages_summary(messages: list[dict[str, Any]]) -> dict[str, Any]:
+    """Cheap summary of LLM messages: count per role and total content length"""
+    roles: dict[str, int] = {}
+    content_chars = 0
+    for message in messages:
+        role = message.get('role')
+        role = getattr(role, 'value', role)
+        roles[role] = roles.get(role, 0) + 1
+        content = message.get('content')
+        if isinstance(content, str):
+            content_chars += len(content)
+    return {'messages': len(messages), 'roles': roles, 'content_chars': content_chars}
+
+
+def payload_size(payload: Any) -> int:
+    """Length of payload without serializing it when possible"""
+    if isinstance(payload, (str, bytes)):
+        return len(payload)
+    # MCP content: text, or base64 data of images and blobs
+    for attribute in ('text', 'data', 'blob'):
+        value = getattr(payload, attribute, None)
+        if isinstance(value, (str, bytes)):
+            return len(value)
+    return len(str(payload))
@@ -2,6 +2,10 @@ from typing import Optional
 
 from aidial_sdk.chat_completion import Choice, Stage
 
+from task.utils.logger import get_logger
+
+_log = get_logger(__name__)
+
 
 class StageProcessor:
 
@@ -16,4 +20,4 @@ class StageProcessor:
         try:
             stage.close()
         except Exception as e:
-            print("⚠️ Unable to close stage. ", e)
+            _log.warning("stage.close_failed", error=repr(e))
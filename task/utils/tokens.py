@@ -0,0 +1,31 @@
+from functools import lru_cache
+from typing import Any, Callable
+
+# Average number of characters per token for English text and code in BPE tokenizers of GPT/Claude models
+_CHARS_PER_TOKEN = 4
+_TIKTOKEN_ENCODING = 'o200k_base'
+
+
+@lru_cache(maxsize=1)
+def _get_encoder() -> Callable[[str], Any] | None:
+    # tiktoken is not required, without it tokens are estimated by text length
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding(_TIKTOKEN_ENCODING).encode_ordinary
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text with tiktoken if it is installed, otherwise estimate them by text length."""
+    if not text:
+        return 0
+    encode = _get_encoder()
+    if encode is None:
+        return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+    return len(encode(text))
+
+
+def tokens_to_chars(tokens: int) -> int:
+    """Approximate number of characters that fit into `tokens`."""
+    return tokens * _CHARS_PER_TOKEN
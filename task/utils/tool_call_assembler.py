@@ -0,0 +1,127 @@
+import json
+from typing import Any, Optional
+
+from aidial_client.types.chat.legacy.chat_completion import ToolCall
+
+from task.utils.logger import get_logger
+
+_log = get_logger(__name__)
+
+
+class _ToolCallBuffer:
+    __slots__ = ('index', 'id', 'name', 'argument_parts')
+
+    def __init__(self, index: int):
+        self.index = index
+        self.id: Optional[str] = None
+        self.name: Optional[str] = None
+        self.argument_parts: list[str] = []
+
+    def arguments(self) -> str:
+        return ''.join(self.argument_parts)
+
+
+class ToolCallAssembler:
+    """
+    Assembles streamed tool call deltas into complete tool calls.
+
+    Deltas are grouped by their own `index` (several parallel tool calls are streamed with different indexes within
+    one choice), argument fragments are collected into a list and joined once the tool call is complete.
+    A tool call is complete as soon as its arguments are a valid JSON object, so it can be dispatched while the model
+    is still streaming next tool calls. A JSON object can't be continued, but if a model still streams more
+    non-whitespace fragments for a dispatched tool call it is reopened and completed again with the new arguments,
+    its previous dispatch must be discarded by the caller.
+    """
+
+    def __init__(self):
+        self._buffers: dict[int, _ToolCallBuffer] = {}
+        self._completed: dict[int, ToolCall] = {}
+
+    def add(self, tool_call_delta: Any) -> list[ToolCall]:
+        """
+        Add tool call delta.
+
+        Args:
+            tool_call_delta: Streamed tool call delta with `index`, optional `id` and `function` fragments
+
+        Returns:
+            Tool calls completed by this delta
+        """
+        index = tool_call_delta.index if tool_call_delta.index is not None else len(self._buffers)
+        buffer = self._buffers.get(index)
+        if buffer is None:
+            buffer = self._buffers[index] = _ToolCallBuffer(index)
+        if tool_call_delta.id:
+            buffer.id = tool_call_delta.id
+        function = tool_call_delta.function
+        if function and function.name:
+            buffer.name = function.name
+        fragment = function.arguments if function else None
+        if not fragment:
+            return []
+
+        buffer.argument_parts.append(fragment)
+        if index in self._completed:
+            if not fragment.strip():
+                return []
+            _log.warning("tool_call.reopened", index=index, tool_call_id=buffer.id, tool=buffer.name)
+            del self._completed[index]
+        # Parsing is attempted only when fragment may close JSON object, not on every fragment
+        if buffer.name and fragment.rstrip().endswith('}') and _parse_json_object(buffer.arguments()) is not None:
+            return self._complete(index)
+        return []
+
+    def finish(self) -> list[ToolCall]:
+        """Complete all remaining tool calls when the stream is over."""
+        completed: list[ToolCall] = []
+        for index in sorted(self._buffers):
+            completed.extend(self._complete(index))
+        return completed
+
+    @property
+    def tool_calls(self) -> list[ToolCall]:
+        """Completed tool calls ordered by index."""
+        return [self._completed[index] for index in sorted(self._completed)]
+
+    def _complete(self, index: int) -> list[ToolCall]:
+        if index in self._completed:
+            return []
+        buffer = self._buffers[index]
+        tool_call = ToolCall.validate(
+            {
+                "index": buffer.index,
+                "id": buffer.id or f"call_{buffer.index}",
+                "type": "function",
+                "function": {
+                    "name": buffer.name or "",
+                    # Some models stream no arguments for tools without parameters
+                    "arguments": buffer.arguments() or "{}",
+                },
+            }
+        )
+        self._completed[index] = tool_call
+        return [tool_call]
+
+
+def parse_arguments(tool_call: ToolCall) -> tuple[dict[str, Any] | None, str | None]:
+    """
+    Validate tool call arguments JSON.
+
+    Returns:
+        Tuple of (arguments, None) if arguments are valid JSON object, (None, error) otherwise
+    """
+    try:
+        arguments = json.loads(tool_call.function.arguments)
+    except json.JSONDecodeError as e:
+        return None, f"Invalid JSON in arguments of `{tool_call.function.name}`: {e}"
+    if not isinstance(arguments, dict):
+        return None, f"Arguments of `{tool_call.function.name}` must be JSON object"
+    return arguments, None
+
+
+def _parse_json_object(arguments: str) -> dict[str, Any] | None:
+    try:
+        parsed = json.loads(arguments)
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
@@ -0,0 +1,124 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from task.utils.tokens import count_tokens, tokens_to_chars
+
+# Store is in memory of the process, so `result_id` can't be fetched after restart or from another replica
+TOOL_RESULT_STORE_MAX_BYTES = int(os.getenv('TOOL_RESULT_STORE_MAX_BYTES', 256 * 1024 * 1024))
+TOOL_RESULT_STORE_TTL_SECONDS = int(os.getenv('TOOL_RESULT_STORE_TTL_SECONDS', 24 * 3600))
+# Budget of tool result that is put into conversation history, tokens
+TOOL_RESULT_DEFAULT_TOKEN_BUDGET = int(os.getenv('TOOL_RESULT_DEFAULT_TOKEN_BUDGET', 4000))
+# Per-tool budgets, comma separated `tool_name:tokens`, e.g. `fetch_content:2000,execute_code:3000`. 0 disables budget
+TOOL_RESULT_TOKEN_BUDGETS = os.getenv('TOOL_RESULT_TOKEN_BUDGETS', '')
+# Share of budget kept from the beginning of result, the rest is kept from its end
+_HEAD_SHARE = 0.7
+
+_store: Optional['ToolResultStore'] = None
+_budgets: Optional[dict[str, int]] = None
+
+
+@dataclass
+class _StoredResult:
+    content: str
+    timestamp: datetime
+    size: int
+
+
+class ToolResultStore:
+    """
+    Thread-safe LRU store of full tool results that were truncated before they were put into conversation history.
+    Results are keyed by conversation, so they can be fetched back only within the same conversation. Results of
+    requests without conversation id are not stored, otherwise all such requests would share them. Results are local
+    to the process, they are lost on restart and are not visible to other replicas.
+    """
+
+    def __init__(self, max_bytes: int = TOOL_RESULT_STORE_MAX_BYTES,
+                 ttl: timedelta = timedelta(seconds=TOOL_RESULT_STORE_TTL_SECONDS)):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._results: OrderedDict[Tuple[str, str], _StoredResult] = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, conversation_id: str, content: str) -> str | None:
+        """Store result and return its id, None if result is not stored (no conversation id or it is too large)."""
+        if not conversation_id:
+            return None
+        size = len(content.encode('utf-8'))
+        if size > self.max_bytes:
+            return None
+        result_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._results[(conversation_id, result_id)] = _StoredResult(content, datetime.now(), size)
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes:
+                _, evicted = self._results.popitem(last=False)
+                self._current_bytes -= evicted.size
+        return result_id
+
+    def get(self, conversation_id: str, result_id: str) -> str | None:
+        """Return stored result or None if it is absent or expired."""
+        if not conversation_id:
+            return None
+        key = (conversation_id, result_id)
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                return None
+            if datetime.now() - result.timestamp >= self.ttl:
+                self._current_bytes -= result.size
+                del self._results[key]
+                return None
+            self._results.move_to_end(key)
+            return result.content
+
+    def size(self) -> int:
+        """Return the number of stored results."""
+        with self._lock:
+            return len(self._results)
+
+
+def get_tool_result_store() -> ToolResultStore:
+    global _store
+    if _store is None:
+        _store = ToolResultStore()
+    return _store
+
+
+def get_token_budget(tool_name: str) -> int | None:
+    """Return token budget of tool result, None if results of the tool are not limited."""
+    global _budgets
+    if _budgets is None:
+        _budgets = {}
+        for item in TOOL_RESULT_TOKEN_BUDGETS.split(','):
+            name, _, tokens = item.strip().partition(':')
+            if name and tokens:
+                _budgets[name.strip()] = int(tokens)
+    budget = _budgets.get(tool_name, TOOL_RESULT_DEFAULT_TOKEN_BUDGET)
+    return budget if budget > 0 else None
+
+
+def truncate_head_tail(content: str, max_tokens: int, placeholder: str) -> str:
+    """
+    Keep beginning and end of content that fit into `max_tokens` and replace the middle with placeholder.
+    Lines are not cut in the middle when possible.
+    """
+    max_chars = max(0, tokens_to_chars(max_tokens) - len(placeholder))
+    if len(content) <= max_chars and count_tokens(content) <= max_tokens:
+        return content
+    head_chars = int(max_chars * _HEAD_SHARE)
+    tail_chars = max_chars - head_chars
+    head = content[:head_chars]
+    tail = content[len(content) - tail_chars:] if tail_chars else ''
+    head_cut = head.rfind('\n')
+    if head_cut > head_chars // 2:
+        head = head[:head_cut + 1]
+    tail_cut = tail.find('\n')
+    if 0 <= tail_cut < tail_chars // 2:
+        tail = tail[tail_cut + 1:]
+    return f"{head}\n{placeholder}\n{tail}"
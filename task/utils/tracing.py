@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Iterator, Optional
+
+# Number of finished spans kept by in-process exporter
+TRACING_MAX_SPANS = int(os.getenv('TRACING_MAX_SPANS', 10_000))
+# Upper bounds of span duration histogram buckets, seconds
+_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_METRIC_NAME = 'agent_span_duration_seconds'
+_ERRORS_METRIC_NAME = 'agent_span_errors_total'
+_OTEL_TRACER_NAME = 'task'
+
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+_exporter: Optional['InMemorySpanExporter'] = None
+_metrics: Optional['SpanMetrics'] = None
+
+
+@dataclass
+class Span:
+    """
+    Span of an operation: agent iteration, LLM completion, tool call, RAG phase. Ids and fields follow OpenTelemetry
+    naming, spans are also mirrored to OpenTelemetry tracer when `opentelemetry-api` is installed.
+    """
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_time: float
+    attributes: dict[str, Any] = field(default_factory=dict)
+    duration_seconds: Optional[float] = None
+    error: Optional[str] = None
+    _otel_span: Any = field(default=None, repr=False)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+        if self._otel_span is not None:
+            self._otel_span.set_attribute(key, _otel_value(value))
+
+    def set_error(self, error: BaseException | str) -> None:
+        self.error = error if isinstance(error, str) else repr(error)
+
+    @property
+    def is_error(self) -> bool:
+        return self.error is not None
+
+
+class InMemorySpanExporter:
+    """Keeps last finished spans in memory, so they can be inspected by tests and benchmarks"""
+
+    def __init__(self, max_spans: int = TRACING_MAX_SPANS):
+        self._spans: deque[Span] = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+
+    def get_finished_spans(self, name: Optional[str] = None) -> list[Span]:
+        with self._lock:
+            return [span for span in self._spans if name is None or span.name == name]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans.clear()
+
+
+class SpanMetrics:
+    """Prometheus histograms of span durations and counters of failed spans, labeled by span name"""
+
+    def __init__(self, buckets: tuple[float, ...] = _DURATION_BUCKETS):
+        self.buckets = buckets
+        # span name -> (non-cumulative bucket counts with +Inf as the last one, sum, count)
+        self._histograms: dict[str, tuple[list[int], float, int]] = {}
+        self._errors: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, span: Span) -> None:
+        with self._lock:
+            counts, total, count = self._histograms.get(span.name) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[bisect_left(self.buckets, span.duration_seconds)] += 1
+            self._histograms[span.name] = (counts, total + span.duration_seconds, count + 1)
+            if span.is_error:
+                self._errors[span.name] = self._errors.get(span.name, 0) + 1
+
+    def render(self) -> str:
+        """Render metrics in Prometheus text exposition format"""
+        lines = [
+            f"# HELP {_METRIC_NAME} Duration of agent operations",
+            f"# TYPE {_METRIC_NAME} histogram",
+        ]
+        with self._lock:
+            histograms = {name: (list(counts), total, count) for name, (counts, total, count) in
+                          self._histograms.items()}
+            errors = dict(self._errors)
+        for name in sorted(histograms):
+            counts, total, count = histograms[name]
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                lines.append(f'{_METRIC_NAME}_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{_METRIC_NAME}_sum{{span="{name}"}} {total}')
+            lines.append(f'{_METRIC_NAME}_count{{span="{name}"}} {count}')
+        lines.append(f"# HELP {_ERRORS_METRIC_NAME} Number of failed agent operations")
+        lines.append(f"# TYPE {_ERRORS_METRIC_NAME} counter")
+        for name in sorted(errors):
+            lines.append(f'{_ERRORS_METRIC_NAME}{{span="{name}"}} {errors[name]}')
+        return "\n".join(lines) + "\n"
+
+
+def get_span_exporter() -> InMemorySpanExporter:
+    global _exporter
+    if _exporter is None:
+        _exporter = InMemorySpanExporter()
+    return _exporter
+
+
+def get_span_metrics() -> SpanMetrics:
+    global _metrics
+    if _metrics is None:
+        _metrics = SpanMetrics()
+    return _metrics
+
+
+def get_current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Trace operation inside `with` block. Spans started inside the block (in the same task or in tasks created in it)
+    become its children. Exception raised from the block marks span as failed and is re-raised.
+    """
+    current = _start_span(name, time.time(), attributes)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish_span(current, time.perf_counter() - started)
+
+
+def record_span(name: str, started: float, **attributes: Any) -> Span:
+    """
+    Record span that started at `started` (`time.perf_counter()`) and ends now, e.g. time to first token that is not
+    bound to a code block
+    """
+    duration = time.perf_counter() - started
+    finished = _start_span(name, time.time() - duration, attributes)
+    _finish_span(finished, duration)
+    return finished
+
+
+def _start_span(name: str, start_time: float, attributes: dict[str, Any]) -> Span:
+    parent = _current_span.get()
+    new_span = Span(
+        name=name,
+        trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=parent.span_id if parent else None,
+        start_time=start_time,
+        attributes=dict(attributes),
+    )
+    tracer = _get_otel_tracer()
+    if tracer is not None:
+        otel_context = _otel_context(parent)
+        new_span._otel_span = tracer.start_span(
+            name,
+            context=otel_context,
+            attributes={key: _otel_value(value) for key, value in attributes.items()},
+            start_time=int(start_time * 1e9),
+        )
+    return new_span
+
+
+def _finish_span(finished: Span, duration: float) -> None:
+    finished.duration_seconds = duration
+    if finished._otel_span is not None:
+        if finished.is_error:
+            from opentelemetry.trace import Status, StatusCode
+            finished._otel_span.set_status(Status(StatusCode.ERROR, finished.error))
+        finished._otel_span.end(end_time=int((finished.start_time + duration) * 1e9))
+    get_span_exporter().export(finished)
+    get_span_metrics().observe(finished)
+
+
+@lru_cache(maxsize=1)
+def _get_otel_tracer() -> Any:
+    # OpenTelemetry is not required, without it spans are only exported in-process and to metrics.
+    # Without configured SDK tracer provider OpenTelemetry spans are no-op
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    return trace.get_tracer(_OTEL_TRACER_NAME)
+
+
+def _otel_context(parent: Optional[Span]) -> Any:
+    if parent is None or parent._otel_span is None:
+        return None
+    from opentelemetry import trace
+    return trace.set_span_in_context(parent._otel_span)
+
+
+def _otel_value(value: Any) -> Any:
+    return value if isinstance(value, (str, bool, int, float)) else str(value)
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Any
+
+from aidial_sdk.chat_completion import Message, Role
+
+from task import agent as agent_module
+from task.agent import BUDGET_EXHAUSTED_MESSAGE, GeneralPurposeAgent
+from task.tools.base import BaseTool
+from task.tools.models import ToolCallParams
+
+
+class _SlowTool(BaseTool):
+    def __init__(self):
+        self.cancelled = False
+
+    @property
+    def name(self) -> str:
+        return "slow"
+
+    @property
+    def description(self) -> str:
+        return "Takes a long time"
+
+    @property
+    def parameters(self) -> dict[str, Any]:
+        return {"type": "object", "properties": {}}
+
+    async def _execute(self, tool_call_params: ToolCallParams) -> str:
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return "done"
+
+
+class _FakeStage:
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def append_content(self, content: str) -> None:
+        pass
+
+
+class _FakeChoice:
+    def __init__(self):
+        self.content = ''
+        self.state = None
+
+    def append_content(self, content: str) -> None:
+        self.content += content
+
+    def create_stage(self, name: str) -> _FakeStage:
+        return _FakeStage()
+
+
+class _FakeCompletions:
+    """Model answers every completion with a call of `slow` tool only"""
+
+    def __init__(self):
+        self.calls: list[dict[str, Any]] = []
+
+    async def create(self, **kwargs: Any):
+        self.calls.append(kwargs)
+        return self._stream(len(self.calls))
+
+    @staticmethod
+    async def _stream(number: int):
+        tool_call = SimpleNamespace(
+            index=0, id=f"call_{number}", function=SimpleNamespace(name="slow", arguments="{}")
+        )
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None, tool_calls=[tool_call]))])
+
+
+def test_round_is_cut_by_time_budget_and_budget_exhausted_message_is_returned(monkeypatch):
+    completions = _FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(agent_module, "get_async_dial_client", lambda *args, **kwargs: client)
+    tool = _SlowTool()
+    agent = GeneralPurposeAgent(endpoint="http://dial", system_prompt="You are helpful", tools=[tool],
+                                max_duration_seconds=0.5)
+    request = SimpleNamespace(api_key="api-key", api_version=None, headers={"x-conversation-id": "conversation"},
+                              messages=[Message(role=Role.USER, content="Run the slow tool")])
+    choice = _FakeChoice()
+
+    started = time.monotonic()
+    message = asyncio.run(agent.handle_request("gpt", choice, request, None))
+
+    assert time.monotonic() - started < 5
+    assert tool.cancelled
+    assert message.content == choice.content == BUDGET_EXHAUSTED_MESSAGE
+    assert not message.tool_calls
+    assert [call.get("tool_choice") for call in completions.calls] == [None, "none"]
+    # Cancelled round is not added to history
+    assert choice.state == {"tool_call_history": []}
@@ -0,0 +1,57 @@
+import asyncio
+
+import httpx
+import pytest
+
+from task.utils import dial_clients
+from task.utils.dial_clients import DialClientRegistry
+
+ENDPOINT = "http://dial"
+
+
+def _handler(requests: list[httpx.Request]):
+    def handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(
+            200,
+            json={"bucket": "bucket", "appdata": "bucket/appdata/agent"},
+            headers={"set-cookie": f"session={request.headers['api-key']}; Path=/"},
+        )
+    return handle
+
+
+@pytest.fixture
+def registry():
+    return DialClientRegistry(limits=httpx.Limits(max_connections=10), http2=False)
+
+
+def test_private_aidial_client_modules_are_available():
+    # DIAL clients share connection pools through private HTTP client wrappers of aidial-client, an update of
+    # aidial-client that moves them must be noticed
+    assert dial_clients._SHARED_POOL_SUPPORTED
+
+
+def test_async_clients_share_pool_but_not_cookies(registry):
+    requests: list[httpx.Request] = []
+    registry.async_http_client(ENDPOINT)._transport = httpx.MockTransport(_handler(requests))
+
+    async def call_as_alice_then_bob():
+        await registry.async_client(ENDPOINT, api_key="alice-key").my_appdata_home()
+        await registry.async_client(ENDPOINT, api_key="bob-key").my_appdata_home()
+        await registry.close()
+
+    asyncio.run(call_as_alice_then_bob())
+
+    assert [request.headers["api-key"] for request in requests] == ["alice-key", "bob-key"]
+    assert "cookie" not in requests[1].headers
+
+
+def test_sync_clients_share_pool_but_not_cookies(registry):
+    requests: list[httpx.Request] = []
+    registry.sync_http_client(ENDPOINT)._transport = httpx.MockTransport(_handler(requests))
+
+    registry.sync_client(ENDPOINT, api_key="alice-key").my_appdata_home()
+    registry.sync_client(ENDPOINT, api_key="bob-key").my_appdata_home()
+
+    assert [request.headers["api-key"] for request in requests] == ["alice-key", "bob-key"]
+    assert "cookie" not in requests[1].headers
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from task.tools.rag import document_cache
+from task.tools.rag.document_cache import DocumentCache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(document_cache, "estimate_entry_size", lambda index, chunks: 1)
+    return DocumentCache(max_bytes=2)
+
+
+def test_contains_does_not_change_stats_or_lru_order(cache):
+    cache.set("first", "index-1", "chunks-1")
+    cache.set("second", "index-2", "chunks-2")
+
+    assert "first" in cache
+    assert "missing" not in cache
+    stats = cache.stats()
+    assert (stats.hits, stats.misses) == (0, 0)
+
+    # `first` is still the least recently used entry, so it is evicted by the next one
+    cache.set("third", "index-3", "chunks-3")
+    assert "first" not in cache
+    assert "second" in cache
+
+
+def test_contains_skips_expired_entries(cache):
+    cache.set("old", "index", "chunks")
+    cache._cache["old"].timestamp = datetime.now() - timedelta(hours=25)
+    cache._spilled["spilled"] = datetime.now() - timedelta(hours=25)
+    cache._spilled["fresh"] = datetime.now()
+
+    assert "old" not in cache
+    assert "spilled" not in cache
+    assert "fresh" in cache
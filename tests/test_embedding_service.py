@@ -0,0 +1,153 @@
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import numpy as np
+import pytest
+
+from task.tools.rag.embedding_service import EmbeddingService
+
+_TIMEOUT = 5
+
+
+class _FakeModel:
+    """Embeds text `"<n>"` as `[n]` and records encoded batches, encoding is held while `gate` is not set"""
+
+    def __init__(self):
+        self.batches: list[list[str]] = []
+        self.encoding = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        self.batches.append(list(texts))
+        self.encoding.set()
+        assert self.gate.wait(_TIMEOUT)
+        if "boom" in texts:
+            raise ValueError("boom")
+        return np.array([[float(text)] for text in texts])
+
+    def hold(self) -> None:
+        self.gate.clear()
+        self.encoding.clear()
+
+    def wait_encoding(self) -> None:
+        assert self.encoding.wait(_TIMEOUT)
+
+
+@pytest.fixture
+def model():
+    return _FakeModel()
+
+
+@pytest.fixture
+def service(model):
+    service = EmbeddingService(lambda: model, max_batch_size=4, max_wait_seconds=0)
+    yield service
+    model.gate.set()
+    service.close()
+
+
+def _texts(start: int, stop: int) -> list[str]:
+    return [str(number) for number in range(start, stop)]
+
+
+def _start_closing(service: EmbeddingService) -> threading.Thread:
+    closing = threading.Thread(target=service.close)
+    closing.start()
+    # Queue is drained under the lock of the service, so it is acquired once the service is marked closed
+    while not service._closed:
+        time.sleep(0.001)
+    with service._lock:
+        return closing
+
+
+def test_large_request_is_sliced_and_query_is_encoded_between_slices(service, model):
+    model.hold()
+    document = service.submit(_texts(0, 10))
+    model.wait_encoding()
+    query = service.submit(["100"])
+    model.gate.set()
+
+    document_embeddings = document.result(_TIMEOUT)
+    query_embeddings = query.result(_TIMEOUT)
+
+    assert model.batches == [_texts(0, 4), ["100"], _texts(4, 8), _texts(8, 10)]
+    assert document_embeddings.dtype == np.float32
+    assert document_embeddings[:, 0].tolist() == list(range(10))
+    assert query_embeddings.tolist() == [[100.0]]
+
+
+def test_requests_queued_meanwhile_share_one_batch(service, model):
+    model.hold()
+    first = service.submit(["0"])
+    model.wait_encoding()
+    queued = [service.submit([str(number)]) for number in range(1, 4)]
+    model.gate.set()
+
+    assert first.result(_TIMEOUT).tolist() == [[0.0]]
+    assert [future.result(_TIMEOUT).tolist() for future in queued] == [[[1.0]], [[2.0]], [[3.0]]]
+    assert model.batches == [["0"], ["1", "2", "3"]]
+
+
+def test_cancelled_sliced_request_is_not_encoded_further(service, model):
+    model.hold()
+    document = service.submit(_texts(0, 10))
+    model.wait_encoding()
+    # Future of a sliced request stays pending between slices, so the caller can cancel it
+    assert document.cancel()
+    model.gate.set()
+
+    assert service.submit(["100"]).result(_TIMEOUT).tolist() == [[100.0]]
+    assert model.batches == [_texts(0, 4), ["100"]]
+
+
+def test_encode_error_fails_requests_of_the_batch(service, model):
+    model.hold()
+    blocker = service.submit(["0"])
+    model.wait_encoding()
+    failed = service.submit(["1", "boom"])
+    sliced = service.submit(["2", "3", "4", "5", "boom", "6"])
+    model.gate.set()
+
+    assert blocker.result(_TIMEOUT).tolist() == [[0.0]]
+    with pytest.raises(ValueError, match="boom"):
+        failed.result(_TIMEOUT)
+    # Sliced request fails on its second slice
+    with pytest.raises(ValueError, match="boom"):
+        sliced.result(_TIMEOUT)
+    # Worker keeps serving requests after a failed batch
+    assert service.submit(["7"]).result(_TIMEOUT).tolist() == [[7.0]]
+
+
+def test_close_cancels_queued_requests(service, model):
+    model.hold()
+    encoding = service.submit(["0"])
+    model.wait_encoding()
+    document = service.submit(_texts(1, 10))
+    query = service.submit(["100"])
+    closing = _start_closing(service)
+    # Request being encoded is completed, requests queued before close are cancelled
+    model.gate.set()
+    closing.join(_TIMEOUT)
+
+    assert encoding.result(_TIMEOUT).tolist() == [[0.0]]
+    for future in (document, query):
+        with pytest.raises(CancelledError):
+            future.result(_TIMEOUT)
+    assert model.batches == [["0"]]
+    with pytest.raises(RuntimeError):
+        service.submit(["1"])
+
+
+def test_close_cancels_remaining_slices(service, model):
+    model.hold()
+    document = service.submit(_texts(0, 10))
+    model.wait_encoding()
+    closing = _start_closing(service)
+    model.gate.set()
+    closing.join(_TIMEOUT)
+
+    with pytest.raises(CancelledError):
+        document.result(_TIMEOUT)
+    assert model.batches == [_texts(0, 4)]
@@ -0,0 +1,102 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from task.tools.files import file_content_extraction_tool
+from task.tools.files.extracted_text_cache import ExtractedTextCache
+from task.tools.files.file_content_extraction_tool import FileContentExtractionTool, _PAGE_SIZE
+from task.utils import dial_file_conent_extractor
+from task.utils.dial_file_conent_extractor import DownloadedFile, extract_pdf_text_prefix
+
+PDF_PAGES = [f"pdf page {number} " * 200 for number in range(30)]
+FULL_TEXT = '\n'.join(PDF_PAGES)
+
+
+class _FakeExtractor:
+    """DIAL file extractor with one PDF, the PDF is "parsed" in the calling process from `PDF_PAGES`"""
+    downloads: list[Path] = []
+    parsed_pages: list[int] = []
+
+    def __init__(self, endpoint: str, api_key: str):
+        pass
+
+    async def aget_etag(self, file_url: str) -> str:
+        return "etag"
+
+    def is_pdf(self, file_url: str) -> bool:
+        return True
+
+    async def adownload(self, file_url: str) -> DownloadedFile:
+        await asyncio.sleep(0.01)
+        path = self.tmp_path / f"download-{len(self.downloads)}.pdf"
+        path.write_bytes(b"%PDF")
+        self.downloads.append(path)
+        return DownloadedFile(filename="document.pdf", path=path, size=4, sha256="")
+
+    async def aextract_pdf_text_prefix(self, downloaded: DownloadedFile, min_chars: int, start_page: int = 0):
+        return extract_pdf_text_prefix(downloaded.path, min_chars, start_page)
+
+
+def _iter_pdf_pages_text(pdf_file, start=0, end=None):
+    for number, page_text in enumerate(PDF_PAGES[start:end], start=start):
+        _FakeExtractor.parsed_pages.append(number)
+        yield page_text
+
+
+@pytest.fixture
+def tool(monkeypatch, tmp_path):
+    monkeypatch.setattr(_FakeExtractor, "tmp_path", tmp_path, raising=False)
+    monkeypatch.setattr(_FakeExtractor, "downloads", [])
+    monkeypatch.setattr(_FakeExtractor, "parsed_pages", [])
+    monkeypatch.setattr(file_content_extraction_tool, "DialFileContentExtractor", _FakeExtractor)
+    monkeypatch.setattr(dial_file_conent_extractor, "iter_pdf_pages_text", _iter_pdf_pages_text)
+    monkeypatch.setattr(dial_file_conent_extractor, "count_pdf_pages", lambda path: len(PDF_PAGES))
+    return FileContentExtractionTool(endpoint="http://dial", text_cache=ExtractedTextCache())
+
+
+def test_pages_in_order_download_and_parse_pdf_once(tool):
+    total_pages = (len(FULL_TEXT) + _PAGE_SIZE - 1) // _PAGE_SIZE
+
+    async def read_all_pages() -> list[str]:
+        pages = []
+        for page in range(1, total_pages + 1):
+            extracted_text = await tool._get_extracted_text("files/bucket/document.pdf", "api-key", page)
+            pages.append(extracted_text.page(page))
+        return pages
+
+    pages = asyncio.run(read_all_pages())
+
+    assert ''.join(pages) == FULL_TEXT
+    assert len(_FakeExtractor.downloads) == 1
+    assert _FakeExtractor.parsed_pages == list(range(len(PDF_PAGES)))
+    # Downloaded file is removed as soon as the whole text is extracted
+    assert not _FakeExtractor.downloads[0].exists()
+
+
+def test_close_removes_kept_download(tool):
+    extracted_text = asyncio.run(tool._get_extracted_text("files/bucket/document.pdf", "api-key", 1))
+
+    assert not extracted_text.complete
+    assert _FakeExtractor.downloads[0].exists()
+    asyncio.run(tool.close())
+    assert not _FakeExtractor.downloads[0].exists()
+
+
+def test_concurrent_reads_download_pdf_once(tool):
+    async def read_concurrently() -> list[str]:
+        texts = await asyncio.gather(
+            tool._get_extracted_text("files/bucket/document.pdf", "api-key", 1),
+            tool._get_extracted_text("files/bucket/document.pdf", "api-key", 1),
+            tool._get_extracted_text("files/bucket/document.pdf", "api-key", 3),
+        )
+        await tool.close()
+        return [texts[0].page(1), texts[1].page(1), texts[2].page(3)]
+
+    pages = asyncio.run(read_concurrently())
+
+    assert pages[0] == pages[1] == FULL_TEXT[:_PAGE_SIZE]
+    assert pages[2] == FULL_TEXT[2 * _PAGE_SIZE:3 * _PAGE_SIZE]
+    assert len(_FakeExtractor.downloads) == 1
+    assert not tool._pdf_locks
+    assert not any(path.exists() for path in _FakeExtractor.downloads)
@@ -0,0 +1,92 @@
+import asyncio
+import multiprocessing
+import socket
+import time
+
+import pytest
+import uvicorn
+
+from benchmarks.fake_mcp_servers import MCPLatency, create_search_server
+from task.tools.mcp.mcp_client_pool import MCPClientPool
+
+_HOST = '127.0.0.1'
+
+
+def _serve_search(port: int, search_latency: float) -> None:
+    uvicorn.run(create_search_server(MCPLatency(search=search_latency)), host=_HOST, port=port, log_level='warning')
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((_HOST, 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(port: int, search_latency: float) -> multiprocessing.Process:
+    process = multiprocessing.get_context('spawn').Process(target=_serve_search, args=(port, search_latency),
+                                                           daemon=True)
+    process.start()
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((_HOST, port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("MCP server didn't start")
+
+
+@pytest.fixture
+def search_server():
+    port = _free_port()
+    process = _start_server(port, search_latency=60)
+    yield port, process
+    process.kill()
+    process.join()
+
+
+def test_call_fails_when_server_is_killed_mid_call(search_server):
+    port, process = search_server
+
+    async def call_and_kill() -> float:
+        pool = await MCPClientPool.create(f"http://{_HOST}:{port}/mcp", size=2, health_check_interval=0)
+        try:
+            call = asyncio.create_task(pool.call_tool("search", {"query": "microwave"}, idempotent=True))
+            await asyncio.sleep(1)
+            process.kill()
+            started = time.monotonic()
+            # Both sessions are connected to the killed server, so the retry fails too
+            with pytest.raises(ConnectionError):
+                await asyncio.wait_for(call, timeout=30)
+            return time.monotonic() - started
+        finally:
+            await pool.close()
+
+    assert asyncio.run(call_and_kill()) < 30
+
+
+def test_pool_reconnects_after_server_restart(search_server):
+    port, process = search_server
+
+    async def call_after_restart() -> str:
+        pool = await MCPClientPool.create(f"http://{_HOST}:{port}/mcp", size=1, health_check_interval=0)
+        restarted = None
+        try:
+            call = asyncio.create_task(pool.call_tool("search", {"query": "microwave"}, idempotent=True))
+            await asyncio.sleep(1)
+            process.kill()
+            with pytest.raises(ConnectionError):
+                await asyncio.wait_for(call, timeout=30)
+            restarted = await asyncio.to_thread(_start_server, port, 0)
+            deadline = time.monotonic() + 30
+            while not pool.connected_sessions and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            return await asyncio.wait_for(pool.call_tool("search", {"query": "microwave"}, idempotent=True), 30)
+        finally:
+            await pool.close()
+            if restarted:
+                restarted.kill()
+                restarted.join()
+
+    assert "microwave" in asyncio.run(call_after_restart())
@@ -0,0 +1,32 @@
+import json
+
+from task.tools.py_interpreter._response import _ExecutionResult
+from task.tools.py_interpreter.python_code_interpreter_tool import PythonCodeInterpreterTool
+from task.utils.tokens import count_tokens
+
+PLACEHOLDER = "[... Result is truncated, use `fetch_tool_result` tool to read it ...]"
+# Compaction doesn't use MCP client and session manager, so the tool is not connected to an interpreter server
+TOOL = object.__new__(PythonCodeInterpreterTool)
+
+
+def test_large_result_is_compacted_to_valid_json():
+    execution_result = _ExecutionResult(
+        success=False,
+        output=[f"row {number} " * 300 for number in range(50)],
+        error="ValueError: " + "x" * 5000,
+        traceback=["  File \"<stdin>\", line 1\n"] * 40,
+    )
+
+    compacted = TOOL._compact_result(execution_result.model_dump_json(), 1000, PLACEHOLDER)
+
+    assert count_tokens(compacted) <= 1000
+    compacted_result = json.loads(compacted)
+    assert compacted_result["truncated"] == PLACEHOLDER
+    assert compacted_result["success"] is False
+    assert compacted_result["output"][0].startswith("row 0 ")
+    assert compacted_result["output"][-1].startswith("row 49 ")
+    assert compacted_result["error"].startswith("ValueError: ")
+
+
+def test_not_json_result_is_left_to_head_tail_truncation():
+    assert TOOL._compact_result("plain text " * 1000, 100, PLACEHOLDER) is None
@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+from task.tools.py_interpreter import session_manager
+from task.tools.py_interpreter.session_manager import InterpreterSessionManager
+
+
+class _FakeInterpreter:
+    """Creates session `"1"` on the first call, warm-up code fails in it until `healthy` is set"""
+
+    def __init__(self):
+        self.calls: list[dict] = []
+        self.healthy = False
+
+    async def call_tool(self, tool_name: str, tool_args: dict) -> str:
+        self.calls.append(tool_args)
+        return json.dumps({
+            "success": self.healthy,
+            "error": None if self.healthy else "ModuleNotFoundError: No module named 'pandas'",
+            "session_info": {"session_id": tool_args.get("session_id", "1")},
+        })
+
+
+def test_session_of_failed_warm_up_is_reused_by_next_refill(monkeypatch):
+    monkeypatch.setattr(session_manager, "_WARM_UP_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(session_manager, "_WARM_UP_RETRY_DELAY_SECONDS", 0)
+    interpreter = _FakeInterpreter()
+    manager = InterpreterSessionManager(interpreter, "execute_code", warm_sessions=1, session_ttl_seconds=60)
+
+    async def warm_up() -> None:
+        # Counted as `_refill` does before it starts warm-up task
+        manager._warming += 1
+        await manager._warm_up()
+
+    async def warm_up_twice() -> None:
+        await warm_up()
+        assert manager.warm_count == 0
+        interpreter.healthy = True
+        await warm_up()
+
+    asyncio.run(warm_up_twice())
+
+    assert [call.get("session_id") for call in interpreter.calls] == [None, "1", "1"]
+    assert manager.acquire("conversation") == "1"
@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+from typing import Optional
+
+from task.utils.tool_call_assembler import ToolCallAssembler, parse_arguments
+
+
+def _delta(index: Optional[int], arguments: Optional[str] = None, name: Optional[str] = None,
+           tool_call_id: Optional[str] = None) -> SimpleNamespace:
+    return SimpleNamespace(index=index, id=tool_call_id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+def _stream(assembler: ToolCallAssembler, deltas: list[SimpleNamespace]) -> list[tuple[str, str]]:
+    """Add deltas and return (id, arguments) of tool calls in order they were dispatched"""
+    dispatched = []
+    for delta in deltas:
+        dispatched.extend(assembler.add(delta))
+    dispatched.extend(assembler.finish())
+    return [(tool_call.id, tool_call.function.arguments) for tool_call in dispatched]
+
+
+def test_interleaved_tool_calls_are_dispatched_as_soon_as_complete():
+    assembler = ToolCallAssembler()
+
+    dispatched = _stream(assembler, [
+        _delta(0, name="search", tool_call_id="call_search"),
+        _delta(1, name="fetch", tool_call_id="call_fetch"),
+        _delta(0, '{"query": '),
+        _delta(1, '{"url": "https://example.com"'),
+        _delta(1, '}'),
+        _delta(0, '"microwave"}'),
+    ])
+
+    assert dispatched == [
+        ("call_fetch", '{"url": "https://example.com"}'),
+        ("call_search", '{"query": "microwave"}'),
+    ]
+    assert [tool_call.id for tool_call in assembler.tool_calls] == ["call_search", "call_fetch"]
+
+
+def test_closing_brace_inside_string_does_not_complete_tool_call():
+    assembler = ToolCallAssembler()
+
+    dispatched = []
+    for delta in [
+        _delta(0, name="execute_code", tool_call_id="call_code"),
+        _delta(0, '{"code": "d = {'),
+        _delta(0, '}'),
+        _delta(0, '"}'),
+    ]:
+        dispatched.append([tool_call.id for tool_call in assembler.add(delta)])
+
+    assert dispatched == [[], [], [], ["call_code"]]
+    assert assembler.tool_calls[0].function.arguments == '{"code": "d = {}"}'
+    assert assembler.finish() == []
+
+
+def test_tool_call_continued_after_dispatch_is_reopened():
+    assembler = ToolCallAssembler()
+
+    first = assembler.add(_delta(0, '{"query": "a"}', name="search", tool_call_id="call_search"))
+    # Whitespace after complete JSON object doesn't reopen tool call
+    assert assembler.add(_delta(0, '\n')) == []
+    assert assembler.tool_calls == first
+    assert assembler.add(_delta(0, '{"query": "b"}')) == []
+    assert assembler.tool_calls == []
+
+    reopened = assembler.finish()
+
+    assert [tool_call.id for tool_call in first] == [tool_call.id for tool_call in reopened] == ["call_search"]
+    assert reopened[0].function.arguments == '{"query": "a"}\n{"query": "b"}'
+    assert assembler.tool_calls == reopened
+    arguments, error = parse_arguments(reopened[0])
+    assert arguments is None
+    assert error.startswith("Invalid JSON in arguments of `search`")
+
+
+def test_arguments_that_never_parse_are_dispatched_when_stream_is_over():
+    assembler = ToolCallAssembler()
+
+    dispatched = _stream(assembler, [
+        _delta(0, '{"query": "microwave"', name="search", tool_call_id="call_search"),
+        _delta(1, '["not", "object"]', name="fetch", tool_call_id="call_fetch"),
+        _delta(2, name="list_files", tool_call_id="call_list"),
+    ])
+
+    assert dispatched == [
+        ("call_search", '{"query": "microwave"'),
+        ("call_fetch", '["not", "object"]'),
+        ("call_list", '{}'),
+    ]
+    errors = [parse_arguments(tool_call)[1] for tool_call in assembler.tool_calls]
+    assert errors[0].startswith("Invalid JSON in arguments of `search`")
+    assert errors[1] == "Arguments of `fetch` must be JSON object"
+    assert errors[2] is None
+
+
+def test_deltas_without_index_and_id_get_their_own_tool_calls():
+    assembler = ToolCallAssembler()
+
+    dispatched = _stream(assembler, [
+        _delta(None, '{"query": "a"}', name="search"),
+        _delta(None, '{"query": "b"}', name="search"),
+    ])
+
+    assert dispatched == [("call_0", '{"query": "a"}'), ("call_1", '{"query": "b"}')]